@@ -0,0 +1,143 @@
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+from benchmarks.load import run_load_test
+from benchmarks.pipeline import compare, load, run_benchmarks, save
+from benchmarks.stand_in_server import FaultConfig, JmaStandInServer
+
+app = typer.Typer(help="取得→変換→保存のパイプラインのベンチマーク")
+
+
+@app.command()
+def run(
+    days: int = typer.Option(30, help="合成するページの日数"),
+    repeat: int = typer.Option(3, help="各段階を計測する回数. 最短の時間を使う"),
+    out: Path = typer.Option(Path("benchmarks/current.json"), help="結果のJSON"),
+    baseline: Optional[Path] = typer.Option(None, help="指定した場合は計測後にこのベースラインと比較する"),
+    max_slowdown: float = typer.Option(0.2, help="許容するスループットの低下率"),
+    max_memory_growth: float = typer.Option(0.2, help="許容するピークメモリの増加率"),
+) -> None:
+    results = run_benchmarks(days=days, repeat=repeat)
+    save(results, out)
+    for name, stage in results["stages"].items():
+        typer.echo(
+            f"{name:<24}{stage['per_sec']:>12.1f} pages/s{stage['peak_bytes'] / 1e6:>10.1f} MB"
+        )
+    if baseline is not None:
+        _compare(baseline, out, max_slowdown, max_memory_growth)
+
+
+@app.command("compare")
+def compare_command(
+    baseline: Path,
+    current: Path,
+    max_slowdown: float = typer.Option(0.2, help="許容するスループットの低下率"),
+    max_memory_growth: float = typer.Option(0.2, help="許容するピークメモリの増加率"),
+) -> None:
+    _compare(baseline, current, max_slowdown, max_memory_growth)
+
+
+def _compare(
+    baseline: Path, current: Path, max_slowdown: float, max_memory_growth: float
+) -> None:
+    regressions = compare(
+        load(baseline), load(current), max_slowdown, max_memory_growth
+    )
+    for regression in regressions:
+        typer.echo(regression, err=True)
+    if regressions:
+        raise typer.Exit(code=1)
+    typer.echo("No regressions")
+
+
+def _fault_config(
+    latency_median_ms: float,
+    latency_sigma: float,
+    error_rate: float,
+    timeout_rate: float,
+    wrong_content_type_rate: float,
+    rate_limit_per_sec: Optional[float],
+) -> FaultConfig:
+    return FaultConfig(
+        latency_median_ms=latency_median_ms,
+        latency_sigma=latency_sigma,
+        error_rate=error_rate,
+        timeout_rate=timeout_rate,
+        wrong_content_type_rate=wrong_content_type_rate,
+        rate_limit_per_sec=rate_limit_per_sec,
+    )
+
+
+@app.command()
+def serve(
+    port: int = typer.Option(8080),
+    latency_median_ms: float = typer.Option(0.0, help="遅延の中央値"),
+    latency_sigma: float = typer.Option(0.0, help="遅延の対数正規分布の sigma"),
+    error_rate: float = typer.Option(0.0, help="503 を返す確率"),
+    timeout_rate: float = typer.Option(0.0, help="応答を timeout_sec 遅らせる確率"),
+    wrong_content_type_rate: float = typer.Option(0.0, help="text/plain で返す確率"),
+    rate_limit_per_sec: Optional[float] = typer.Option(None, help="超えると 429"),
+) -> None:
+    """気象庁のスタンドインのサーバーを起動する. Ctrl-C で止める"""
+    faults = _fault_config(
+        latency_median_ms,
+        latency_sigma,
+        error_rate,
+        timeout_rate,
+        wrong_content_type_rate,
+        rate_limit_per_sec,
+    )
+    server = JmaStandInServer(faults, port=port)
+    typer.echo(f"Serving JMA stand-in on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+@app.command("load")
+def load_command(
+    days: int = typer.Option(30, help="取得する日数"),
+    concurrency: int = typer.Option(8),
+    base_url: Optional[str] = typer.Option(
+        None, help="既に起動しているサーバー. 省略した場合はプロセス内で起動する"
+    ),
+    time_out_sec: float = typer.Option(2.0),
+    latency_median_ms: float = typer.Option(50.0, help="遅延の中央値"),
+    latency_sigma: float = typer.Option(0.5, help="遅延の対数正規分布の sigma"),
+    error_rate: float = typer.Option(0.0, help="503 を返す確率"),
+    timeout_rate: float = typer.Option(0.0, help="応答を timeout_sec 遅らせる確率"),
+    wrong_content_type_rate: float = typer.Option(0.0, help="text/plain で返す確率"),
+    rate_limit_per_sec: Optional[float] = typer.Option(None, help="超えると 429"),
+) -> None:
+    """スタンドインのサーバーに backfill を向けてスループットと遅延の分布を測る"""
+    kwargs = {"days": days, "concurrency": concurrency, "time_out_sec": time_out_sec}
+    if base_url is not None:
+        report = run_load_test(base_url, **kwargs)
+    else:
+        faults = _fault_config(
+            latency_median_ms,
+            latency_sigma,
+            error_rate,
+            timeout_rate,
+            wrong_content_type_rate,
+            rate_limit_per_sec,
+        )
+        with JmaStandInServer(faults) as server:
+            report = run_load_test(server.base_url, **kwargs)
+    typer.echo(
+        f"{report.requests} requests, {report.ok} ok in {report.seconds:.2f}s "
+        f"({report.per_sec:.1f} req/s)"
+    )
+    typer.echo(
+        "latency ms: "
+        + ", ".join(f"{name}={value:.1f}" for name, value in report.latency_ms.items())
+    )
+    if report.errors:
+        typer.echo(f"errors: {report.errors}")
+
+
+if __name__ == "__main__":
+    app()
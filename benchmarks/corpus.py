@@ -0,0 +1,48 @@
+"""ベンチマーク用のページ.
+
+tests/input_examples のページを元に, 日付ごとに値を変えた合成ページを作る.
+何年分でもメモリに載せずに1ページずつ生成できる.
+"""
+import random
+import re
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Iterator, Tuple
+
+INPUT_EXAMPLES_DIR = Path(__file__).parents[1] / "tests" / "input_examples"
+HAMAMATSU_HTML = INPUT_EXAMPLES_DIR / "hamamatsu_jma.html"
+
+_NUMBER_CELL = re.compile(r'(<td class="data_0_0">)(-?\d+(?:\.\d+)?)(\)?</td>)')
+_HEADING = re.compile(r"(浜松　)\d{4}年\d{1,2}月\d{1,2}日")
+
+
+def fixture_html() -> str:
+    return HAMAMATSU_HTML.read_text()
+
+
+def synthetic_page(template: str, date_: date) -> str:
+    """template の数値のセルを date_ ごとに決まる乱数でずらしたページ"""
+    rng = random.Random(date_.toordinal())
+
+    def jitter(match: "re.Match[str]") -> str:
+        value = match.group(2)
+        decimals = len(value.split(".")[1]) if "." in value else 0
+        shifted = float(value) + rng.uniform(-1.0, 1.0)
+        if decimals == 0:
+            shifted = max(shifted, 0.0)
+        return f"{match.group(1)}{shifted:.{decimals}f}{match.group(3)}"
+
+    page = _NUMBER_CELL.sub(jitter, template)
+    return _HEADING.sub(
+        lambda m: f"{m.group(1)}{date_.year}年{date_.month}月{date_.day}日", page
+    )
+
+
+def synthetic_corpus(
+    start_date: date, days: int, template: str = ""
+) -> Iterator[Tuple[date, str]]:
+    """start_date から days 日分の (日付, ページ) を順に生成する"""
+    template = template or fixture_html()
+    for i in range(days):
+        date_ = start_date + timedelta(days=i)
+        yield date_, synthetic_page(template, date_)
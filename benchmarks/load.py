@@ -0,0 +1,103 @@
+"""スタンドインのサーバーに backfill を向けてスループットと遅延の分布を測る.
+
+$ python -m benchmarks load --days 365 --concurrency 16 --latency-median-ms 80 --error-rate 0.02
+"""
+import asyncio
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+import numpy as np
+
+from jma_scraper.core.location_instances import HAMAMATSU, HAMAMATSU_10Minutes_COLUMNS
+from jma_scraper.core.repository import AsyncFetcher, Writer
+from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.infrastracture.http_client import AsyncJmaHttpClient
+from jma_scraper.usecase.backfill import BackfillTarget, PolitenessBudget, backfill
+
+
+class NullWriter(Writer):
+    """書き込みを計測に含めないための Writer"""
+
+    def write(self, src: Any, dst: Any = None) -> None:
+        pass
+
+
+class TimedFetcher:
+    """リクエストごとの所要時間と, 失敗した例外の種類を記録する AsyncFetcher"""
+
+    def __init__(self, fetcher: AsyncFetcher):
+        self.fetcher = fetcher
+        self.latencies_sec: List[float] = []
+        self.errors: Counter[str] = Counter()
+
+    async def __call__(
+        self, query_param: QueryParamsForJma, time_out_sec: float = 2.0
+    ) -> str:
+        started = time.perf_counter()
+        try:
+            return await self.fetcher(query_param, time_out_sec=time_out_sec)
+        except Exception as e:
+            self.errors[type(e).__name__] += 1
+            raise
+        finally:
+            self.latencies_sec.append(time.perf_counter() - started)
+
+
+@dataclass(eq=True, frozen=True)
+class LoadReport:
+    requests: int
+    ok: int
+    seconds: float
+    latency_ms: Dict[str, float]  # p50, p95, p99, max
+    errors: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def per_sec(self) -> float:
+        return self.requests / self.seconds if self.seconds > 0 else float("inf")
+
+
+async def load_test(
+    base_url: str,
+    days: int = 30,
+    concurrency: int = 8,
+    min_interval_sec: float = 0.0,
+    time_out_sec: float = 2.0,
+    end_date: date = date(2022, 12, 31),
+) -> LoadReport:
+    """base_url のサーバーから浜松10分ごとの days 日分を取得して変換する. 保存はしない"""
+    target = BackfillTarget(location=HAMAMATSU, columns=HAMAMATSU_10Minutes_COLUMNS)
+    async with AsyncJmaHttpClient(
+        max_connections=concurrency, base_url=base_url
+    ) as client:
+        fetcher = TimedFetcher(client)
+        started = time.perf_counter()
+        results = await backfill(
+            [target],
+            end_date - timedelta(days=days - 1),
+            end_date,
+            fetcher=fetcher,
+            writer_factory=NullWriter,
+            concurrency=concurrency,
+            budget=PolitenessBudget(min_interval_sec),
+            time_out_sec=time_out_sec,
+        )
+        seconds = time.perf_counter() - started
+
+    latencies_ms = np.array(fetcher.latencies_sec) * 1000
+    return LoadReport(
+        requests=len(fetcher.latencies_sec),
+        ok=sum(result.ok for result in results),
+        seconds=seconds,
+        latency_ms={
+            name: float(np.percentile(latencies_ms, q)) if latencies_ms.size else 0.0
+            for name, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+        },
+        errors=dict(fetcher.errors),
+    )
+
+
+def run_load_test(base_url: str, **kwargs: Any) -> LoadReport:
+    return asyncio.run(load_test(base_url, **kwargs))
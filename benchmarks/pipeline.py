@@ -0,0 +1,247 @@
+"""取得→変換→保存の各段階の処理時間とピークメモリを測る.
+
+$ python -m benchmarks run --days 60 --out benchmarks/baseline.json
+$ python -m benchmarks run --days 60 --out current.json
+$ python -m benchmarks compare benchmarks/baseline.json current.json
+
+compare はスループットの低下, ピークメモリの増加が閾値を超えると終了コード1で終わる.
+"""
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import date
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import pandas as pd
+
+from benchmarks.corpus import synthetic_corpus
+from jma_scraper.core.html_to_dataframe import (
+    flatten_columns,
+    format_columns,
+    pluck_table_from_html,
+    read_html_table,
+)
+from jma_scraper.core.location_instances import HAMAMATSU, HAMAMATSU_10Minutes_COLUMNS
+from jma_scraper.core.location_spec import LocationColumnType, RecordInterval
+from jma_scraper.core.repository import WriterSrcValues
+from jma_scraper.core.table_decoder import TEN_MINUTES_LAYOUTS, decode_table
+from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.infrastracture.localfile import DfLocalCsvWriter
+from jma_scraper.infrastracture.parquet import write_parquet_days
+
+Pages = List[Tuple[date, str]]
+
+AFTER_COLUMNS = HAMAMATSU_10Minutes_COLUMNS.after_columns
+
+
+@dataclass(eq=True, frozen=True)
+class StageResult:
+    name: str
+    items: int
+    seconds: float  # repeat 回のうち最短
+    peak_bytes: int
+
+    @property
+    def per_sec(self) -> float:
+        return self.items / self.seconds if self.seconds > 0 else float("inf")
+
+
+@dataclass(eq=True, frozen=True)
+class Stage:
+    """setup は計測に含めない. run は処理した件数を返す"""
+
+    name: str
+    setup: Callable[[Pages, Path], Any]
+    run: Callable[[Any], int]
+
+
+def _src_values(date_: date) -> WriterSrcValues:
+    return WriterSrcValues(
+        date=date_, location_name=HAMAMATSU.en_name, every_xx="every_10_minutes"
+    )
+
+
+def _formatted(pages: Pages) -> List[Tuple[date, pd.DataFrame]]:
+    return [
+        (
+            date_,
+            format_columns(
+                flatten_columns(
+                    read_html_table(pluck_table_from_html(html), pd.read_html)
+                ),
+                AFTER_COLUMNS,
+            ),
+        )
+        for date_, html in pages
+    ]
+
+
+def _run_query_params(pages: Pages) -> int:
+    for date_, _ in pages:
+        _ = QueryParamsForJma.from_location_spec(
+            HAMAMATSU, date_, RecordInterval.ten_minutes
+        ).query_url
+    return len(pages)
+
+
+def _run_pluck(pages: Pages) -> int:
+    for _, html in pages:
+        pluck_table_from_html(html)
+    return len(pages)
+
+
+def _run_read_html(tables: List[str]) -> int:
+    for table in tables:
+        read_html_table(table, pd.read_html)
+    return len(tables)
+
+
+def _run_flatten_format(dfs: List[pd.DataFrame]) -> int:
+    for df in dfs:
+        format_columns(flatten_columns(df.copy()), AFTER_COLUMNS)
+    return len(dfs)
+
+
+def _run_decode_table(pages: Pages) -> int:
+    layout = TEN_MINUTES_LAYOUTS[LocationColumnType.main]
+    for _, html in pages:
+        decode_table(html, layout).to_frame()
+    return len(pages)
+
+
+def _run_csv_writer(args: Tuple[List[Tuple[date, pd.DataFrame]], Path]) -> int:
+    frames, workdir = args
+    for date_, df in frames:
+        src_values = _src_values(date_)
+        DfLocalCsvWriter(src_values).write(
+            df, dst=workdir / f"{src_values.format()}.csv"
+        )
+    return len(frames)
+
+
+def _run_parquet_writer(args: Tuple[List[Tuple[date, pd.DataFrame]], Path]) -> int:
+    frames, workdir = args
+    write_parquet_days(
+        [(_src_values(date_), df) for date_, df in frames], root=workdir / "parquet"
+    )
+    return len(frames)
+
+
+STAGES: Tuple[Stage, ...] = (
+    Stage("query_params", lambda pages, _: pages, _run_query_params),
+    Stage("pluck_table_from_html", lambda pages, _: pages, _run_pluck),
+    Stage(
+        "read_html_table",
+        lambda pages, _: [pluck_table_from_html(html) for _, html in pages],
+        _run_read_html,
+    ),
+    Stage(
+        "flatten_format_columns",
+        lambda pages, _: [
+            read_html_table(pluck_table_from_html(html), pd.read_html)
+            for _, html in pages
+        ],
+        _run_flatten_format,
+    ),
+    Stage("decode_table", lambda pages, _: pages, _run_decode_table),
+    Stage(
+        "csv_writer",
+        lambda pages, workdir: (_formatted(pages), workdir),
+        _run_csv_writer,
+    ),
+    Stage(
+        "parquet_writer",
+        lambda pages, workdir: (_formatted(pages), workdir),
+        _run_parquet_writer,
+    ),
+)
+
+
+def measure(stage: Stage, pages: Pages, repeat: int = 3) -> StageResult:
+    """repeat 回のうち最短の時間と, tracemalloc を有効にした1回のピークメモリ"""
+    with tempfile.TemporaryDirectory() as tmp:
+        prepared = stage.setup(pages, Path(tmp))
+        timings = []
+        items = 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            items = stage.run(prepared)
+            timings.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        try:
+            stage.run(prepared)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return StageResult(
+        name=stage.name, items=items, seconds=min(timings), peak_bytes=peak_bytes
+    )
+
+
+def run_benchmarks(
+    days: int = 30,
+    repeat: int = 3,
+    start_date: date = date(2020, 1, 1),
+    stages: Tuple[Stage, ...] = STAGES,
+) -> Dict[str, Any]:
+    pages = list(synthetic_corpus(start_date, days))
+    results = [measure(stage, pages, repeat) for stage in stages]
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "pandas": pd.__version__,
+            "days": days,
+            "repeat": repeat,
+        },
+        "stages": {
+            result.name: {**asdict(result), "per_sec": result.per_sec}
+            for result in results
+        },
+    }
+
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    max_slowdown: float = 0.2,
+    max_memory_growth: float = 0.2,
+) -> List[str]:
+    """閾値を超えた退行を説明する文字列のリスト. 空なら退行なし.
+
+    >>> base = {"stages": {"pluck": {"per_sec": 100.0, "peak_bytes": 1000}}}
+    >>> compare(base, {"stages": {"pluck": {"per_sec": 90.0, "peak_bytes": 1100}}})
+    []
+    >>> compare(base, {"stages": {"pluck": {"per_sec": 50.0, "peak_bytes": 1000}}})
+    ['pluck: throughput 50.0/s is 50% below the baseline 100.0/s']
+    """
+    regressions = []
+    for name, base in baseline["stages"].items():
+        now = current["stages"].get(name)
+        if now is None:
+            regressions.append(f"{name}: missing in the current results")
+            continue
+        if now["per_sec"] < base["per_sec"] * (1 - max_slowdown):
+            drop = 1 - now["per_sec"] / base["per_sec"]
+            regressions.append(
+                f"{name}: throughput {now['per_sec']:.1f}/s is {drop:.0%} below the baseline {base['per_sec']:.1f}/s"
+            )
+        if now["peak_bytes"] > base["peak_bytes"] * (1 + max_memory_growth):
+            growth = now["peak_bytes"] / base["peak_bytes"] - 1
+            regressions.append(
+                f"{name}: peak memory {now['peak_bytes']} bytes is {growth:.0%} above the baseline {base['peak_bytes']} bytes"
+            )
+    return regressions
+
+
+def save(results: Dict[str, Any], path: Path) -> None:
+    path.write_text(json.dumps(results, indent=2, ensure_ascii=False) + "\n")
+
+
+def load(path: Path) -> Dict[str, Any]:
+    return json.loads(path.read_text())
@@ -0,0 +1,265 @@
+"""気象庁の過去の気象データのページを真似るローカルのHTTPサーバー.
+
+/obd/stats/etrn/view/{interval}_{s1|a1}.php に任意の prec_no, block_no, 日付で答える.
+10分ごと (s1) はテスト用のページを日付ごとにずらした合成ページ, それ以外は
+table_decoder のレイアウトから作った合成ページを返す.
+遅延の分布, 5xx, タイムアウト, 誤った Content-Type, レート制限を注入できる.
+
+$ python -m benchmarks serve --port 8080 --latency-median-ms 80 --error-rate 0.01
+"""
+import calendar
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.corpus import fixture_html, synthetic_page
+from jma_scraper.core.location_spec import LocationColumnType, RecordInterval
+from jma_scraper.core.table_decoder import TableLayout, layout_for
+
+_ROUTE = re.compile(
+    r"^/obd/stats/etrn/view/(?P<interval>[0-9a-z]+)_(?P<col>s1|a1)\.php$"
+)
+
+
+@dataclass(eq=True, frozen=True)
+class FaultConfig:
+    """注入する遅延と失敗. 各 rate は 0 から 1 の確率"""
+
+    latency_median_ms: float = 0.0
+    latency_sigma: float = 0.0  # 対数正規分布の sigma. 0 なら常に median
+    error_rate: float = 0.0  # 503 を返す
+    timeout_rate: float = 0.0  # timeout_sec 待ってから返す
+    timeout_sec: float = 5.0
+    wrong_content_type_rate: float = 0.0  # text/plain で返す
+    rate_limit_per_sec: Optional[float] = None  # 超えたら 429 と Retry-After
+    seed: int = 0
+
+    def latency_sec(self, rng: random.Random) -> float:
+        if self.latency_median_ms <= 0:
+            return 0.0
+        if self.latency_sigma <= 0:
+            return self.latency_median_ms / 1000
+        return (
+            rng.lognormvariate(0.0, self.latency_sigma) * self.latency_median_ms / 1000
+        )
+
+
+class _TokenBucket:
+    def __init__(self, rate_per_sec: float):
+        self.rate_per_sec = rate_per_sec
+        self.tokens = rate_per_sec
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.rate_per_sec,
+                self.tokens + (now - self.updated_at) * self.rate_per_sec,
+            )
+            self.updated_at = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def _value_cell(col: str, layout: TableLayout, rng: random.Random) -> str:
+    if col in layout.direction_columns:
+        return rng.choice(["北", "北北東", "南西", "西北西", "静穏"])
+    if col in layout.text_columns:
+        return rng.choice(["晴", "曇", "雨", "晴一時曇"])
+    return f"{rng.uniform(0, 30):.1f}"
+
+
+def _row_labels(
+    record_interval: RecordInterval, page_date: date
+) -> List[Tuple[str, ...]]:
+    if record_interval == RecordInterval.ten_minutes:
+        return [(f"{i // 6:02}:{i % 6}0",) for i in range(1, 145)]
+    if record_interval == RecordInterval.one_hour:
+        return [(str(hour),) for hour in range(1, 25)]
+    if record_interval == RecordInterval.one_day:
+        days = calendar.monthrange(page_date.year, page_date.month)[1]
+        return [(str(day),) for day in range(1, days + 1)]
+    periods = (
+        6 if record_interval == RecordInterval.five_day_divide_for_each_month else 3
+    )
+    return [
+        (str(month), str(p)) for month in range(1, 13) for p in range(1, periods + 1)
+    ]
+
+
+def synthetic_layout_page(
+    record_interval: RecordInterval, col_type: LocationColumnType, page_date: date
+) -> str:
+    """layout_for のレイアウトに合う tablefix1 を持つページ"""
+    layout = layout_for(record_interval, col_type)
+    rng = random.Random(page_date.toordinal())
+    # 元の見出しが分かっているレイアウトはその見出しにする
+    names = layout.original_columns or layout.columns
+    header = "<tr>" + "".join(f"<th>{name}</th>" for name in names) + "</tr>"
+    rows = []
+    for labels in _row_labels(record_interval, page_date):
+        cells = [f"<td>{label}</td>" for label in labels]
+        cells += [
+            f'<td class="data_0_0">{_value_cell(col, layout, rng)}</td>'
+            for col in layout.value_columns
+        ]
+        rows.append("<tr>" + "".join(cells) + "</tr>")
+    return (
+        '<html><body><table id="tablefix1" class="data2_s">'
+        + header
+        + "".join(rows)
+        + "</table></body></html>"
+    )
+
+
+@lru_cache(maxsize=1)
+def _fixture() -> str:
+    return fixture_html()
+
+
+def render_page(
+    record_interval: RecordInterval, col_type: LocationColumnType, page_date: date
+) -> str:
+    if (
+        record_interval == RecordInterval.ten_minutes
+        and col_type == LocationColumnType.main
+    ):
+        return synthetic_page(_fixture(), page_date)
+    return synthetic_layout_page(record_interval, col_type, page_date)
+
+
+class JmaStandInServer(ThreadingHTTPServer):
+    """別スレッドで動かす場合は start() と stop(), またはコンテキストマネージャで使う.
+
+    >>> with JmaStandInServer(FaultConfig(latency_median_ms=50)) as server:  # doctest: +SKIP
+    ...     client = AsyncJmaHttpClient(base_url=server.base_url)
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        faults: FaultConfig = FaultConfig(),
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        super().__init__((host, port), _Handler)
+        self.faults = faults
+        self.rng = random.Random(faults.seed)
+        self.rng_lock = threading.Lock()
+        self.bucket = (
+            _TokenBucket(faults.rate_limit_per_sec)
+            if faults.rate_limit_per_sec is not None
+            else None
+        )
+        self.requests = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw(self) -> Tuple[float, float]:
+        """(遅延秒, 失敗の種類を決める 0-1 の乱数)"""
+        with self.rng_lock:
+            self.requests += 1
+            return self.faults.latency_sec(self.rng), self.rng.random()
+
+    def start(self) -> "JmaStandInServer":
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="jma-stand-in", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "JmaStandInServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: JmaStandInServer
+    protocol_version = "HTTP/1.1"  # keep-alive を受け付ける
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def _send(
+        self,
+        status: HTTPStatus,
+        body: str,
+        content_type: str = "text/html",
+        headers: Tuple[Tuple[str, str], ...] = (),
+    ) -> None:
+        encoded = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        route = _ROUTE.match(url.path)
+        query = parse_qs(url.query)
+        try:
+            record_interval = RecordInterval(route["interval"])  # type: ignore[index]
+            col_type = LocationColumnType(route["col"])  # type: ignore[index]
+            _ = int(query["prec_no"][0]), int(query["block_no"][0])
+            page_date = date(
+                int(query["year"][0]), int(query["month"][0]), int(query["day"][0])
+            )
+        except (TypeError, KeyError, ValueError):
+            self._send(HTTPStatus.NOT_FOUND, "not found")
+            return
+
+        faults = self.server.faults
+        if self.server.bucket is not None and not self.server.bucket.take():
+            self._send(
+                HTTPStatus.TOO_MANY_REQUESTS,
+                "slow down",
+                headers=(("Retry-After", "1"),),
+            )
+            return
+
+        latency, dice = self.server.draw()
+        if dice < faults.timeout_rate:
+            time.sleep(faults.timeout_sec)
+        elif latency:
+            time.sleep(latency)
+        dice -= faults.timeout_rate
+        if 0 <= dice < faults.error_rate:
+            self._send(HTTPStatus.SERVICE_UNAVAILABLE, "unavailable")
+            return
+        dice -= faults.error_rate
+        content_type = "text/html"
+        if 0 <= dice < faults.wrong_content_type_rate:
+            content_type = "text/plain"
+        self._send(
+            HTTPStatus.OK,
+            render_page(record_interval, col_type, page_date),
+            content_type=content_type,
+        )
@@ -1,66 +1,236 @@
-import sys
-import time
-from datetime import date, timedelta
+import asyncio
+import contextlib
+import os
+from collections import Counter
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, List, Optional
 
 from loguru import logger
 from sqlalchemy.engine import Engine
-from sqlmodel import Session, create_engine, select
-from sqlmodel.engine.result import ScalarResult
+from sqlmodel import Session
 
-from jma_scraper.core.url_formatter import QueryParamsForJma
-from jma_scraper.infrastracture.db_tables import FetchFailed
+from jma_scraper.core.location_instances import HAMAMATSU, HAMAMATSU_10Minutes_COLUMNS
+from jma_scraper.core.metrics import METRICS, SamplingProfiler
+from jma_scraper.core.repository import WriterSrcValues
+from jma_scraper.infrastracture.audit_log import AuditLogWriter
+from jma_scraper.infrastracture.db_tables import LocalFileSaved
+from jma_scraper.infrastracture.html_cache import PackedHtmlCache
+from jma_scraper.infrastracture.http_client import AsyncJmaHttpClient
+from jma_scraper.infrastracture.localfile import (
+    JMA_CSV_DIR,
+    JMA_HTML_CACHE_DIR,
+    DfLocalCsvWriter,
+)
 from jma_scraper.infrastracture.sqlite_starter import (
-    DB_LOG,
     DB_PATH,
     create_db_and_tables,
+    create_engine_all,
     create_session,
     create_sql_url,
 )
-from jma_scraper.usecase.hamamatsu.write_scenario_local import write_scenario_local
+from jma_scraper.usecase.backfill import (
+    BackfillResult,
+    BackfillTarget,
+    PolitenessBudget,
+    parse_process_pool,
+)
+from jma_scraper.usecase.retry_queue import RetryQueue, drain
+from jma_scraper.usecase.revalidate import RevalidationResult, RevisionIndex, revalidate
+from jma_scraper.usecase.sync import CoverageIndex, sync
 
 START_DATE = date(2014, 12, 31)
 END_DATE = date(2015, 1, 1)
 
-sql_url = create_sql_url(str(DB_PATH))
-sys.stdout = open(DB_LOG, "a")
-engine = create_engine(sql_url, echo=True, connect_args={"check_same_thread": False})
-started_engine: Engine = create_db_and_tables(engine)
-session = create_session(started_engine)
+
+@lru_cache(maxsize=None)
+def started_engine() -> Engine:
+    """import 時には DB を開かず, 最初に呼んだときに engine とテーブルを作る"""
+    sql_url = create_sql_url(str(DB_PATH))
+    # JMA_SQL_ECHO=1 のときだけ発行したSQLを DB_LOG に書き出す
+    engine = create_engine_all(sql_url, echo=os.environ.get("JMA_SQL_ECHO") == "1")
+    return create_db_and_tables(engine)
+
+
+HAMAMATSU_10MINUTES_TARGET = BackfillTarget(
+    location=HAMAMATSU, columns=HAMAMATSU_10Minutes_COLUMNS
+)
+
+
+async def _backfill_hamamatsu_10minutes(
+    start_date: date,
+    end_date: date,
+    concurrency: int,
+    min_interval_sec: float,
+    parse_processes: Optional[int],
+    session: Session,
+) -> List[BackfillResult]:
+    # 保存済みのCSVと LocalFileSaved の記録にない日だけを取得する
+    coverage = CoverageIndex().add_csv_dir(JMA_CSV_DIR).add_local_file_saved(session)
+    parse_pool = (
+        parse_process_pool(parse_processes)
+        if parse_processes
+        else contextlib.nullcontext(None)
+    )
+    with AuditLogWriter(started_engine()) as audit, parse_pool as parse_executor:
+        async with AsyncJmaHttpClient(max_connections=concurrency) as client:
+            return await sync(
+                [HAMAMATSU_10MINUTES_TARGET],
+                start_date,
+                end_date,
+                fetcher=client,
+                writer_factory=DfLocalCsvWriter,
+                coverage=coverage,
+                concurrency=concurrency,
+                budget=PolitenessBudget(min_interval_sec),
+                audit=audit,
+                cache=PackedHtmlCache(JMA_HTML_CACHE_DIR),
+                parse_executor=parse_executor,
+                parse_concurrency=parse_processes,
+            )
 
 
 def hamamatsu_10minutes_save_as_csv(
-    start_date: date = START_DATE, end_date: date = END_DATE
+    start_date: date = START_DATE,
+    end_date: date = END_DATE,
+    concurrency: int = 4,
+    min_interval_sec: float = 0.5,
+    parse_processes: Optional[int] = None,
+    session: Optional[Session] = None,
 ) -> None:
-    assert end_date > start_date
-    delta_date = END_DATE - START_DATE
-    current_day = END_DATE
-    for _ in range(delta_date.days):
-        try:
-            write_scenario_local(current_day, session=session)
-            logger.info("current_day={}", current_day)
-        except Exception as e:
-            logger.error(str(e))
+    """start_date から end_date まで (両端を含む) の浜松10分ごとのデータのうち,
+    まだ保存していない日をCSVに保存する.
+    parse_processes を指定した場合はそのプロセス数でパースする. キャッシュ済みの
+    ページを大量に処理し直すときはコア数にすると速い.
+    """
+    if end_date < start_date:
+        raise ValueError(
+            f"end_date should be on or after start_date, got {start_date=}, {end_date=}"
+        )
+    session = session if session is not None else create_session(started_engine())
+    results = asyncio.run(
+        _backfill_hamamatsu_10minutes(
+            start_date,
+            end_date,
+            concurrency,
+            min_interval_sec,
+            parse_processes,
+            session,
+        )
+    )
+    RetryQueue(session).record_results(results)
+    _record_saved_csv(results, session)
+
+
+def _record_saved_csv(results: List[BackfillResult], session: Session) -> None:
+    for result in results:
+        if not result.ok:
             continue
+        src_values = WriterSrcValues(
+            date=result.date,
+            location_name=result.target.location.en_name,
+            every_xx=result.target.record_interval.to_literal(),
+        )
+        dst = DfLocalCsvWriter(src_values).create_csv_full_path()
+        session.add(LocalFileSaved(file_path=str(dst)))
+    session.commit()
 
-        current_day = current_day - timedelta(days=1)
-        assert isinstance(current_day, date)
-        time.sleep(2)
+
+async def _drain_hamamatsu_10minutes(
+    queue: RetryQueue, concurrency: int, min_interval_sec: float
+) -> List[BackfillResult]:
+    with AuditLogWriter(started_engine()) as audit:
+        async with AsyncJmaHttpClient(max_connections=concurrency) as client:
+            return await drain(
+                queue,
+                [HAMAMATSU_10MINUTES_TARGET],
+                fetcher=client,
+                writer_factory=DfLocalCsvWriter,
+                concurrency=concurrency,
+                budget=PolitenessBudget(min_interval_sec),
+                audit=audit,
+                cache=PackedHtmlCache(JMA_HTML_CACHE_DIR),
+            )
+
+
+def retry_failed_fetch(
+    session: Session, concurrency: int = 4, min_interval_sec: float = 0.5
+) -> None:
+    """再試行キューのうち次の時刻を過ぎたものだけを取り直す.
+    RetryJob 導入前の FetchFailed は初回にキューへ移す.
+    """
+    queue = RetryQueue(session)
+    imported = queue.import_fetch_failed()
+    if imported:
+        logger.info("Imported {} failed fetches into the retry queue", imported)
+    results = asyncio.run(
+        _drain_hamamatsu_10minutes(queue, concurrency, min_interval_sec)
+    )
+    _record_saved_csv(results, session)
+
+
+async def _revalidate_hamamatsu_10minutes(
+    revisions: RevisionIndex, days: int, concurrency: int, min_interval_sec: float
+) -> List[RevalidationResult]:
+    with AuditLogWriter(started_engine()) as audit:
+        async with AsyncJmaHttpClient(max_connections=concurrency) as client:
+            return await revalidate(
+                [HAMAMATSU_10MINUTES_TARGET],
+                fetcher=client,
+                writer_factory=DfLocalCsvWriter,
+                revisions=revisions,
+                days=days,
+                concurrency=concurrency,
+                budget=PolitenessBudget(min_interval_sec),
+                audit=audit,
+                cache=PackedHtmlCache(JMA_HTML_CACHE_DIR),
+            )
+
+
+def revalidate_recent(
+    session: Session,
+    days: int = 30,
+    concurrency: int = 4,
+    min_interval_sec: float = 0.5,
+) -> None:
+    """今日までの days 日分の浜松10分ごとのページを取り直し, 気象庁が値を直した日だけCSVを書き直す"""
+    results = asyncio.run(
+        _revalidate_hamamatsu_10minutes(
+            RevisionIndex(session), days, concurrency, min_interval_sec
+        )
+    )
+    counts = Counter(str(result.status) for result in results)
+    logger.info("Revalidated {} pages: {}", len(results), dict(counts))
 
 
-def retry_failed_fetch(session: Session) -> None:
-    logger.info(session)
-    with session:
-        statement = select(FetchFailed)
-        all_failed: ScalarResult[FetchFailed] = session.exec(statement)
-        assert all_failed is not None
-        urls = [failed.url for failed in all_failed.all()]
-    for url in urls:
-        date_ = QueryParamsForJma.get_date_from_url(url)
-        logger.info("Retry succeeded {}", url)
-        write_scenario_local(date_, session)
-        time.sleep(1)
+@contextlib.contextmanager
+def instrumentation() -> Iterator[None]:
+    """JMA_METRICS_DIR を指定した場合は計測を有効にし, 終了時に metrics.prom と
+    run_summary.json をそこに書き出す. JMA_PROFILE を指定した場合はサンプリング
+    プロファイラの collapsed stack をそのファイルに書き出す.
+    """
+    metrics_dir = os.environ.get("JMA_METRICS_DIR")
+    profile_path = os.environ.get("JMA_PROFILE")
+    METRICS.enabled = metrics_dir is not None
+    METRICS.reset()
+    profiler = SamplingProfiler().start() if profile_path else None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(Path(profile_path))  # type: ignore[arg-type]
+        if metrics_dir is not None:
+            METRICS.write(Path(metrics_dir))
+            logger.info("Wrote metrics to {}", metrics_dir)
 
 
 if __name__ == "__main__":
-    retry_failed_fetch(session=session)
-    hamamatsu_10minutes_save_as_csv()
+    with instrumentation(), create_session(started_engine()) as main_session:
+        retry_failed_fetch(session=main_session)
+        hamamatsu_10minutes_save_as_csv(session=main_session)
+        # JMA_REVALIDATE_DAYS=30 なら直近30日を取り直して訂正を反映する
+        revalidate_days = os.environ.get("JMA_REVALIDATE_DAYS")
+        if revalidate_days:
+            revalidate_recent(session=main_session, days=int(revalidate_days))
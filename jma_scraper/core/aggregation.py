@@ -0,0 +1,216 @@
+"""保存済みの10分ごとの値から, 1時間ごと, 日ごと, 月ごとの値を気象庁と同じ集計の仕方で作る.
+
+列名は気象庁の日ごとのページ (table_decoder の daily レイアウト) に合わせ, どの粒度でも同じ名前にする.
+
+- 降水量, 日照時間は合計. 日照時間は分から時間にする
+- 気温は平均, 最高, 最低. 相対湿度は平均, 最小. 気圧, 風速は平均
+- 平均は気象庁と同じく毎正時 (HH:00) の値の平均で, 日ごとの値は24回の平均. 1時間ごとの値は H:00 の値.
+  最高, 最低, 最大, 最小, 合計は10分ごとの全ての値から作る
+- 最大風速, 最大瞬間風速はその最大値と, 最大になった10分間の風向
+- 日ごとの値は 00:10 から 24:00 まで, 1時間ごとの値は (H-1):10 から H:00 までを H 時とする
+- 月ごとの値は気象庁と同じく日ごとの値から作る. 月平均気温は日平均気温の平均
+
+>>> from datetime import date
+>>> df = pd.DataFrame({
+...     "date": [date(2022, 1, 1)] * 3,
+...     "時分": ["00:10", "01:00", "24:00"],
+...     "気温(ºC)": [1.0, 3.0, 5.0],
+...     "最大瞬間_風速(m/s)": [4.0, 9.0, 2.0],
+...     "最大瞬間_風向": ["北", "西", "南"],
+... })
+>>> daily = aggregate_10minutes(df, Level.daily)
+>>> daily[["平均_気温(ºC)", "最高_気温(ºC)", "最大瞬間_風速(m/s)", "最大瞬間_風向"]].to_dict("records")
+[{'平均_気温(ºC)': 4.0, '最高_気温(ºC)': 5.0, '最大瞬間_風速(m/s)': 9.0, '最大瞬間_風向': '西'}]
+>>> aggregate_10minutes(df, Level.hourly)["時"].tolist()
+[1, 24]
+"""
+from enum import StrEnum
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from jma_scraper.core.location_spec import MainColumns10MinutesFormatted as Ten
+from jma_scraper.core.timestamps import HOUR_COLUMN, jst_index, minutes_of_day
+
+DATE_COLUMN = "date"  # 月ごとの値ではその月の1日
+COUNT_COLUMN = "10分値の数"  # 集計に使った行数. 欠けた日や時間を見分ける
+
+
+class Level(StrEnum):
+    hourly = "hourly"
+    daily = "daily"
+    monthly = "monthly"
+
+    @property
+    def keys(self) -> List[str]:
+        return [DATE_COLUMN, HOUR_COLUMN] if self is Level.hourly else [DATE_COLUMN]
+
+
+# 集計した列の名前. 気象庁の日ごとのページと同じ
+PRESSURE = "現地_平均気圧(hPa)"
+PRESSURE_SEA = "海面_平均気圧(hPa)"
+RAIN = "降水量_合計(mm)"
+RAIN_DAY_MAX = "降水量_日最大(mm)"
+RAIN_1HOUR_MAX = "降水量_最大1時間(mm)"
+RAIN_10MINUTES_MAX = "降水量_最大10分間(mm)"
+TEMPERATURE = "平均_気温(ºC)"
+TEMPERATURE_MAX = "最高_気温(ºC)"
+TEMPERATURE_MIN = "最低_気温(ºC)"
+TEMPERATURE_MAX_MEAN = "日最高_気温_平均(ºC)"
+TEMPERATURE_MIN_MEAN = "日最低_気温_平均(ºC)"
+HUMIDITY = "平均_相対湿度(%)"
+HUMIDITY_MIN = "最小_相対湿度(%)"
+WIND = "平均_風速(m/s)"
+WIND_MAX = "最大_風速(m/s)"
+WIND_MAX_DIRECTION = "最大_風向"
+GUST = "最大瞬間_風速(m/s)"
+GUST_DIRECTION = "最大瞬間_風向"
+WIND_MODE_DIRECTION = "最多_風向"
+SUNSHINE = "日照時間(h)"
+
+
+def _direction_at_max(
+    speed: pd.Series, direction: pd.Series, keys: List[pd.Series]
+) -> pd.Series:
+    """グループごとに speed が最大の行の direction. 値がないグループは欠損"""
+    valid = speed.notna()
+    rows = speed[valid].groupby([key[valid] for key in keys]).idxmax()
+    return pd.Series(direction.loc[rows.to_numpy()].to_numpy(), index=rows.index)
+
+
+def _most_frequent(direction: pd.Series, keys: List[pd.Series]) -> pd.Series:
+    valid = direction.notna()
+    counts = direction[valid].groupby(
+        [key[valid] for key in keys] + [direction[valid]], observed=True
+    )
+    sizes = counts.size()
+    top = sizes.groupby(level=list(range(len(keys)))).idxmax()
+    return pd.Series([index[-1] for index in top], index=top.index)
+
+
+def _hourly_rain_max(df: pd.DataFrame) -> pd.Series:
+    """前1時間降水量 (10分ずつずらした60分間の合計) の日ごとの最大.
+    前日の 23:20 からの値も使うので, df に前日分があれば日の始まりも正しくなる.
+    """
+    at = jst_index(df[DATE_COLUMN].to_numpy(), minutes_of_day(df[Ten.hour_minutes]))
+    rain = pd.Series(df[Ten.rain_amount].to_numpy(), index=at).sort_index()
+    per_hour = rain.rolling("60min", min_periods=1).sum()
+    order = np.argsort(at.asi8, kind="stable")
+    return per_hour.groupby(df[DATE_COLUMN].to_numpy()[order]).max()
+
+
+def aggregate_10minutes(df: pd.DataFrame, level: Level) -> pd.DataFrame:
+    """date, 時分 と値の列を持つ10分ごとの値 (Parquet に保存した形) を, 1時間ごとか日ごとにする.
+    ない列の集計は飛ばすので, 観測項目の少ない a1 の地点でも使える.
+    """
+    if level is Level.monthly:
+        raise ValueError("monthly values are made from daily values by aggregate_daily")
+    columns = set(df.columns)
+    keys = [df[DATE_COLUMN]]
+    if level is Level.hourly:
+        hours = (minutes_of_day(df[Ten.hour_minutes]) + 59) // 60
+        keys.append(pd.Series(hours, index=df.index, name=HOUR_COLUMN))
+    by = df.groupby(keys, sort=True)
+    # 平均は毎正時の値だけから作る
+    on_the_hour = minutes_of_day(df[Ten.hour_minutes]) % 60 == 0
+    by_hour = df[on_the_hour].groupby([key[on_the_hour] for key in keys], sort=True)
+
+    out: Dict[str, pd.Series] = {COUNT_COLUMN: by.size().astype("int32")}
+    if Ten.h_pa in columns:
+        out[PRESSURE] = by_hour[Ten.h_pa].mean()
+    if Ten.h_pa_sea in columns:
+        out[PRESSURE_SEA] = by_hour[Ten.h_pa_sea].mean()
+    if Ten.rain_amount in columns:
+        out[RAIN] = by[Ten.rain_amount].sum(min_count=1)
+        if level is Level.daily:
+            out[RAIN_1HOUR_MAX] = _hourly_rain_max(df)
+        out[RAIN_10MINUTES_MAX] = by[Ten.rain_amount].max()
+    if Ten.temperature in columns:
+        out[TEMPERATURE] = by_hour[Ten.temperature].mean()
+        out[TEMPERATURE_MAX] = by[Ten.temperature].max()
+        out[TEMPERATURE_MIN] = by[Ten.temperature].min()
+    if Ten.humidity in columns:
+        out[HUMIDITY] = by_hour[Ten.humidity].mean()
+        out[HUMIDITY_MIN] = by[Ten.humidity].min()
+    if Ten.ave_wind_speed in columns:
+        out[WIND] = by_hour[Ten.ave_wind_speed].mean()
+        out[WIND_MAX] = by[Ten.ave_wind_speed].max()
+        if Ten.ave_wind_direction in columns:
+            out[WIND_MAX_DIRECTION] = _direction_at_max(
+                df[Ten.ave_wind_speed], df[Ten.ave_wind_direction], keys
+            )
+    if Ten.max_wind_speed in columns:
+        out[GUST] = by[Ten.max_wind_speed].max()
+        if Ten.max_wind_direction in columns:
+            out[GUST_DIRECTION] = _direction_at_max(
+                df[Ten.max_wind_speed], df[Ten.max_wind_direction], keys
+            )
+    if level is Level.daily and Ten.ave_wind_direction in columns:
+        out[WIND_MODE_DIRECTION] = _most_frequent(df[Ten.ave_wind_direction], keys)
+    if Ten.sunshine_duration in columns:
+        out[SUNSHINE] = by[Ten.sunshine_duration].sum(min_count=1) / 60
+    return _to_frame(out, level)
+
+
+# 日ごとの値から月ごとの値を作るときの集計. (元の列, 集計, 作る列).
+# at_max は 作る列 (風速) が最大になった日の 元の列 (風向)
+_MONTHLY_RULES = (
+    (COUNT_COLUMN, "sum", COUNT_COLUMN),
+    (PRESSURE, "mean", PRESSURE),
+    (PRESSURE_SEA, "mean", PRESSURE_SEA),
+    (RAIN, "sum", RAIN),
+    (RAIN, "max", RAIN_DAY_MAX),
+    (RAIN_1HOUR_MAX, "max", RAIN_1HOUR_MAX),
+    (RAIN_10MINUTES_MAX, "max", RAIN_10MINUTES_MAX),
+    (TEMPERATURE, "mean", TEMPERATURE),
+    (TEMPERATURE_MAX, "mean", TEMPERATURE_MAX_MEAN),
+    (TEMPERATURE_MIN, "mean", TEMPERATURE_MIN_MEAN),
+    (TEMPERATURE_MAX, "max", TEMPERATURE_MAX),
+    (TEMPERATURE_MIN, "min", TEMPERATURE_MIN),
+    (HUMIDITY, "mean", HUMIDITY),
+    (HUMIDITY_MIN, "min", HUMIDITY_MIN),
+    (WIND, "mean", WIND),
+    (WIND_MAX, "max", WIND_MAX),
+    (WIND_MAX_DIRECTION, "at_max", WIND_MAX),
+    (GUST, "max", GUST),
+    (GUST_DIRECTION, "at_max", GUST),
+    (SUNSHINE, "sum", SUNSHINE),
+)
+
+
+def month_start(dates: pd.Series) -> pd.Series:
+    """
+    >>> from datetime import date
+    >>> month_start(pd.Series([date(2022, 2, 14)])).tolist()
+    [datetime.date(2022, 2, 1)]
+    """
+    return dates.map(lambda d: d.replace(day=1))
+
+
+def aggregate_daily(daily: pd.DataFrame) -> pd.DataFrame:
+    """aggregate_10minutes の日ごとの値から月ごとの値を作る"""
+    keys = [month_start(daily[DATE_COLUMN]).rename(DATE_COLUMN)]
+    by = daily.groupby(keys, sort=True)
+    out: Dict[str, pd.Series] = {}
+    for source, how, name in _MONTHLY_RULES:
+        if source not in daily.columns:
+            continue
+        if how == "at_max":
+            out[source] = _direction_at_max(daily[name], daily[source], keys)
+        elif how == "sum":
+            out[name] = by[source].sum(min_count=1)
+        else:
+            out[name] = getattr(by[source], how)()
+    if COUNT_COLUMN in out:
+        out[COUNT_COLUMN] = out[COUNT_COLUMN].astype("int32")
+    return _to_frame(out, Level.monthly)
+
+
+def _to_frame(out: Dict[str, pd.Series], level: Level) -> pd.DataFrame:
+    frame = pd.DataFrame(out)
+    frame.index.names = level.keys
+    for name in frame.columns:
+        if name != COUNT_COLUMN and pd.api.types.is_float_dtype(frame[name]):
+            frame[name] = frame[name].astype("float32")
+    return frame.reset_index()
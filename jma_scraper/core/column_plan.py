@@ -0,0 +1,293 @@
+"""tablefix1 の見出し行から列の計画 (生の見出し → 列名, 型) を作り, 見出しのハッシュごとに使い回す.
+
+見出し行は本体の行より前にあるので, 知らないレイアウトは本体をパースする前に分かる.
+同じレイアウトのページが何ページあっても, 計画を作るのは1回だけ.
+
+>>> table = (
+...     '<table id="tablefix1"><tr><th rowspan="2">時</th><th colspan="2">風向・風速</th></tr>'
+...     '<tr><th>風速<br>(m/s)</th><th>風向</th></tr><tr><td>1</td><td>2.0</td><td>北</td></tr></table>'
+... )
+>>> flatten_header(header_cells(table))
+('時', '風向・風速_風速 (m/s)', '風向・風速_風向')
+>>> plan = PLANS.plan_for(table)
+>>> plan.columns
+('時', '風向・風速_風速(m/s)', '風向・風速_風向')
+>>> plan.dtypes["風向・風速_風向"]
+'float32'
+>>> PLANS.plan_for(table) is plan
+True
+"""
+import hashlib
+import html
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from loguru import logger
+
+from jma_scraper.core.errors import LayoutMismatchError
+from jma_scraper.core.metrics import METRICS, timed
+
+
+@dataclass(eq=True, frozen=True)
+class TableLayout:
+    """tablefix1 の列の並び. columns の先頭 label_columns 列は時刻, 日などの行ラベル列"""
+
+    columns: Tuple[str, ...]
+    direction_columns: FrozenSet[str] = frozenset()
+    text_columns: FrozenSet[str] = frozenset()  # 天気, 雲量など数値にしない列
+    label_columns: int = 1
+    # 見出しを上から "_" でつないだ元の名前. 空の場合は見出しの列数だけを確かめる
+    original_columns: Tuple[str, ...] = ()
+
+    @property
+    def label_column_names(self) -> Tuple[str, ...]:
+        return self.columns[: self.label_columns]
+
+    @property
+    def value_columns(self) -> Tuple[str, ...]:
+        return self.columns[self.label_columns :]
+
+
+HeaderCell = Tuple[str, int, int]  # (見出しの文字列, colspan, rowspan)
+
+_FIRST_TD = re.compile(r"<td\b", re.IGNORECASE)
+_ROW = re.compile(r"<tr\b[^>]*>(.*?)</tr>", re.IGNORECASE | re.DOTALL)
+_TH = re.compile(r"<th\b([^>]*)>(.*?)</th>", re.IGNORECASE | re.DOTALL)
+_SPAN = re.compile(r"\b(colspan|rowspan)\s*=\s*[\"']?(\d+)", re.IGNORECASE)
+_BR = re.compile(r"<br\s*/?>", re.IGNORECASE)
+_TAG = re.compile(r"<[^>]+>")
+_SPACES = re.compile(r"\s+")
+
+# 見出しから列名を作るときの単位の書き換え. 既存のレイアウトの列名の書き方に合わせる
+_UNITS: Tuple[Tuple[str, str], ...] = (
+    ("℃", "ºC"),
+    ("％", "%"),
+    ("(分)", "(min)"),
+    ("(時間)", "(h)"),
+)
+_LABEL_HEADERS = frozenset({"時分", "時", "日", "月", "期間"})
+_TEXT_HEADERS = ("天気", "雲量")
+
+
+def header_cells(table_html: str) -> Tuple[Tuple[HeaderCell, ...], ...]:
+    """最初の td より前の行の th を行ごとに取り出す. 本体の行は読まない"""
+    first_td = _FIRST_TD.search(table_html)
+    head = table_html if first_td is None else table_html[: first_td.start()]
+    rows = []
+    for row in _ROW.finditer(head):
+        cells = []
+        for attrs, raw in _TH.findall(row.group(1)):
+            spans = {name.lower(): int(n) for name, n in _SPAN.findall(attrs)}
+            text = html.unescape(_TAG.sub("", _BR.sub(" ", raw)))
+            cells.append(
+                (
+                    _SPACES.sub(" ", text).strip(),
+                    spans.get("colspan", 1),
+                    spans.get("rowspan", 1),
+                )
+            )
+        if cells:
+            rows.append(tuple(cells))
+    return tuple(rows)
+
+
+def header_fingerprint(cells: Tuple[Tuple[HeaderCell, ...], ...]) -> str:
+    """見出しの文字列と結合の仕方のハッシュ. style などの属性の違いは無視する"""
+    return hashlib.blake2b(repr(cells).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def flatten_header(cells: Tuple[Tuple[HeaderCell, ...], ...]) -> Tuple[str, ...]:
+    """colspan, rowspan を展開して, 列ごとに上から見出しを "_" でつなぐ.
+    rowspan で続いている同じ見出しは1回だけにし, 重複する名前には pandas と同じく .1 を付ける.
+    """
+    grid: Dict[Tuple[int, int], str] = {}
+    for r, row in enumerate(cells):
+        c = 0
+        for text, colspan, rowspan in row:
+            while (r, c) in grid:
+                c += 1
+            for dr in range(rowspan):
+                for dc in range(colspan):
+                    grid[(r + dr, c + dc)] = text
+            c += colspan
+    width = max((c for _, c in grid), default=-1) + 1
+
+    names: List[str] = []
+    seen: Dict[str, int] = {}
+    for c in range(width):
+        levels: List[str] = []
+        for r in range(len(cells)):
+            text = grid.get((r, c), "")
+            if text and (not levels or levels[-1] != text):
+                levels.append(text)
+        name = "_".join(levels)
+        n = seen.get(name, 0)
+        seen[name] = n + 1
+        names.append(f"{name}.{n}" if n else name)
+    return tuple(names)
+
+
+def _canonical_name(raw: str) -> str:
+    """
+    >>> _canonical_name("日照 時間 (分)")
+    '日照時間(min)'
+    """
+    name = raw.replace(" ", "")
+    for before, after in _UNITS:
+        name = name.replace(before, after)
+    return name
+
+
+def _header_key(name: str) -> str:
+    """read_html の "時分_時分" と flatten_header の "時分" を同じにする. 空白は無視する.
+    >>> _header_key("降水量 (mm)_降水量 (mm)") == _header_key("降水量(mm)")
+    True
+    """
+    levels: List[str] = []
+    for level in name.replace(" ", "").split("_"):
+        if not levels or levels[-1] != level:
+            levels.append(level)
+    return "_".join(levels)
+
+
+def _check_header(raw_columns: Tuple[str, ...], layout: TableLayout) -> None:
+    if len(raw_columns) != len(layout.columns):
+        raise LayoutMismatchError(
+            f"The table header has {len(raw_columns)} columns, but the layout expects "
+            f"{len(layout.columns)}. The layout may be different: {raw_columns}"
+        )
+    different = [
+        (raw, original)
+        for raw, original in zip(raw_columns, layout.original_columns, strict=False)
+        if _header_key(raw) != _header_key(original)
+    ]
+    if different:
+        raise LayoutMismatchError(
+            f"The table header does not match the layout. (header, expected): {different}"
+        )
+
+
+def derive_layout(raw_columns: Tuple[str, ...]) -> TableLayout:
+    """既存のレイアウトがない見出しから列名と列の種類を決める"""
+    columns = tuple(_canonical_name(raw) for raw in raw_columns)
+    label_columns = 1
+    while label_columns < len(columns) and columns[label_columns] in _LABEL_HEADERS:
+        label_columns += 1
+    levels = [column.split(".")[0].split("_") for column in columns]
+    return TableLayout(
+        columns=columns,
+        direction_columns=frozenset(
+            column
+            for column, level in zip(columns, levels, strict=True)
+            if level[-1].startswith("風向")
+        ),
+        text_columns=frozenset(
+            column
+            for column, level in zip(columns, levels, strict=True)
+            if any(text.startswith(_TEXT_HEADERS) for text in level)
+        ),
+        label_columns=label_columns,
+    )
+
+
+@dataclass(eq=True, frozen=True)
+class ColumnPlan:
+    """1つの見出しのレイアウトに対する, 生の見出しから列名, 型への対応"""
+
+    fingerprint: str
+    raw_columns: Tuple[str, ...]
+    layout: TableLayout
+    derived: bool = False  # レイアウトの指定なしで見出しから作った
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return self.layout.columns
+
+    @property
+    def mapping(self) -> Dict[str, str]:
+        return dict(zip(self.raw_columns, self.columns, strict=True))
+
+    @property
+    def dtypes(self) -> Dict[str, str]:
+        """decode_table の結果の列の型"""
+        layout = self.layout
+        return {
+            column: "object"
+            if column in layout.label_column_names or column in layout.text_columns
+            else "float32"
+            for column in layout.columns
+        }
+
+
+def build_plan(
+    fingerprint: str,
+    cells: Tuple[Tuple[HeaderCell, ...], ...],
+    layout: Optional[TableLayout] = None,
+) -> ColumnPlan:
+    raw_columns = flatten_header(cells)
+    if layout is not None:
+        if raw_columns:
+            _check_header(raw_columns, layout)
+        return ColumnPlan(fingerprint, raw_columns, layout)
+    if not raw_columns:
+        raise LayoutMismatchError(
+            "The table has no header row, so a layout should be given."
+        )
+    logger.warning("Unknown table layout {}: {}", fingerprint, raw_columns)
+    return ColumnPlan(
+        fingerprint, raw_columns, derive_layout(raw_columns), derived=True
+    )
+
+
+class ColumnPlanRegistry:
+    """(見出しのハッシュ, 指定したレイアウト) ごとの ColumnPlan. 通常はモジュールの PLANS を使う"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._plans: Dict[Tuple[str, Optional[TableLayout]], ColumnPlan] = {}
+        # レイアウトに合わなかった見出しのエラーの内容. 同じ見出しは2回確かめない
+        self._rejected: Dict[Tuple[str, Optional[TableLayout]], str] = {}
+
+    @timed("column_plan")
+    def plan_for(
+        self, table_html: str, layout: Optional[TableLayout] = None
+    ) -> ColumnPlan:
+        """tablefix1 部分のhtmlの見出し行だけを読んで計画を返す.
+        layout を渡した場合は見出しが合うか (original_columns がなければ列数だけ) を確かめて
+        その列名を使い, 合わなければ LayoutMismatchError を送出する.
+        省略した場合は見出しから列名を作る.
+        """
+        cells = header_cells(table_html)
+        key = (header_fingerprint(cells), layout)
+        plan = self._plans.get(key)
+        if plan is not None:
+            return plan
+        rejected = self._rejected.get(key)
+        if rejected is not None:
+            raise LayoutMismatchError(rejected)
+        try:
+            plan = build_plan(key[0], cells, layout)
+        except LayoutMismatchError as e:
+            with self._lock:
+                self._rejected[key] = str(e)
+            raise
+        METRICS.inc("column_plans_built")
+        with self._lock:
+            return self._plans.setdefault(key, plan)
+
+    def plans(self) -> List[ColumnPlan]:
+        with self._lock:
+            return list(self._plans.values())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._plans.clear()
+            self._rejected.clear()
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+
+PLANS = ColumnPlanRegistry()
@@ -0,0 +1,118 @@
+"""整形済みの DataFrame を小さい型にする compact スキーマ.
+
+- 値の列は float32. 気象庁の記号は decode_cell と同じく読む ("--" は 0, "///", "×" は欠損)
+- 風向は静穏と16方位の順序つき Categorical (1行1バイト). 度数へは配列の参照1回で変換する
+- 時分は 0:00 からの分の int16 ("24:00" は 1440). 時, 日, 月などの行ラベルも int16
+- 天気などの文字列の列はそのまま
+
+文字列の変換は重複を除いた値ごとに1回だけ行い, 行ごとの Python の処理や object の中間の列は作らない.
+
+>>> directions = to_wind_direction(["北", "西北西)", "静穏", "///"])
+>>> list(directions)
+['北', '西北西', '静穏', nan]
+>>> direction_degrees(directions)
+array([360. , 292.5,   0. ,   nan], dtype=float32)
+>>> to_float32(["1017.2", "6.5)", "--", "×"])
+array([1017.2,    6.5,    0. ,    nan], dtype=float32)
+"""
+from typing import Dict, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from jma_scraper.core.column_plan import TableLayout, derive_layout
+from jma_scraper.core.table_decoder import (
+    WIND_DIRECTION_DEGREES,
+    WIND_DIRECTIONS_16,
+    decode_cell,
+)
+from jma_scraper.core.timestamps import HOUR_MINUTES_COLUMN, ArrayLike, minutes_of_day
+
+# 度数の小さい順. コードは 度数 / 22.5 と同じになる
+WIND_DIRECTION_DTYPE = pd.CategoricalDtype(("静穏", *WIND_DIRECTIONS_16), ordered=True)
+# コード -1 (欠損) は末尾の NaN を指す
+_DEGREES = np.array(
+    [WIND_DIRECTION_DEGREES[name] for name in WIND_DIRECTION_DTYPE.categories]
+    + [np.nan],
+    dtype=np.float32,
+)
+_HOUR_MINUTES_TEXT = np.array([f"{m // 60:02}:{m % 60:02}" for m in range(24 * 60 + 1)])
+
+
+def _decode_uniques(values: np.ndarray, is_direction: bool) -> np.ndarray:
+    """セルの文字列を重複を除いて decode_cell で読み, 元の並びの float32 にする"""
+    codes, uniques = pd.factorize(values)
+    decoded = np.array(
+        [decode_cell(str(value), is_direction)[0] for value in uniques] + [np.nan],
+        dtype=np.float32,
+    )
+    return decoded[codes]
+
+
+def to_float32(values: ArrayLike) -> np.ndarray:
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.number):
+        return values.astype(np.float32, copy=False)
+    return _decode_uniques(values, is_direction=False)
+
+
+def to_wind_direction(values: ArrayLike) -> pd.Categorical:
+    """風向の文字列, または decode_table の度数を WIND_DIRECTION_DTYPE にする"""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.number):
+        degrees = values.astype(np.float32, copy=False)
+    else:
+        degrees = _decode_uniques(values, is_direction=True)
+    codes = np.where(np.isnan(degrees), -1, np.rint(degrees / 22.5)).astype(np.int8)
+    return pd.Categorical.from_codes(codes, dtype=WIND_DIRECTION_DTYPE)
+
+
+def direction_degrees(directions: Union[pd.Categorical, pd.Series]) -> np.ndarray:
+    """WIND_DIRECTION_DTYPE の風向を度数 (北が360, 静穏が0) にする. 欠損は NaN"""
+    if isinstance(directions, pd.Series):
+        directions = directions.array
+    return _DEGREES[np.asarray(directions.codes)]
+
+
+def hour_minutes_text(minutes: ArrayLike) -> np.ndarray:
+    """int16 の時分を "HH:MM" の文字列に戻す.
+
+    >>> hour_minutes_text([10, 1440]).tolist()
+    ['00:10', '24:00']
+    """
+    return _HOUR_MINUTES_TEXT[np.asarray(minutes)]
+
+
+def _label(series: pd.Series) -> Union[np.ndarray, pd.Series]:
+    if series.name == HOUR_MINUTES_COLUMN:
+        return minutes_of_day(series.to_numpy()).astype(np.int16)
+    try:
+        return pd.to_numeric(series).to_numpy().astype(np.int16)
+    except (TypeError, ValueError):
+        return series  # 数値でないラベルはそのまま
+
+
+def compact_frame(
+    df: pd.DataFrame, layout: Optional[TableLayout] = None
+) -> pd.DataFrame:
+    """df の列を compact スキーマの型にした新しい DataFrame. index はそのまま.
+    layout を省略した場合は列名から風向, 文字列の列を決める.
+
+    >>> df = pd.DataFrame({"時分": ["00:10", "24:00"], "気温(ºC)": ["6.5", "6.3)"], "平均_風向": ["北", "静穏"]})
+    >>> compact_frame(df).dtypes.astype(str).to_dict()
+    {'時分': 'int16', '気温(ºC)': 'float32', '平均_風向': 'category'}
+    """
+    if layout is None:
+        layout = derive_layout(tuple(str(column) for column in df.columns))
+    columns: Dict[str, object] = {}
+    for name in df.columns:
+        series = df[name]
+        if name in layout.label_column_names:
+            columns[name] = _label(series)
+        elif name in layout.direction_columns:
+            columns[name] = to_wind_direction(series.to_numpy())
+        elif name in layout.text_columns:
+            columns[name] = series
+        else:
+            columns[name] = to_float32(series.to_numpy())
+    return pd.DataFrame(columns, index=df.index, copy=False)
@@ -0,0 +1,18 @@
+"""取り直しても結果の変わらないエラー.
+
+メンテナンス中のページやエラーページで起きる ValueError (content-type が違う, tablefix1 がない など) は
+時間をおけば取れるので, 再試行キューは PermanentPageError だけを恒久的なエラーとみなす.
+どちらも ValueError なので, 既存の except ValueError はそのまま捕まえる.
+"""
+
+
+class PermanentPageError(ValueError):
+    """ページのURLや表のレイアウトが不正で, 何度取り直しても同じ結果になるエラー"""
+
+
+class PageUrlError(PermanentPageError):
+    """観測地点, 日付, 間隔からページのURLを作れない"""
+
+
+class LayoutMismatchError(PermanentPageError):
+    """表の見出しや行の形が想定のレイアウトと違う"""
@@ -1,11 +1,18 @@
-from typing import Any, List, Protocol, Sequence, TypeAlias
+import re
+from typing import Any, List, Optional, Protocol, Sequence, TypeAlias
 
+import lxml.html
 import pandas as pd
-from bs4 import BeautifulSoup
+from lxml import etree
 from pandas import MultiIndex
 
-from jma_scraper.core.repository import Fetcher
+from jma_scraper.core.column_plan import PLANS, TableLayout
+from jma_scraper.core.errors import LayoutMismatchError
+from jma_scraper.core.location_instances import TEN_MINUTES_COLUMNS
+from jma_scraper.core.metrics import timed
+from jma_scraper.core.repository import Fetcher, HtmlCache
 from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.infrastracture.html_cache import CachedFetcher
 from jma_scraper.infrastracture.http_client import fetch_html
 
 HTML_TABLE_ID_SPEC = "tablefix1"  # 気象庁ホームページの仕様で tableタグにこのidが付与されているところが観測データのBody
@@ -13,14 +20,62 @@ HTML_TABLE_ID_SPEC = "tablefix1"  # 気象庁ホームページの仕様で tabl
 HtmlText: TypeAlias = str
 
 
+# tablefix1 の開始タグと, 入れ子を数えるための table 開始/終了タグ
+_TABLEFIX1_OPEN_TAG = re.compile(
+    rf"<table\b[^>]*\sid\s*=\s*[\"']?{HTML_TABLE_ID_SPEC}\b[^>]*>", re.IGNORECASE
+)
+_TABLE_TAG = re.compile(r"<(/?)table\b", re.IGNORECASE)
+_TABLEFIX1_XPATH = etree.XPath(f'//*[@id="{HTML_TABLE_ID_SPEC}"]')
+
+
+def _table_not_found() -> ValueError:
+    return ValueError(
+        f"The HTML content should contain 'id={HTML_TABLE_ID_SPEC}', but cannot be found."
+    )
+
+
+def _slice_tablefix1(fetched_html: str) -> HtmlText | None:
+    """ページ全体をDOMにせず, 文字列の走査だけで tablefix1 の table 部分を切り出す.
+    見つからない, または閉じタグが見つからない場合は None
+    """
+    open_tag = _TABLEFIX1_OPEN_TAG.search(fetched_html)
+    if open_tag is None:
+        return None
+    depth = 1
+    for tag in _TABLE_TAG.finditer(fetched_html, open_tag.end()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            end = fetched_html.find(">", tag.end())
+            if end == -1:
+                return None
+            return fetched_html[open_tag.start() : end + 1]
+    return None
+
+
+def pluck_table_element(fetched_html: str) -> lxml.html.HtmlElement:
+    """id=tablefix1 の要素を lxml の要素として返す"""
+    table_html = _slice_tablefix1(fetched_html)
+    if table_html is not None:
+        return lxml.html.fragment_fromstring(table_html)
+
+    # 切り出せない崩れたhtmlはページ全体をlxmlでパースして探す
+    try:
+        found = _TABLEFIX1_XPATH(lxml.html.document_fromstring(fetched_html))
+    except etree.ParserError as e:
+        raise _table_not_found() from e
+    if not found:
+        raise _table_not_found()
+    return found[0]
+
+
+@timed("pluck_table_from_html")
 def pluck_table_from_html(fetched_html: str) -> HtmlText:
-    soup = BeautifulSoup(fetched_html, features="html.parser")
-    table_content = soup.find(id=HTML_TABLE_ID_SPEC)
-    if table_content is None:
-        raise ValueError(
-            f"The HTML content should contain 'id={HTML_TABLE_ID_SPEC}', but cannot be found."
-        )
-    return table_content.__str__()
+    """id=tablefix1 の table 部分のhtmlを元のページから切り出して返す"""
+    table_html = _slice_tablefix1(fetched_html)
+    if table_html is not None:
+        return table_html
+    element = pluck_table_element(fetched_html)
+    return etree.tostring(element, encoding="unicode", method="html")
 
 
 class TableReader(Protocol):
@@ -28,6 +83,7 @@ class TableReader(Protocol):
         ...
 
 
+@timed("read_html_table")
 def read_html_table(
     html_str: HtmlText, table_reader: TableReader = pd.read_html, **kwargs: Any
 ) -> pd.DataFrame:
@@ -41,6 +97,7 @@ def read_html_table(
 FlattenDf: TypeAlias = pd.DataFrame
 
 
+@timed("flatten_columns")
 def flatten_columns(html_table_df: pd.DataFrame) -> FlattenDf:
     """関連のあるマルチカラムインデックスをアンダースコアでつなぐ"""
     if not isinstance(html_table_df.columns, MultiIndex):
@@ -55,6 +112,7 @@ def flatten_columns(html_table_df: pd.DataFrame) -> FlattenDf:
 FormattedDf: TypeAlias = pd.DataFrame
 
 
+@timed("format_columns")
 def format_columns(
     flattened_df: FlattenDf, after_columns: Sequence[str]
 ) -> FormattedDf:
@@ -69,22 +127,56 @@ def format_columns(
             "Input dataframe must be the flattened columns, but got Multiples, check dataframe contents"
         )
     if len(flattened_df.columns) != len(after_columns):
-        raise ValueError(
+        raise LayoutMismatchError(
             f"Column length should be the same original={len(flattened_df.columns)}, after={len(after_columns)}"
         )
     flattened_df.columns = after_columns
     return flattened_df
 
 
+def layout_of_columns(after_columns: Sequence[str]) -> TableLayout:
+    """after_columns の列名のレイアウト. 既知の Columns の列名なら元の見出しの中身も確かめる"""
+    for columns in TEN_MINUTES_COLUMNS.values():
+        if list(after_columns) == list(columns.after_columns):
+            return TableLayout(
+                tuple(after_columns), original_columns=tuple(columns.original_columns)
+            )
+    return TableLayout(tuple(after_columns))
+
+
+def parse_html_to_df(
+    fetched_html: str,
+    after_columns: Optional[Sequence[str]] = None,
+    compact: bool = False,
+) -> FormattedDf:
+    """取得したページ全体のhtmlから整形済みのDataFrameまでを一気に変換する.
+    列名は見出し行のハッシュごとに1回だけ作る ColumnPlan で付けるので, ページごとに見出しをつながない.
+    after_columns を省略した場合は見出しから列名を作る.
+    compact=True の場合は compact_frame で float32, 風向の Categorical, 時分の int16 にする.
+    """
+    html_table_only = pluck_table_from_html(fetched_html)
+    layout = None if after_columns is None else layout_of_columns(after_columns)
+    plan = PLANS.plan_for(html_table_only, layout)
+    df = read_html_table(html_table_only, pd.read_html)
+    df.columns = list(plan.columns)
+    if compact:
+        # compact は table_decoder 経由でこのモジュールを import するので, ここで import する
+        from jma_scraper.core.compact import compact_frame
+
+        return compact_frame(df)
+    return df
+
+
 def fetch_df(
     qp: QueryParamsForJma,
-    after_columns: Sequence[str],
+    after_columns: Optional[Sequence[str]] = None,
     fetcher: Fetcher = fetch_html,
     time_out_sec: float = 2.0,
+    cache: Optional[HtmlCache] = None,
+    compact: bool = False,
 ) -> FormattedDf:
+    """cache を渡した場合はキャッシュを先に探し, なければ取得してキャッシュに保存する"""
+    if cache is not None:
+        fetcher = CachedFetcher(fetcher, cache)
     html_txt = fetcher(qp, time_out_sec=time_out_sec)
-    html_table_only = pluck_table_from_html(html_txt)
-    df = read_html_table(html_table_only, pd.read_html)
-    df = flatten_columns(df)
-    df = format_columns(df, after_columns=after_columns)
-    return df
+    return parse_html_to_df(html_txt, after_columns=after_columns, compact=compact)
@@ -1,3 +1,5 @@
+from typing import Dict
+
 from jma_scraper.core.location_spec import (
     Columns,
     FewColumns10Minutes,
@@ -47,3 +49,9 @@ SHIZUOKA_10Minutes_COLUMNS = Columns(
 IWATA_10Minutes_COLUMNS = Columns(
     original_columns=few_col_10min_list, after_columns=few_col_10min_list_fmt
 )
+
+# 10分ごとの値の列名は観測地点の種類だけで決まる. 見出しとの対応は column_plan が見出しから作る
+TEN_MINUTES_COLUMNS: Dict[LocationColumnType, Columns] = {
+    LocationColumnType.main: HAMAMATSU_10Minutes_COLUMNS,
+    LocationColumnType.few: IWATA_10Minutes_COLUMNS,
+}
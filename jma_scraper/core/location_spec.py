@@ -1,9 +1,11 @@
 from dataclasses import dataclass
+from datetime import date, timedelta
 from enum import StrEnum
 from pathlib import Path
-from typing import Dict, List, Literal
+from typing import TYPE_CHECKING, Dict, List, Literal
 
-import pandas as pd
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class LocationColumnType(StrEnum):
@@ -73,6 +75,136 @@ class FewColumns10MinutesFormatted(StrEnum):
     sunshine_duration = "日照時間(min)"
 
 
+class MainColumnsHourlyFormatted(StrEnum):
+    hour = "時"
+    h_pa = "現地_気圧(hPa)"
+    h_pa_sea = "海面_気圧(hPa)"
+    rain_amount = "降水量(mm)"
+    temperature = "気温(ºC)"
+    dew_point = "露点温度(ºC)"
+    vapor_pressure = "蒸気圧(hPa)"
+    humidity = "相対湿度(%)"
+    wind_speed = "風速(m/s)"
+    wind_direction = "風向"
+    sunshine_duration = "日照時間(h)"
+    global_solar_radiation = "全天日射量(MJ/m2)"
+    snowfall = "降雪(cm)"
+    snow_depth = "積雪(cm)"
+    weather = "天気"
+    cloud_amount = "雲量"
+    visibility = "視程(km)"
+
+
+class FewColumnsHourlyFormatted(StrEnum):
+    hour = "時"
+    rain_amount = "降水量(mm)"
+    temperature = "気温(ºC)"
+    dew_point = "露点温度(ºC)"
+    vapor_pressure = "蒸気圧(hPa)"
+    humidity = "相対湿度(%)"
+    wind_speed = "風速(m/s)"
+    wind_direction = "風向"
+    sunshine_duration = "日照時間(h)"
+    snowfall = "降雪(cm)"
+    snow_depth = "積雪(cm)"
+
+
+class MainColumnsDailyFormatted(StrEnum):
+    day = "日"
+    h_pa = "現地_平均気圧(hPa)"
+    h_pa_sea = "海面_平均気圧(hPa)"
+    rain_total = "降水量_合計(mm)"
+    rain_max_1_hour = "降水量_最大1時間(mm)"
+    rain_max_10_minutes = "降水量_最大10分間(mm)"
+    temperature_ave = "平均_気温(ºC)"
+    temperature_max = "最高_気温(ºC)"
+    temperature_min = "最低_気温(ºC)"
+    humidity_ave = "平均_相対湿度(%)"
+    humidity_min = "最小_相対湿度(%)"
+    ave_wind_speed = "平均_風速(m/s)"
+    max_wind_speed = "最大_風速(m/s)"
+    max_wind_direction = "最大_風向"
+    max_gust_speed = "最大瞬間_風速(m/s)"
+    max_gust_direction = "最大瞬間_風向"
+    most_frequent_direction = "最多_風向"
+    sunshine_duration = "日照時間(h)"
+    snowfall_total = "降雪_合計(cm)"
+    snow_depth_max = "最深積雪(cm)"
+    weather_daytime = "天気概況_昼"
+    weather_night = "天気概況_夜"
+
+
+class FewColumnsDailyFormatted(StrEnum):
+    day = "日"
+    rain_total = "降水量_合計(mm)"
+    rain_max_1_hour = "降水量_最大1時間(mm)"
+    rain_max_10_minutes = "降水量_最大10分間(mm)"
+    temperature_ave = "平均_気温(ºC)"
+    temperature_max = "最高_気温(ºC)"
+    temperature_min = "最低_気温(ºC)"
+    humidity_ave = "平均_相対湿度(%)"
+    humidity_min = "最小_相対湿度(%)"
+    ave_wind_speed = "平均_風速(m/s)"
+    max_wind_speed = "最大_風速(m/s)"
+    max_wind_direction = "最大_風向"
+    max_gust_speed = "最大瞬間_風速(m/s)"
+    max_gust_direction = "最大瞬間_風向"
+    most_frequent_direction = "最多_風向"
+    sunshine_duration = "日照時間(h)"
+    snowfall_total = "降雪_合計(cm)"
+    snow_depth_max = "最深積雪(cm)"
+
+
+class MainColumnsPeriodFormatted(StrEnum):
+    """半旬 (mb5daily), 旬 (10daily) ごとの値. 1ページに1年分"""
+
+    month = "月"
+    period = "期間"
+    h_pa = "現地_平均気圧(hPa)"
+    h_pa_sea = "海面_平均気圧(hPa)"
+    rain_total = "降水量_合計(mm)"
+    rain_max_1_day = "降水量_日最大(mm)"
+    rain_max_1_hour = "降水量_最大1時間(mm)"
+    temperature_ave = "平均_気温(ºC)"
+    temperature_daily_max_ave = "日最高_気温_平均(ºC)"
+    temperature_daily_min_ave = "日最低_気温_平均(ºC)"
+    temperature_max = "最高_気温(ºC)"
+    temperature_min = "最低_気温(ºC)"
+    humidity_ave = "平均_相対湿度(%)"
+    humidity_min = "最小_相対湿度(%)"
+    ave_wind_speed = "平均_風速(m/s)"
+    max_wind_speed = "最大_風速(m/s)"
+    max_wind_direction = "最大_風向"
+    max_gust_speed = "最大瞬間_風速(m/s)"
+    max_gust_direction = "最大瞬間_風向"
+    sunshine_duration = "日照時間(h)"
+    snowfall_total = "降雪_合計(cm)"
+    snow_depth_max = "最深積雪(cm)"
+
+
+class FewColumnsPeriodFormatted(StrEnum):
+    """半旬 (mb5daily), 旬 (10daily) ごとの値. 1ページに1年分"""
+
+    month = "月"
+    period = "期間"
+    rain_total = "降水量_合計(mm)"
+    rain_max_1_day = "降水量_日最大(mm)"
+    rain_max_1_hour = "降水量_最大1時間(mm)"
+    temperature_ave = "平均_気温(ºC)"
+    temperature_daily_max_ave = "日最高_気温_平均(ºC)"
+    temperature_daily_min_ave = "日最低_気温_平均(ºC)"
+    temperature_max = "最高_気温(ºC)"
+    temperature_min = "最低_気温(ºC)"
+    ave_wind_speed = "平均_風速(m/s)"
+    max_wind_speed = "最大_風速(m/s)"
+    max_wind_direction = "最大_風向"
+    max_gust_speed = "最大瞬間_風速(m/s)"
+    max_gust_direction = "最大瞬間_風向"
+    sunshine_duration = "日照時間(h)"
+    snowfall_total = "降雪_合計(cm)"
+    snow_depth_max = "最深積雪(cm)"
+
+
 COLUMNS_MAPPINGS = dict(
     zip(MainColumns10Minutes, MainColumns10MinutesFormatted, strict=True)
 )
@@ -113,7 +245,9 @@ class Columns:
             ls = [*ls, {"original": org, "after": aft}]
         return ls
 
-    def to_df(self) -> pd.DataFrame:
+    def to_df(self) -> "pd.DataFrame":
+        import pandas as pd  # CLI の起動を遅くしないよう使うときに読み込む
+
         ls_d = self._to_list_dict()
         return pd.DataFrame.from_records(ls_d)
 
@@ -149,6 +283,47 @@ class RecordInterval(StrEnum):
         """
         return cls._name_mappings()[every_xxx]
 
+    def to_literal(self) -> "TYPE_EVERY_XX":
+        """
+        >>> RecordInterval.ten_minutes.to_literal()
+        'every_10_minutes'
+        """
+        literals = {
+            enum_value: name for name, enum_value in self._name_mappings().items()
+        }
+        return literals[self]  # type: ignore
+
+    def page_date(self, date_: date) -> date:
+        """その日を含むページを表す日付. 日ごとの値は1ページに1ヶ月分, 半旬と旬は1年分.
+        >>> RecordInterval.one_day.page_date(date(2022, 3, 15))
+        datetime.date(2022, 3, 1)
+        >>> RecordInterval.ten_day_divide_for_each_mont.page_date(date(2022, 3, 15))
+        datetime.date(2022, 1, 1)
+        >>> RecordInterval.one_hour.page_date(date(2022, 3, 15))
+        datetime.date(2022, 3, 15)
+        """
+        if self is RecordInterval.one_day:
+            return date_.replace(day=1)
+        if self in (
+            RecordInterval.five_day_divide_for_each_month,
+            RecordInterval.ten_day_divide_for_each_mont,
+        ):
+            return date_.replace(month=1, day=1)
+        return date_
+
+    def page_dates(self, start_date: date, end_date: date) -> List[date]:
+        """start_date から end_date まで (両端を含む) を取得するのに必要なページの日付を新しい順に返す.
+        >>> RecordInterval.one_day.page_dates(date(2022, 1, 20), date(2022, 3, 2))
+        [datetime.date(2022, 3, 1), datetime.date(2022, 2, 1), datetime.date(2022, 1, 1)]
+        """
+        pages: List[date] = []
+        current_day = end_date
+        while current_day >= start_date:
+            page = self.page_date(current_day)
+            pages.append(page)
+            current_day = page - timedelta(days=1)
+        return pages
+
     def with_location_col_type(self, location_column_type: "LocationColumnType") -> str:
         """
         >>> lc_main = LocationColumnType.main
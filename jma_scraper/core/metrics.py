@@ -0,0 +1,302 @@
+"""取得, パース, 保存の各段階の処理時間, 件数, バイト数の計測.
+
+既定では無効で, 無効の間は timer() も timed() も enabled を1回見るだけで何もしない.
+
+>>> metrics = Metrics(enabled=True)
+>>> with metrics.timer("fetch"):
+...     pass
+>>> metrics.inc("pages_ok")
+>>> metrics.add_bytes("fetch", "in", 1024)
+>>> metrics.summary()["counters"]
+{'pages_ok': 1}
+>>> print(metrics.to_prometheus().splitlines()[-1])
+jma_bytes_total{stage="fetch",direction="in"} 1024
+"""
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from types import FrameType, TracebackType
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+# 秒. 1ページの取得は数百ミリ秒, パースは数ミリ秒から数十ミリ秒
+BUCKETS_SEC: Tuple[float, ...] = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+@dataclass
+class Histogram:
+    """Prometheus の histogram と同じく, バケットごとの件数と合計を持つ"""
+
+    bucket_counts: List[int] = field(default_factory=lambda: [0] * len(BUCKETS_SEC))
+    count: int = 0
+    sum_sec: float = 0.0
+    max_sec: float = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.sum_sec += seconds
+        self.max_sec = max(self.max_sec, seconds)
+        for i, upper in enumerate(BUCKETS_SEC):
+            if seconds <= upper:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """Prometheus の histogram_quantile と同じくバケット内を線形補間した分位点.
+        最大のバケットを超えた場合は max_sec
+
+        >>> h = Histogram()
+        >>> for seconds in (0.02, 0.03, 0.04, 0.2):
+        ...     h.observe(seconds)
+        >>> round(h.quantile(0.5), 4)
+        0.0375
+        """
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for upper, bucket_count in zip(BUCKETS_SEC, self.bucket_counts, strict=True):
+            if bucket_count and cumulative + bucket_count >= rank:
+                estimate = lower + (upper - lower) * (rank - cumulative) / bucket_count
+                return min(estimate, self.max_sec)
+            cumulative += bucket_count
+            lower = upper
+        return self.max_sec
+
+
+class Metrics:
+    """スレッドセーフな計測値の入れ物. 通常はモジュールの METRICS を使う"""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started_at = datetime.now()
+            self._started = time.perf_counter()
+            self.histograms: Dict[str, Histogram] = {}
+            self.counters: Counter[str] = Counter()
+            self.bytes: Counter[Tuple[str, str]] = Counter()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += value
+
+    def add_bytes(self, stage: str, direction: str, n_bytes: int) -> None:
+        """direction は "in" (受け取った) か "out" (書き出した)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.bytes[(stage, direction)] += n_bytes
+
+    def timer(self, stage: str) -> ContextManager[None]:
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timer(stage)
+
+    @contextlib.contextmanager
+    def _timer(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def summary(self) -> Dict[str, Any]:
+        """JSON にできる実行のまとめ"""
+        with self._lock:
+            elapsed_sec = time.perf_counter() - self._started
+            return {
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "elapsed_sec": elapsed_sec,
+                "stages": {
+                    stage: {
+                        "count": h.count,
+                        "total_sec": h.sum_sec,
+                        "mean_ms": h.sum_sec / h.count * 1000 if h.count else 0.0,
+                        "p50_ms": h.quantile(0.5) * 1000,
+                        "p95_ms": h.quantile(0.95) * 1000,
+                        "max_ms": h.max_sec * 1000,
+                        "per_sec": h.count / elapsed_sec if elapsed_sec > 0 else 0.0,
+                    }
+                    for stage, h in sorted(self.histograms.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+                "bytes": {
+                    f"{stage}.{direction}": n_bytes
+                    for (stage, direction), n_bytes in sorted(self.bytes.items())
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        """Prometheus の text exposition format"""
+        lines = [
+            "# TYPE jma_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for upper, bucket_count in zip(
+                    BUCKETS_SEC, h.bucket_counts, strict=True
+                ):
+                    cumulative += bucket_count
+                    lines.append(
+                        f'jma_stage_seconds_bucket{{stage="{stage}",le="{upper}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'jma_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}'
+                )
+                lines.append(f'jma_stage_seconds_sum{{stage="{stage}"}} {h.sum_sec}')
+                lines.append(f'jma_stage_seconds_count{{stage="{stage}"}} {h.count}')
+            lines.append("# TYPE jma_events_total counter")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'jma_events_total{{name="{name}"}} {value}')
+            lines.append("# TYPE jma_bytes_total counter")
+            for (stage, direction), n_bytes in sorted(self.bytes.items()):
+                lines.append(
+                    f'jma_bytes_total{{stage="{stage}",direction="{direction}"}} {n_bytes}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def write(self, out_dir: Path) -> None:
+        """out_dir に metrics.prom と run_summary.json を書き出す"""
+        out_dir.mkdir(parents=True, exist_ok=True)
+        (out_dir / "metrics.prom").write_text(self.to_prometheus())
+        (out_dir / "run_summary.json").write_text(
+            json.dumps(self.summary(), indent=2, ensure_ascii=False) + "\n"
+        )
+
+
+_NULL_TIMER: ContextManager[None] = contextlib.nullcontext()
+
+METRICS = Metrics()
+
+
+def timed(stage: str, metrics: Optional[Metrics] = None) -> Callable[[F], F]:
+    """関数の処理時間を stage として記録するデコレータ. metrics を省略した場合は METRICS"""
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            target = metrics if metrics is not None else METRICS
+            if not target.enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                target.observe(stage, time.perf_counter() - started)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+class SamplingProfiler:
+    """別スレッドから interval_sec ごとに全スレッドのスタックを覗くプロファイラ.
+    計測対象のコードには手を入れないので, 関数ごとの計測より偏りが少ない.
+    結果は flamegraph.pl や speedscope が読める collapsed stack 形式で書き出す.
+
+    >>> with SamplingProfiler() as profiler:  # doctest: +SKIP
+    ...     hamamatsu_10minutes_save_as_csv()
+    >>> profiler.write(Path("profile.folded"))  # doctest: +SKIP
+    """
+
+    def __init__(self, interval_sec: float = 0.005):
+        self.interval_sec = interval_sec
+        self.samples: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _collapse(frame: Optional[FrameType]) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({Path(code.co_filename).name})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval_sec):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.samples[self._collapse(frame)] += 1
+
+    def start(self) -> "SamplingProfiler":
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="jma-sampling-profiler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "SamplingProfiler":
+        return self.start()
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.stop()
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.samples.most_common()
+        )
+
+    def write(self, path: Path) -> None:
+        path.write_text(self.collapsed())
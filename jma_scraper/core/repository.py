@@ -1,11 +1,13 @@
 import abc
 from abc import ABC
+from dataclasses import dataclass
 from datetime import date
-from typing import Any, Protocol, runtime_checkable
+from typing import Any, Optional, Protocol, Sequence, Tuple, runtime_checkable
 
 from pydantic import BaseModel, Field
 
 from jma_scraper.core.location_spec import TYPE_EVERY_XX
+from jma_scraper.core.metrics import timed
 from jma_scraper.core.url_formatter import QueryParamsForJma
 
 
@@ -36,10 +38,86 @@ class Fetcher(Protocol):
         ...
 
 
+@runtime_checkable
+class AsyncFetcher(Protocol):
+    """Fetcher の asyncio 版. 並行バックフィルで使う."""
+
+    async def __call__(
+        self, query_param: QueryParamsForJma, time_out_sec: float = 2.0
+    ) -> str:
+        ...
+
+
+@dataclass(eq=True, frozen=True)
+class ConditionalPage:
+    """条件つきで取得した結果. 前回から変わっていない (304) 場合は html_text が None"""
+
+    html_text: Optional[str]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.html_text is None
+
+
+@runtime_checkable
+class ConditionalFetcher(Protocol):
+    """If-None-Match / If-Modified-Since を送れる AsyncFetcher. 再検証で使う"""
+
+    async def fetch_if_modified(
+        self,
+        query_param: QueryParamsForJma,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        time_out_sec: float = 2.0,
+    ) -> ConditionalPage:
+        ...
+
+
+@runtime_checkable
+class HtmlCache(Protocol):
+    """取得したページの生htmlのキャッシュ. key には QueryParamsForJma.query_url を使う."""
+
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    def put(self, key: str, html_text: str) -> str:
+        """保存して内容のダイジェストを返す"""
+        ...
+
+
+@runtime_checkable
+class AuditLog(Protocol):
+    """db_tables の行 (FetchedHtml, FetchFailed など) の記録先. 書き込みを待たずに返す."""
+
+    def record(self, row: Any) -> None:
+        ...
+
+
 class Writer(ABC):
+    def __init_subclass__(cls, **kwargs: Any):
+        # 実装クラスの write を "write.<クラス名>" として計測する
+        super().__init_subclass__(**kwargs)
+        if "write" in cls.__dict__:
+            cls.write = timed(f"write.{cls.__name__}")(cls.write)  # type: ignore[method-assign]
+
     def __init__(self, src_values: WriterSrcValues, *args: Any, **kwargs: Any):
         self.src_name = src_values
 
     @abc.abstractmethod
     def write(self, src: Any, dst: Any) -> None:
         ...
+
+
+@runtime_checkable
+class BatchWriter(Protocol):
+    """複数ページをまとめて書き込める writer_factory. backfill は batch_pages ページずつ write_many に渡す"""
+
+    batch_pages: int
+
+    def __call__(self, src_values: WriterSrcValues) -> Writer:
+        ...
+
+    def write_many(self, frames: Sequence[Tuple[WriterSrcValues, Any]]) -> None:
+        ...
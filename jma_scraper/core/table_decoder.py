@@ -0,0 +1,325 @@
+"""tablefix1 を pd.read_html を通さずにセル単位で直接デコードする.
+
+数値はfloat32の2次元配列, 気象庁の値の記号 (")", "]", "×", "///", "--" など) は
+同じ形の uint8 の品質フラグ配列として1パスで取り出す.
+"""
+import html
+import re
+from dataclasses import dataclass, field
+from enum import IntEnum, StrEnum
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Type
+
+import numpy as np
+import pandas as pd
+
+from jma_scraper.core.column_plan import PLANS, TableLayout
+from jma_scraper.core.errors import LayoutMismatchError
+from jma_scraper.core.html_to_dataframe import HtmlText, pluck_table_from_html
+from jma_scraper.core.location_spec import (
+    FewColumns10Minutes,
+    FewColumns10MinutesFormatted,
+    FewColumnsDailyFormatted,
+    FewColumnsHourlyFormatted,
+    FewColumnsPeriodFormatted,
+    LocationColumnType,
+    MainColumns10Minutes,
+    MainColumns10MinutesFormatted,
+    MainColumnsDailyFormatted,
+    MainColumnsHourlyFormatted,
+    MainColumnsPeriodFormatted,
+    RecordInterval,
+)
+from jma_scraper.core.metrics import timed
+from jma_scraper.core.repository import Fetcher, HtmlCache
+from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.infrastracture.html_cache import CachedFetcher
+from jma_scraper.infrastracture.http_client import fetch_html
+
+
+class QualityFlag(IntEnum):
+    """セルの値に付く気象庁の記号
+    https://www.data.jma.go.jp/obd/stats/data/mdrr/man/remark.html
+    """
+
+    normal = 0
+    quasi_normal = 1  # ")" 準正常値. 値はそのまま使える
+    insufficient = 2  # "]" 資料不足値
+    dubious = 3  # "#" 疑問値
+    no_phenomenon = 4  # "--" 該当現象なし. 値は 0 とする
+    missing = 5  # "×" 欠測
+    not_observed = 6  # "///" 観測していない, 統計していない
+    blank = 7  # 空欄. 夜間の日照時間など
+
+
+# 値の後ろに付く記号
+_SUFFIX_FLAGS: Dict[str, QualityFlag] = {
+    ")": QualityFlag.quasi_normal,
+    "]": QualityFlag.insufficient,
+    "#": QualityFlag.dubious,
+}
+
+# 16方位. 北を360度, 静穏を0度とする気象庁の表記に合わせる
+WIND_DIRECTIONS_16: Tuple[str, ...] = (
+    "北北東",
+    "北東",
+    "東北東",
+    "東",
+    "東南東",
+    "南東",
+    "南南東",
+    "南",
+    "南南西",
+    "南西",
+    "西南西",
+    "西",
+    "西北西",
+    "北西",
+    "北北西",
+    "北",
+)
+WIND_DIRECTION_DEGREES: Dict[str, float] = {
+    direction: 22.5 * (i + 1) for i, direction in enumerate(WIND_DIRECTIONS_16)
+}
+WIND_DIRECTION_DEGREES["静穏"] = 0.0
+
+_ROW = re.compile(r"<tr\b[^>]*>(.*?)</tr>", re.IGNORECASE | re.DOTALL)
+_CELL = re.compile(r"<td\b[^>]*>(.*?)</td>", re.IGNORECASE | re.DOTALL)
+_TAG = re.compile(r"<[^>]+>")
+_IMG_ALT = re.compile(r"<img\b[^>]*\balt=[\"']([^\"']*)[\"']", re.IGNORECASE)
+
+
+# 数値にせず文字列のまま残す列の Enum のメンバー名
+_TEXT_MEMBERS = frozenset(
+    {"weather", "weather_daytime", "weather_night", "cloud_amount"}
+)
+
+
+def _layout_from_enum(
+    columns: Type[StrEnum],
+    label_columns: int = 1,
+    original: Optional[Type[StrEnum]] = None,
+) -> TableLayout:
+    """original は元の見出しの Enum. 分かっているレイアウトだけ見出しの中身まで確かめる"""
+    members = list(columns.__members__.items())
+    return TableLayout(
+        columns=tuple(member for _, member in members),
+        direction_columns=frozenset(
+            member for name, member in members if name.endswith("direction")
+        ),
+        text_columns=frozenset(
+            member for name, member in members if name in _TEXT_MEMBERS
+        ),
+        label_columns=label_columns,
+        original_columns=() if original is None else tuple(original),
+    )
+
+
+TEN_MINUTES_LAYOUTS: Dict[LocationColumnType, TableLayout] = {
+    LocationColumnType.main: _layout_from_enum(
+        MainColumns10MinutesFormatted, original=MainColumns10Minutes
+    ),
+    LocationColumnType.few: _layout_from_enum(
+        FewColumns10MinutesFormatted, original=FewColumns10Minutes
+    ),
+}
+
+LAYOUTS: Dict[Tuple[RecordInterval, LocationColumnType], TableLayout] = {
+    (RecordInterval.ten_minutes, LocationColumnType.main): TEN_MINUTES_LAYOUTS[
+        LocationColumnType.main
+    ],
+    (RecordInterval.ten_minutes, LocationColumnType.few): TEN_MINUTES_LAYOUTS[
+        LocationColumnType.few
+    ],
+    (RecordInterval.one_hour, LocationColumnType.main): _layout_from_enum(
+        MainColumnsHourlyFormatted
+    ),
+    (RecordInterval.one_hour, LocationColumnType.few): _layout_from_enum(
+        FewColumnsHourlyFormatted
+    ),
+    (RecordInterval.one_day, LocationColumnType.main): _layout_from_enum(
+        MainColumnsDailyFormatted
+    ),
+    (RecordInterval.one_day, LocationColumnType.few): _layout_from_enum(
+        FewColumnsDailyFormatted
+    ),
+}
+for _interval in (
+    RecordInterval.five_day_divide_for_each_month,
+    RecordInterval.ten_day_divide_for_each_mont,
+):
+    LAYOUTS[(_interval, LocationColumnType.main)] = _layout_from_enum(
+        MainColumnsPeriodFormatted, label_columns=2
+    )
+    LAYOUTS[(_interval, LocationColumnType.few)] = _layout_from_enum(
+        FewColumnsPeriodFormatted, label_columns=2
+    )
+
+
+def layout_for(
+    record_interval: RecordInterval, location_col_type: LocationColumnType
+) -> TableLayout:
+    """
+    >>> [str(c) for c in layout_for(RecordInterval.one_hour, LocationColumnType.few).columns[:3]]
+    ['時', '降水量(mm)', '気温(ºC)']
+    """
+    try:
+        return LAYOUTS[(record_interval, location_col_type)]
+    except KeyError as e:
+        raise LayoutMismatchError(
+            f"No table layout for {record_interval.with_location_col_type(location_col_type)}"
+        ) from e
+
+
+@lru_cache(maxsize=8192)
+def decode_cell(text: str, is_direction: bool = False) -> Tuple[float, QualityFlag]:
+    """セルの文字列を (値, 品質フラグ) にする. 風向は度数にする.
+    >>> decode_cell("1017.2")
+    (1017.2, <QualityFlag.normal: 0>)
+    >>> decode_cell("6.5)")
+    (6.5, <QualityFlag.quasi_normal: 1>)
+    >>> decode_cell("--")
+    (0.0, <QualityFlag.no_phenomenon: 4>)
+    >>> decode_cell("西北西", is_direction=True)
+    (292.5, <QualityFlag.normal: 0>)
+    """
+    text = text.strip()
+    if not text:
+        return float("nan"), QualityFlag.blank
+    if text == "--":
+        return 0.0, QualityFlag.no_phenomenon
+    if text.startswith("///"):
+        return float("nan"), QualityFlag.not_observed
+    if text.startswith("×"):
+        return float("nan"), QualityFlag.missing
+
+    flag = QualityFlag.normal
+    if text[-1] in _SUFFIX_FLAGS:
+        flag = _SUFFIX_FLAGS[text[-1]]
+        text = text[:-1].rstrip()
+
+    try:
+        if is_direction:
+            return WIND_DIRECTION_DEGREES[text], flag
+        return float(text), flag
+    except (KeyError, ValueError) as e:
+        raise ValueError(f"Unknown cell value in the JMA table: {text!r}") from e
+
+
+@dataclass(eq=False, frozen=True)
+class DecodedTable:
+    """decode_table の結果. values と flags は (行数, 値の列数) の同じ形.
+    text_columns の列は values では NaN で, 文字列は texts に入る.
+    """
+
+    layout: TableLayout
+    labels: Tuple[Tuple[str, ...], ...]  # 行ラベル列ごとの値
+    values: np.ndarray
+    flags: np.ndarray
+    texts: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+
+    @property
+    def row_labels(self) -> Tuple[str, ...]:
+        return self.labels[0]
+
+    def to_frame(self) -> pd.DataFrame:
+        """format_columns 後と同じ列名で, 値の列は float32 の DataFrame"""
+        df = pd.DataFrame(
+            self.values, columns=list(self.layout.value_columns), copy=False
+        )
+        for col, texts in self.texts.items():
+            df[col] = list(texts)
+        for i, col in enumerate(self.layout.label_column_names):
+            df.insert(i, col, list(self.labels[i]))
+        return df
+
+    def flags_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            self.flags, columns=list(self.layout.value_columns), copy=False
+        )
+
+
+def _cell_text(raw: str) -> str:
+    if "<" in raw:
+        # 天気はアイコン画像の alt に入っている
+        alt = _IMG_ALT.search(raw)
+        raw = alt.group(1) if alt is not None else _TAG.sub("", raw)
+    if "&" in raw:
+        raw = html.unescape(raw)
+    return raw
+
+
+def _split_rows(table_html: HtmlText, layout: TableLayout) -> List[List[str]]:
+    n_cols = len(layout.columns)
+    rows: List[List[str]] = []
+    for row in _ROW.finditer(table_html):
+        cells = _CELL.findall(row.group(1))
+        if not cells:
+            continue
+        missing_labels = n_cols - len(cells)
+        if rows and 0 < missing_labels < layout.label_columns:
+            # 月などの行ラベルが rowspan で省略されている行は前の行のラベルを使う
+            cells = rows[-1][:missing_labels] + cells
+        if len(cells) != n_cols:
+            raise LayoutMismatchError(
+                f"The table row should have {n_cols} cells, got {len(cells)}. The layout may be different."
+            )
+        rows.append(cells)
+    return rows
+
+
+@timed("decode_table")
+def decode_table(
+    html_text: HtmlText, layout: Optional[TableLayout] = None
+) -> DecodedTable:
+    """ページ全体, または tablefix1 部分のhtmlを read_html を使わずにデコードする.
+    見出し行 (td を含まない行) は本体より先に PLANS で照合し, 列数の合わないレイアウトは本体を読む前に弾く.
+    layout を省略した場合は見出しから作った列名を使う.
+    """
+    table_html = pluck_table_from_html(html_text)
+    layout = PLANS.plan_for(table_html, layout).layout
+    rows = _split_rows(table_html, layout)
+
+    n_labels = layout.label_columns
+    value_columns = layout.value_columns
+    values = np.empty((len(rows), len(value_columns)), dtype=np.float32)
+    flags = np.empty((len(rows), len(value_columns)), dtype=np.uint8)
+    is_direction = [col in layout.direction_columns for col in value_columns]
+    is_text = [col in layout.text_columns for col in value_columns]
+    labels: List[List[str]] = [[] for _ in range(n_labels)]
+    texts: Dict[str, List[str]] = {
+        col: [] for col in value_columns if col in layout.text_columns
+    }
+    for i, cells in enumerate(rows):
+        for k in range(n_labels):
+            labels[k].append(_cell_text(cells[k]).strip())
+        for j, raw in enumerate(cells[n_labels:]):
+            text = _cell_text(raw)
+            if is_text[j]:
+                texts[value_columns[j]].append(text.strip())
+                values[i, j] = np.nan
+                flags[i, j] = QualityFlag.normal if text.strip() else QualityFlag.blank
+                continue
+            values[i, j], flags[i, j] = decode_cell(text, is_direction[j])
+
+    return DecodedTable(
+        layout=layout,
+        labels=tuple(tuple(label) for label in labels),
+        values=values,
+        flags=flags,
+        texts={col: tuple(text) for col, text in texts.items()},
+    )
+
+
+def fetch_decoded_df(
+    qp: QueryParamsForJma,
+    fetcher: Fetcher = fetch_html,
+    time_out_sec: float = 2.0,
+    cache: Optional[HtmlCache] = None,
+) -> pd.DataFrame:
+    """fetch_df の decode_table 版. 取得間隔, 観測地点の種類からレイアウトを選ぶ"""
+    layout = layout_for(qp.record_interval, qp.location_col_type)
+    if cache is not None:
+        fetcher = CachedFetcher(fetcher, cache)
+    html_text = fetcher(qp, time_out_sec=time_out_sec)
+    return decode_table(html_text, layout).to_frame()
@@ -0,0 +1,127 @@
+"""時分 ("00:10" … "24:00") と日付から, JST の DatetimeIndex を行ごとの Python 関数なしで作る.
+
+気象庁の "24:00" はその日の終わり, つまり翌日の 00:00. 日付に分を足すだけなので繰り上がりは自然に扱える.
+時分の文字列は "HH:MM" の固定長なので, 文字コードの配列として見て数字を取り出す.
+
+>>> index = jst_index_for_day(["00:10", "12:00", "24:00"], date(2022, 1, 31))
+>>> [str(t) for t in index]
+['2022-01-31 00:10:00+09:00', '2022-01-31 12:00:00+09:00', '2022-02-01 00:00:00+09:00']
+>>> index.name
+'datetime'
+"""
+from datetime import date
+from typing import Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from jma_scraper.core.location_spec import MainColumns10MinutesFormatted
+
+JST = "Asia/Tokyo"
+TIMESTAMP_INDEX = "datetime"
+HOUR_MINUTES_COLUMN: str = MainColumns10MinutesFormatted.hour_minutes
+HOUR_COLUMN = "時"  # 1時間ごとのページ. 1 … 24 の整数
+
+# 1951年以降の日本の時刻は夏時間がなく UTC+9 で一定
+_JST_OFFSET = np.timedelta64(9, "h")
+_ZERO = ord("0")
+
+ArrayLike = Union[Sequence, np.ndarray, pd.Series, pd.Index]
+
+
+def minutes_of_day(hour_minutes: ArrayLike) -> np.ndarray:
+    """ "HH:MM" の配列をその日の 0:00 からの分 (int64) にする. "24:00" は 1440.
+    compact_frame で分の整数にした列はそのまま int64 にする.
+
+    >>> minutes_of_day(["00:10", "09:30", "24:00"])
+    array([  10,  570, 1440])
+    """
+    values = np.asarray(hour_minutes)
+    if np.issubdtype(values.dtype, np.integer):
+        return values.astype(np.int64)
+    values = values.astype("U5")
+    codes = values.view(np.uint32).reshape(-1, 5).astype(np.int64) - _ZERO
+    digits = codes[:, [0, 1, 3, 4]]
+    hours = digits[:, 0] * 10 + digits[:, 1]
+    minutes = digits[:, 2] * 10 + digits[:, 3]
+    bad = (
+        (codes[:, 2] != ord(":") - _ZERO)
+        | ((digits < 0) | (digits > 9)).any(axis=1)
+        | (minutes >= 60)
+        | (hours * 60 + minutes > 24 * 60)
+    )
+    if bad.any():
+        raise ValueError(
+            f"{HOUR_MINUTES_COLUMN} should be HH:MM up to 24:00, got {values[bad][:5].tolist()}"
+        )
+    return hours * 60 + minutes
+
+
+def _days(dates: ArrayLike) -> np.ndarray:
+    """date, 日付の文字列, datetime64 の配列を datetime64[D] にする. 変換は重複を除いた日付ごとに1回"""
+    codes, uniques = pd.factorize(np.asarray(dates))
+    if (codes < 0).any():
+        raise ValueError("dates should not contain missing values")
+    return np.asarray(pd.to_datetime(uniques)).astype("datetime64[D]")[codes]
+
+
+def jst_index(dates: ArrayLike, minutes: ArrayLike) -> pd.DatetimeIndex:
+    """行ごとの日付と 0:00 からの分から JST の DatetimeIndex を作る.
+    何千日分を連結した配列でも, 日付の変換以外は NumPy の演算1回ずつで済む.
+    """
+    minutes = np.asarray(minutes, dtype=np.int64)
+    days = _days(dates)
+    if len(days) != len(minutes):
+        raise ValueError(
+            f"dates and minutes should be the same length, got {len(days)} and {len(minutes)}"
+        )
+    utc = days.astype("datetime64[m]") + minutes.astype("timedelta64[m]") - _JST_OFFSET
+    return (
+        pd.DatetimeIndex(utc.astype("datetime64[ns]"), name=TIMESTAMP_INDEX)
+        .tz_localize("UTC")
+        .tz_convert(JST)
+    )
+
+
+def jst_index_for_day(hour_minutes: ArrayLike, date_: date) -> pd.DatetimeIndex:
+    """1日分のページの時分の列から作る"""
+    minutes = minutes_of_day(hour_minutes)
+    return jst_index(np.full(len(minutes), np.datetime64(date_, "D")), minutes)
+
+
+def _minutes_column(df: pd.DataFrame) -> Union[np.ndarray, None]:
+    if HOUR_MINUTES_COLUMN in df.columns:
+        return minutes_of_day(df[HOUR_MINUTES_COLUMN].to_numpy())
+    if HOUR_COLUMN in df.columns:
+        return df[HOUR_COLUMN].to_numpy(dtype=np.int64) * 60
+    return None
+
+
+def with_jst_index(df: pd.DataFrame, date_: date) -> pd.DataFrame:
+    """時分 (または時) の列がある1日分の DataFrame に JST の index を付ける.
+    列はそのまま残すので, index=False で書き出すCSVなどの中身は変わらない.
+    日ごとの値など時刻のないページはそのまま返す.
+    """
+    minutes = _minutes_column(df)
+    if minutes is None:
+        return df
+    df.index = jst_index(np.full(len(df), np.datetime64(date_, "D")), minutes)
+    return df
+
+
+def jst_index_from_columns(
+    df: pd.DataFrame, date_column: str = "date"
+) -> pd.DatetimeIndex:
+    """日付の列と時分 (または時) の列を持つ, 複数日を連結した DataFrame の index を作る.
+    Parquet から読み込んだ何年分ものデータの結合やリサンプリングの前に使う.
+
+    >>> df = pd.DataFrame({"date": [date(2022, 1, 1), date(2022, 1, 2)], "時分": ["24:00", "00:10"]})
+    >>> [str(t) for t in jst_index_from_columns(df)]
+    ['2022-01-02 00:00:00+09:00', '2022-01-02 00:10:00+09:00']
+    """
+    minutes = _minutes_column(df)
+    if minutes is None:
+        raise ValueError(
+            f"df should have {HOUR_MINUTES_COLUMN} or {HOUR_COLUMN} column, got {list(df.columns)}"
+        )
+    return jst_index(df[date_column].to_numpy(), minutes)
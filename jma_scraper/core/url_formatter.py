@@ -4,6 +4,7 @@ from urllib.parse import parse_qs, urlparse
 
 from pydantic import BaseModel, Field, HttpUrl, PastDate
 
+from jma_scraper.core.errors import PageUrlError
 from jma_scraper.core.location_spec import Location, LocationColumnType, RecordInterval
 
 
@@ -153,7 +154,7 @@ class QueryParamsForJma(BaseModel):
         result = path.split("/")[-1].split(".")[0].split("_")[1]
 
         if result not in set(LocationColumnType):
-            raise ValueError(
+            raise PageUrlError(
                 f"Column type should be in the one of {list(LocationColumnType)}, but got: {result}"
             )
         return result  # type: ignore
@@ -0,0 +1,110 @@
+import queue
+import threading
+from types import TracebackType
+from typing import List, Optional, Type
+
+from loguru import logger
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, SQLModel
+
+_STOP = object()
+
+
+class AuditLogWriter:
+    """db_tables の記録をバックグラウンドのスレッドでまとめて commit する.
+
+    record() はキューに積むだけなので, 取得処理のワーカーは DB の書き込みを待たない.
+    batch_size 件たまるか flush_interval_sec 経つと1トランザクションで書き込む.
+
+    >>> with AuditLogWriter(engine) as audit:  # doctest: +SKIP
+    ...     audit.record(FetchedHtml(url=url, digest=digest))
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        batch_size: int = 500,
+        flush_interval_sec: float = 1.0,
+    ):
+        if batch_size < 1:
+            raise ValueError(f"batch_size should be 1 or more, got {batch_size}")
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval_sec = flush_interval_sec
+        self._queue: "queue.Queue[object]" = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="jma-audit-log", daemon=True
+        )
+        self._closed = False
+        self._thread.start()
+
+    def record(self, row: SQLModel) -> None:
+        if self._closed:
+            raise RuntimeError("AuditLogWriter is already closed")
+        self._queue.put(row)
+
+    def flush(self) -> None:
+        """それまでに record した行が commit されるまで待つ"""
+        self._queue.join()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def __enter__(self) -> "AuditLogWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def _next_batch(self) -> List[object]:
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval_sec))
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, rows: List[SQLModel]) -> None:
+        try:
+            self._commit_all(rows)
+        except Exception as e:
+            # 1行の不正で他の行まで捨てないよう, 1行ずつ書き直して失敗した行だけを記録する
+            logger.warning("Failed to write {} audit rows at once: {}", len(rows), e)
+            for row in rows:
+                try:
+                    self._commit_all([row])
+                except Exception as row_error:
+                    # 監査ログの失敗で取得処理を止めない
+                    logger.error("Failed to write audit row {!r}: {}", row, row_error)
+
+    def _commit_all(self, rows: List[SQLModel]) -> None:
+        with Session(self.engine) as session:
+            try:
+                session.add_all(rows)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+    def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            batch = self._next_batch()
+            rows = [row for row in batch if row is not _STOP]
+            stopped = len(rows) != len(batch)
+            try:
+                if rows:
+                    self._commit(rows)  # type: ignore[arg-type]
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
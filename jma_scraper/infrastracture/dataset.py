@@ -0,0 +1,207 @@
+"""保存済みの Parquet アーカイブを, 必要になるまで読まずに絞り込む JmaDataset.
+
+観測地点と年はパーティションのパスで, 期間は row group の日付の統計で, 変数は列の指定で絞るので,
+読むのは選んだ観測地点, 期間の row group の, 選んだ列の分だけ. to_arrow, to_pandas を呼ぶまでは
+ファイルのフッターしか読まない.
+
+>>> ds = JmaDataset(Path("root")).select("hamamatsu", ["気温(ºC)"], date(2022, 1, 1), date(2022, 1, 31))
+>>> ds.stations, ds.variables
+(('hamamatsu',), ('気温(ºC)',))
+>>> ds.select(end=date(2022, 2, 28)).end
+datetime.date(2022, 2, 28)
+"""
+from dataclasses import dataclass, replace
+from datetime import date
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from jma_scraper.core.aggregation import Level
+from jma_scraper.core.metrics import METRICS, timed
+from jma_scraper.core.timestamps import (
+    HOUR_COLUMN,
+    HOUR_MINUTES_COLUMN,
+    jst_index_from_columns,
+)
+from jma_scraper.infrastracture.parquet import (
+    DATE_COLUMN,
+    JMA_PARQUET_DIR,
+    PARTITION_FILE,
+    PERIOD_COLUMN,
+)
+from jma_scraper.infrastracture.pyramid import RAW_INTERVAL
+
+STATION_COLUMN = "station"
+_KEY_COLUMNS = (
+    DATE_COLUMN,
+    str(HOUR_COLUMN),
+    str(HOUR_MINUTES_COLUMN),
+    PERIOD_COLUMN,
+)
+
+
+@dataclass(eq=True, frozen=True)
+class Fragment:
+    """1つのパーティションのファイルのうち, 読む row group と列"""
+
+    path: Path
+    station: str
+    row_groups: Tuple[int, ...]
+    columns: Tuple[str, ...]
+    n_bytes: int  # 読む row group, 列の圧縮後のバイト数
+
+
+def _names(values: Union[str, Sequence[str], None]) -> Optional[Tuple[str, ...]]:
+    if values is None:
+        return None
+    return (values,) if isinstance(values, str) else tuple(values)
+
+
+@dataclass(eq=True, frozen=True)
+class JmaDataset:
+    """root 以下の source (10分ごとの値 "every_10_minutes", またはピラミッドの hourly, daily, monthly).
+    select で絞り込んだ新しい JmaDataset を返し, to_arrow, to_pandas で初めて値を読む.
+    """
+
+    root: Path = JMA_PARQUET_DIR
+    source: str = RAW_INTERVAL
+    stations: Optional[Tuple[str, ...]] = None  # None は全ての観測地点
+    variables: Optional[Tuple[str, ...]] = None  # None は全ての列
+    start: Optional[date] = None
+    end: Optional[date] = None
+
+    def select(
+        self,
+        stations: Union[str, Sequence[str], None] = None,
+        variables: Union[str, Sequence[str], None] = None,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+    ) -> "JmaDataset":
+        """指定した条件だけを置き換える. start, end は両端を含む日付"""
+        changes = {
+            "stations": _names(stations),
+            "variables": _names(variables),
+            "start": start,
+            "end": end,
+        }
+        return replace(self, **{k: v for k, v in changes.items() if v is not None})
+
+    def _source_dir(self) -> str:
+        if self.source in set(Level):
+            return f"pyramid={self.source}"
+        return f"interval={self.source}"
+
+    def _station_names(self) -> List[str]:
+        if self.stations is not None:
+            return list(self.stations)
+        return sorted(
+            path.name.split("=", 1)[1] for path in self.root.glob("station=*")
+        )
+
+    def _year_selected(self, path: Path) -> bool:
+        year = int(path.parent.name.split("=", 1)[1])
+        return (self.start is None or year >= self.start.year) and (
+            self.end is None or year <= self.end.year
+        )
+
+    def files(self) -> List[Tuple[str, Path]]:
+        """観測地点と年のパーティションで絞った (観測地点, ファイル). 中身は読まない"""
+        found = []
+        for station in self._station_names():
+            source_dir = self.root / f"station={station}" / self._source_dir()
+            for path in sorted(source_dir.glob(f"year=*/{PARTITION_FILE}")):
+                if self._year_selected(path):
+                    found.append((station, path))
+        return found
+
+    def _overlaps(self, statistics: Optional[pq.Statistics]) -> bool:
+        if statistics is None or not statistics.has_min_max:
+            return True
+        return (self.start is None or statistics.max >= self.start) and (
+            self.end is None or statistics.min <= self.end
+        )
+
+    def fragments(self) -> List[Fragment]:
+        """ファイルのフッターだけを読んで, 読む row group と列を決める"""
+        fragments = []
+        for station, path in self.files():
+            metadata = pq.read_metadata(path)
+            names = metadata.schema.to_arrow_schema().names
+            if self.variables is None:
+                columns = names
+            else:
+                keys = [name for name in _KEY_COLUMNS if name in names]
+                columns = keys + [name for name in self.variables if name in names]
+            date_index = names.index(DATE_COLUMN)
+            row_groups = tuple(
+                i
+                for i in range(metadata.num_row_groups)
+                if self._overlaps(metadata.row_group(i).column(date_index).statistics)
+            )
+            n_bytes = sum(
+                metadata.row_group(i).column(names.index(name)).total_compressed_size
+                for i in row_groups
+                for name in columns
+            )
+            fragments.append(
+                Fragment(path, station, row_groups, tuple(columns), n_bytes)
+            )
+        return fragments
+
+    def scanned_bytes(self) -> int:
+        """to_arrow で読む圧縮後のバイト数"""
+        return sum(fragment.n_bytes for fragment in self.fragments())
+
+    def _in_range(self, table: pa.Table) -> pa.Table:
+        mask = None
+        if self.start is not None:
+            mask = pc.greater_equal(table[DATE_COLUMN], pa.scalar(self.start))
+        if self.end is not None:
+            before_end = pc.less_equal(table[DATE_COLUMN], pa.scalar(self.end))
+            mask = before_end if mask is None else pc.and_(mask, before_end)
+        return table if mask is None else table.filter(mask)
+
+    @timed("dataset_read")
+    def to_arrow(self) -> pa.Table:
+        """先頭に station の列を足した Arrow Table. 観測地点で列が違う場合はない列を null にする"""
+        fragments = self.fragments()
+        if self.variables is not None and fragments:
+            found = {name for fragment in fragments for name in fragment.columns}
+            missing = [name for name in self.variables if name not in found]
+            if missing:
+                raise ValueError(f"Unknown variables {missing} in {self.source}")
+        tables = []
+        for fragment in fragments:
+            if not fragment.row_groups:
+                continue
+            table = pq.ParquetFile(fragment.path).read_row_groups(
+                list(fragment.row_groups), columns=list(fragment.columns)
+            )
+            METRICS.add_bytes("dataset", "in", fragment.n_bytes)
+            table = self._in_range(table)
+            tables.append(
+                table.add_column(
+                    0,
+                    STATION_COLUMN,
+                    pa.array([fragment.station] * len(table), type=pa.string()),
+                )
+            )
+        if not tables:
+            return pa.table(
+                {
+                    STATION_COLUMN: pa.array([], type=pa.string()),
+                    DATE_COLUMN: pa.array([], type=pa.date32()),
+                }
+            )
+        return pa.concat_tables(tables, promote_options="permissive")
+
+    def to_pandas(self, timestamp_index: bool = False) -> pd.DataFrame:
+        """timestamp_index=True の場合は時分 (または時) の列から JST の DatetimeIndex を付ける"""
+        df = self.to_arrow().to_pandas()
+        if timestamp_index and len(df):
+            df.index = jst_index_from_columns(df)
+        return df
@@ -1,4 +1,6 @@
 from datetime import datetime
+from enum import StrEnum
+from typing import Optional
 
 from pydantic import HttpUrl
 from sqlmodel import Field, SQLModel
@@ -10,28 +12,63 @@ class HasId(SQLModel):
 
 
 class FetchedHtml(HasId, table=True):
-    recorded_at: datetime = Field(default_factory=datetime.now)
-    url: HttpUrl = Field(...)
-    html_content: str = Field(...)
+    """取得したページの記録. html本体は HtmlCache に保存し, ここにはダイジェストだけを持つ"""
+
+    recorded_at: datetime = Field(default_factory=datetime.now, index=True)
+    url: HttpUrl = Field(..., index=True)
+    digest: Optional[str] = Field(default=None, description="htmlのsha256")
+    html_content: Optional[str] = Field(
+        default=None, description="HtmlCache導入前の記録との互換のため残している"
+    )
 
 
 class FetchFailed(HasId, table=True):
-    recorded_at: datetime = Field(default_factory=datetime.now)
-    url: HttpUrl = Field(...)
+    recorded_at: datetime = Field(default_factory=datetime.now, index=True)
+    url: HttpUrl = Field(..., index=True)
     message: str = Field(...)
 
 
 class LocalFileSaved(HasId, table=True):
-    recorded_at: datetime = Field(default_factory=datetime.now)
-    file_path: str = Field(...)
+    recorded_at: datetime = Field(default_factory=datetime.now, index=True)
+    file_path: str = Field(..., index=True)
 
 
 class R2UploadSucceeded(HasId, table=True):
-    recorded_at: datetime = Field(default_factory=datetime.now)
-    url: HttpUrl = Field(...)
+    recorded_at: datetime = Field(default_factory=datetime.now, index=True)
+    url: HttpUrl = Field(..., index=True)
 
 
 class R2UploadFailed(HasId, table=True):
-    recorded_at: datetime = Field(default_factory=datetime.now)
-    url: HttpUrl = Field(...)
+    recorded_at: datetime = Field(default_factory=datetime.now, index=True)
+    url: HttpUrl = Field(..., index=True)
     message: str = Field(...)
+
+
+class RetryStatus(StrEnum):
+    pending = "pending"
+    resolved = "resolved"
+    dead = "dead"  # 恒久的なエラー, または試行回数の上限に達した
+
+
+class RetryJob(HasId, table=True):
+    """取得に失敗したページの再試行待ち. url ごとに1行で, 状態を更新していく"""
+
+    url: str = Field(..., sa_column_kwargs={"unique": True})
+    status: RetryStatus = Field(default=RetryStatus.pending, index=True)
+    attempts: int = Field(default=0, description="失敗した回数")
+    next_attempt_at: datetime = Field(default_factory=datetime.now, index=True)
+    last_error: str = Field(default="")
+    permanent: bool = Field(default=False, description="再試行しても直らないエラーか")
+    created_at: datetime = Field(default_factory=datetime.now)
+    resolved_at: Optional[datetime] = Field(default=None)
+
+
+class PageRevision(HasId, table=True):
+    """再検証で最後に確かめたページの版. url ごとに1行で, 変わっていなければ checked_at だけ更新する"""
+
+    url: str = Field(..., sa_column_kwargs={"unique": True})
+    etag: Optional[str] = Field(default=None)
+    last_modified: Optional[str] = Field(default=None)
+    table_digest: str = Field(..., description="tablefix1 部分のsha256")
+    checked_at: datetime = Field(default_factory=datetime.now)
+    changed_at: datetime = Field(default_factory=datetime.now, index=True)
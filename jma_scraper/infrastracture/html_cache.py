@@ -0,0 +1,163 @@
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import zstandard
+
+from jma_scraper.core.repository import Fetcher, HtmlCache
+from jma_scraper.core.url_formatter import QueryParamsForJma
+
+
+def html_digest(html_text: str) -> str:
+    """
+    >>> html_digest("<html></html>")[:16]
+    'b633a587c652d023'
+    """
+    return hashlib.sha256(html_text.encode("utf-8")).hexdigest()
+
+
+class PackedHtmlCache:
+    """zstd で圧縮した生htmlを1つの追記専用ファイルに詰めて保存するキャッシュ.
+
+    - pages.pack: 圧縮したhtmlを追記していく
+    - index.tsv: 追記専用のインデックス. 2種類の行がある
+        - "D<TAB>digest<TAB>offset<TAB>length": pages.pack 中の位置
+        - "K<TAB>key<TAB>digest": key (URL) と内容のダイジェストの対応. 後の行が優先
+    - dict-{dict_id}.zdict: train_dictionary で作った zstd 辞書
+
+    内容のダイジェストで重複を除くので, 同じ内容のページは1回しか保存されない.
+    """
+
+    PACK_FILE = "pages.pack"
+    INDEX_FILE = "index.tsv"
+
+    def __init__(self, root_dir: Path, level: int = 10):
+        self.root_dir = root_dir
+        self.level = level
+        self._lock = threading.Lock()
+        self._blobs: Dict[str, Tuple[int, int]] = {}
+        self._keys: Dict[str, str] = {}
+        self._dictionaries: Dict[int, zstandard.ZstdCompressionDict] = {}
+        self._active_dictionary: Optional[zstandard.ZstdCompressionDict] = None
+        self._loaded = False
+
+    @property
+    def pack_path(self) -> Path:
+        return self.root_dir / self.PACK_FILE
+
+    @property
+    def index_path(self) -> Path:
+        return self.root_dir / self.INDEX_FILE
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        for dict_path in sorted(self.root_dir.glob("dict-*.zdict")):
+            dictionary = zstandard.ZstdCompressionDict(dict_path.read_bytes())
+            self._dictionaries[dictionary.dict_id()] = dictionary
+            self._active_dictionary = dictionary
+        if self.index_path.exists():
+            with self.index_path.open(encoding="utf-8") as f:
+                for line in f:
+                    self._apply_index_line(line)
+        self._loaded = True
+
+    def _apply_index_line(self, line: str) -> None:
+        fields = line.rstrip("\n").split("\t")
+        # 書き込み途中で落ちた最終行などは読み飛ばす
+        if fields[0] == "D" and len(fields) == 4:
+            self._blobs[fields[1]] = (int(fields[2]), int(fields[3]))
+        elif fields[0] == "K" and len(fields) == 3:
+            self._keys[fields[1]] = fields[2]
+
+    def _compressor(self) -> zstandard.ZstdCompressor:
+        if self._active_dictionary is None:
+            return zstandard.ZstdCompressor(level=self.level)
+        return zstandard.ZstdCompressor(
+            level=self.level, dict_data=self._active_dictionary
+        )
+
+    def _decompress(self, data: bytes) -> bytes:
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        if dict_id == 0:
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zstandard.ZstdDecompressor(
+            dict_data=self._dictionaries[dict_id]
+        ).decompress(data)
+
+    def train_dictionary(self, samples: Iterable[str], dict_size: int = 112_640) -> int:
+        """気象庁のページで zstd 辞書を学習し, 以降の書き込みに使う. 辞書IDを返す.
+        以前の辞書も残すので, 既に保存したページはそのまま読める.
+        """
+        encoded = [sample.encode("utf-8") for sample in samples]
+        dictionary = zstandard.train_dictionary(dict_size, encoded)
+        with self._lock:
+            self._load()
+            self.root_dir.mkdir(parents=True, exist_ok=True)
+            dict_id = dictionary.dict_id()
+            (self.root_dir / f"dict-{dict_id}.zdict").write_bytes(dictionary.as_bytes())
+            self._dictionaries[dict_id] = dictionary
+            self._active_dictionary = dictionary
+        return dict_id
+
+    def digest_of(self, key: str) -> Optional[str]:
+        with self._lock:
+            self._load()
+            return self._keys.get(key)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.digest_of(key) is not None
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            self._load()
+            digest = self._keys.get(key)
+            if digest is None:
+                return None
+            offset, length = self._blobs[digest]
+        with self.pack_path.open("rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        return self._decompress(data).decode("utf-8")
+
+    def put(self, key: str, html_text: str) -> str:
+        digest = html_digest(html_text)
+        with self._lock:
+            self._load()
+            if self._keys.get(key) == digest:
+                return digest
+            self.root_dir.mkdir(parents=True, exist_ok=True)
+            lines = []
+            if digest not in self._blobs:
+                data = self._compressor().compress(html_text.encode("utf-8"))
+                with self.pack_path.open("ab") as f:
+                    offset = f.seek(0, 2)
+                    f.write(data)
+                lines.append(f"D\t{digest}\t{offset}\t{len(data)}\n")
+            lines.append(f"K\t{key}\t{digest}\n")
+            # pack への書き込みが終わってからインデックスに追記する
+            with self.index_path.open("a", encoding="utf-8") as f:
+                f.writelines(lines)
+            for line in lines:
+                self._apply_index_line(line)
+        return digest
+
+
+class CachedFetcher:
+    """キャッシュにあればネットワークに接続せずに返す Fetcher"""
+
+    def __init__(self, fetcher: Fetcher, cache: HtmlCache):
+        self.fetcher = fetcher
+        self.cache = cache
+
+    def __call__(
+        self, query_param: QueryParamsForJma, time_out_sec: float = 2.0
+    ) -> str:
+        key = str(query_param.query_url)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        html_text = self.fetcher(query_param, time_out_sec=time_out_sec)
+        self.cache.put(key, html_text)
+        return html_text
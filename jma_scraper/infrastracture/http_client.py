@@ -1,18 +1,29 @@
-from typing import Union
+from functools import lru_cache
+from importlib.util import find_spec
+from types import TracebackType
+from typing import Any, Dict, Optional, Type, Union
+from urllib.parse import urlsplit, urlunsplit
 
 import httpx
 from pydantic import HttpUrl
 
+from jma_scraper.core.metrics import METRICS
+from jma_scraper.core.repository import ConditionalPage
 from jma_scraper.core.url_formatter import QueryParamsForJma
 
+# h2, brotli はオプショナル. 入っていなければ HTTP/1.1, gzip にフォールバックする.
+HTTP2_AVAILABLE = find_spec("h2") is not None
+BROTLI_AVAILABLE = (
+    find_spec("brotli") is not None or find_spec("brotlicffi") is not None
+)
 
-def fetch_html(query_param: QueryParamsForJma, time_out_sec: float = 2.0) -> str:
-    """気象庁のサイトから過去の気象データを取得してhtmlテキストを返す
-    >>> q_jma = QueryParamsForJma(date=date(2022, 1, 1), prefecture_no=50, block_no=47654, record_interval=RecordInterval.five_day_divide_for_each_month) # doctest: +SKIP
-    >>> html_text = fetch_html(q_jma.query_url, timeout=2.0) # doctest: +SKIP
-    """
-    response = httpx.get(query_param.query_url, timeout=time_out_sec)
+ACCEPT_ENCODING = "br, gzip, deflate" if BROTLI_AVAILABLE else "gzip, deflate"
+
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY_SEC = 30.0
 
+
+def _html_text_or_raise(response: httpx.Response) -> str:
     if response.is_error:
         response.raise_for_status()
 
@@ -24,6 +35,188 @@ def fetch_html(query_param: QueryParamsForJma, time_out_sec: float = 2.0) -> str
     return response.text
 
 
+def rebase_url(url: str, base_url: Optional[str]) -> str:
+    """url のスキームとホストを base_url のものにする. ローカルのスタンドインに向けるときに使う.
+    >>> rebase_url("https://www.data.jma.go.jp/obd/stats/etrn/view/10min_s1.php?prec_no=50", "http://127.0.0.1:8080")
+    'http://127.0.0.1:8080/obd/stats/etrn/view/10min_s1.php?prec_no=50'
+    """
+    if base_url is None:
+        return url
+    base = urlsplit(base_url)
+    parts = urlsplit(url)
+    return urlunsplit((base.scheme, base.netloc, parts.path, parts.query, ""))
+
+
+def _client_kwargs(
+    max_connections: int, keepalive_expiry: float, http2: bool
+) -> Dict[str, Any]:
+    if max_connections < 1:
+        raise ValueError(f"max_connections should be 1 or more, got {max_connections}")
+    return {
+        "http2": http2 and HTTP2_AVAILABLE,
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        "headers": {"Accept-Encoding": ACCEPT_ENCODING},
+    }
+
+
+class JmaHttpClient:
+    """コネクションプールを持つ Fetcher.
+    同じインスタンスを使い回すことで, 気象庁サーバーへのDNS解決, TCP/TLSハンドシェイクを
+    リクエストごとに繰り返さない. HTTP/2 は h2 がインストールされていればALPNで交渉する.
+
+    >>> with JmaHttpClient(max_connections=4) as client:  # doctest: +SKIP
+    ...     html_text = client(q_jma)
+    """
+
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY_SEC,
+        http2: bool = True,
+        transport: Union[httpx.BaseTransport, None] = None,
+        base_url: Optional[str] = None,
+    ):
+        """base_url を渡した場合は気象庁の代わりにそのホストに問い合わせる"""
+        self.base_url = base_url
+        self._client = httpx.Client(
+            transport=transport,
+            **_client_kwargs(max_connections, keepalive_expiry, http2),
+        )
+
+    def __call__(
+        self, query_param: QueryParamsForJma, time_out_sec: float = 2.0
+    ) -> str:
+        url = rebase_url(query_param.query_url, self.base_url)
+        with METRICS.timer("fetch"):
+            response = self._client.get(url, timeout=time_out_sec)
+        METRICS.add_bytes("fetch", "in", len(response.content))
+        return _html_text_or_raise(response)
+
+    def close(self) -> None:
+        self._client.close()
+
+    def __enter__(self) -> "JmaHttpClient":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Union[Type[BaseException], None],
+        exc_val: Union[BaseException, None],
+        exc_tb: Union[TracebackType, None],
+    ) -> None:
+        self.close()
+
+
+class AsyncJmaHttpClient:
+    """JmaHttpClient の asyncio 版. AsyncFetcher を実装する."""
+
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY_SEC,
+        http2: bool = True,
+        transport: Union[httpx.AsyncBaseTransport, None] = None,
+        base_url: Optional[str] = None,
+    ):
+        """base_url を渡した場合は気象庁の代わりにそのホストに問い合わせる"""
+        self.base_url = base_url
+        self._client = httpx.AsyncClient(
+            transport=transport,
+            **_client_kwargs(max_connections, keepalive_expiry, http2),
+        )
+
+    async def __call__(
+        self, query_param: QueryParamsForJma, time_out_sec: float = 2.0
+    ) -> str:
+        url = rebase_url(query_param.query_url, self.base_url)
+        with METRICS.timer("fetch"):
+            response = await self._client.get(url, timeout=time_out_sec)
+        METRICS.add_bytes("fetch", "in", len(response.content))
+        return _html_text_or_raise(response)
+
+    async def fetch_if_modified(
+        self,
+        query_param: QueryParamsForJma,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        time_out_sec: float = 2.0,
+    ) -> ConditionalPage:
+        """前回の ETag, Last-Modified を送って取得する. 気象庁が 304 を返した場合は本文を受け取らない.
+        ヘッダーを返さないサーバーでは通常の取得と同じになる.
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        url = rebase_url(query_param.query_url, self.base_url)
+        with METRICS.timer("fetch"):
+            response = await self._client.get(
+                url, headers=headers, timeout=time_out_sec
+            )
+        METRICS.add_bytes("fetch", "in", len(response.content))
+        if response.status_code == httpx.codes.NOT_MODIFIED:
+            return ConditionalPage(
+                None,
+                etag=response.headers.get("ETag", etag),
+                last_modified=response.headers.get("Last-Modified", last_modified),
+            )
+        return ConditionalPage(
+            _html_text_or_raise(response),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def __aenter__(self) -> "AsyncJmaHttpClient":
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Union[Type[BaseException], None],
+        exc_val: Union[BaseException, None],
+        exc_tb: Union[TracebackType, None],
+    ) -> None:
+        await self.aclose()
+
+
+@lru_cache(maxsize=None)
+def get_default_client() -> JmaHttpClient:
+    """プロセス内で共有する JmaHttpClient. fetch_html はこれを使う."""
+    return JmaHttpClient()
+
+
+def fetch_html(query_param: QueryParamsForJma, time_out_sec: float = 2.0) -> str:
+    """気象庁のサイトから過去の気象データを取得してhtmlテキストを返す
+    プロセス内で共有するコネクションプールを使う.
+    >>> q_jma = QueryParamsForJma(date=date(2022, 1, 1), prefecture_no=50, block_no=47654, record_interval=RecordInterval.five_day_divide_for_each_month) # doctest: +SKIP
+    >>> html_text = fetch_html(q_jma.query_url, timeout=2.0) # doctest: +SKIP
+    """
+    return get_default_client()(query_param, time_out_sec=time_out_sec)
+
+
+async def fetch_html_async(
+    query_param: QueryParamsForJma,
+    time_out_sec: float = 2.0,
+    client: Union[httpx.AsyncClient, None] = None,
+) -> str:
+    """fetch_html の asyncio 版. clientを渡した場合はそのコネクションを使い回す.
+    >>> html_text = asyncio.run(fetch_html_async(q_jma)) # doctest: +SKIP
+    """
+    if client is None:
+        async with httpx.AsyncClient() as new_client:
+            response = await new_client.get(query_param.query_url, timeout=time_out_sec)
+    else:
+        response = await client.get(query_param.query_url, timeout=time_out_sec)
+    return _html_text_or_raise(response)
+
+
 def fetch_html_from_url(url: Union[str, HttpUrl], time_out_sec: float = 2.0) -> str:
     qp = QueryParamsForJma.from_url(url)
     return fetch_html(qp, time_out_sec=time_out_sec)
@@ -3,16 +3,18 @@ from typing import Iterator, Union
 
 import pandas as pd
 
+from jma_scraper.core.metrics import METRICS
 from jma_scraper.core.repository import Writer, WriterSrcValues
 
+# import しただけではディレクトリを作らない. 各ディレクトリは最初の保存時に作られる
 RESOURCE_ROOT = Path(__file__).parents[2] / "__data__"  # プロジェクトのルートに__data__ディレクトリ
-RESOURCE_ROOT.mkdir(exist_ok=True)
 
 JMA_CSV_DIR = RESOURCE_ROOT / "jma_csv"  # __data__/jma_csv
-JMA_CSV_DIR.mkdir(exist_ok=True)
 
 JMA_CSV_FILES: Iterator[Path] = JMA_CSV_DIR.glob("*.csv")
 
+JMA_HTML_CACHE_DIR = RESOURCE_ROOT / "html_cache"  # __data__/html_cache 最初の保存時に作られる
+
 
 class DfLocalCsvWriter(Writer):
     def __init__(self, src_values: WriterSrcValues):
@@ -22,7 +24,10 @@ class DfLocalCsvWriter(Writer):
     def write(self, src: pd.DataFrame, dst: Union[Path, None] = None) -> None:
         if dst is None:
             dst = self.create_csv_full_path()
+        Path(dst).parent.mkdir(parents=True, exist_ok=True)
         src.to_csv(dst, index=False)
+        if METRICS.enabled:
+            METRICS.add_bytes("write", "out", Path(dst).stat().st_size)
 
     def create_csv_full_path(self) -> Path:
         return JMA_CSV_DIR / f"{self.src_values.format()}.csv"
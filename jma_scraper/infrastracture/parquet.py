@@ -0,0 +1,278 @@
+import os
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from jma_scraper.core.column_plan import TableLayout
+from jma_scraper.core.compact import hour_minutes_text, to_float32
+from jma_scraper.core.location_spec import (
+    LocationColumnType,
+    MainColumns10MinutesFormatted,
+    MainColumnsDailyFormatted,
+    MainColumnsHourlyFormatted,
+    MainColumnsPeriodFormatted,
+    RecordInterval,
+)
+from jma_scraper.core.repository import Writer, WriterSrcValues
+from jma_scraper.core.table_decoder import layout_for
+from jma_scraper.infrastracture.localfile import RESOURCE_ROOT
+
+JMA_PARQUET_DIR = RESOURCE_ROOT / "jma_parquet"  # __data__/jma_parquet 最初の保存時に作られる
+PARTITION_FILE = "data.parquet"
+
+DATE_COLUMN = "date"
+HOUR_MINUTES_COLUMN: str = MainColumns10MinutesFormatted.hour_minutes
+HOUR_COLUMN: str = MainColumnsHourlyFormatted.hour
+DAY_COLUMN: str = MainColumnsDailyFormatted.day
+MONTH_COLUMN: str = MainColumnsPeriodFormatted.month
+PERIOD_COLUMN: str = MainColumnsPeriodFormatted.period
+# 半旬, 旬の何日ごとに期間が始まるか
+_PERIOD_DAYS = {
+    RecordInterval.five_day_divide_for_each_month: 5,
+    RecordInterval.ten_day_divide_for_each_mont: 10,
+}
+# 旬のページの期間は文字で書かれる. 半旬のページは 1 から 6 の数
+_PERIOD_NUMBERS = {"上旬": "1", "中旬": "2", "下旬": "3"}
+
+# 10分ごとの1ヶ月分の行数を1つの row group にする
+DEFAULT_ROW_GROUP_SIZE = 144 * 31
+# ParquetBatchWriter が1回にまとめて書くページ数
+DEFAULT_BATCH_PAGES = 64
+
+# 同じパーティションへの同時書き込みで読み込み-書き換えが競合しないように
+_partition_locks: Dict[Path, threading.Lock] = defaultdict(threading.Lock)
+_partition_locks_guard = threading.Lock()
+
+
+def partition_dir(root: Path, src_values: WriterSrcValues) -> Path:
+    """
+    >>> src = WriterSrcValues(date=date(2022, 1, 1), location_name='hamamatsu', every_xx='every_10_minutes')
+    >>> partition_dir(Path("root"), src).as_posix()
+    'root/station=hamamatsu/interval=every_10_minutes/year=2022'
+    """
+    return (
+        root
+        / f"station={src_values.location_name}"
+        / f"interval={src_values.every_xx}"
+        / f"year={src_values.date.year}"
+    )
+
+
+def storage_layout(record_interval: RecordInterval) -> TableLayout:
+    """保存するときの列の種類. main の列は few の列を全て含むので main のレイアウトを使う"""
+    return layout_for(record_interval, LocationColumnType.main)
+
+
+def sort_keys(record_interval: RecordInterval) -> List[str]:
+    """保存した行の並び. 日, 月は date の列に入るので使わない.
+    >>> sort_keys(RecordInterval.ten_minutes)
+    ['date', '時分']
+    >>> sort_keys(RecordInterval.one_day)
+    ['date']
+    >>> sort_keys(RecordInterval.ten_day_divide_for_each_mont)
+    ['date', '期間']
+    """
+    labels = storage_layout(record_interval).label_column_names
+    return [DATE_COLUMN] + [
+        str(label) for label in labels if label not in (DAY_COLUMN, MONTH_COLUMN)
+    ]
+
+
+def _numbers(series: pd.Series) -> np.ndarray:
+    """
+    >>> _numbers(pd.Series(["1", "上旬", "下旬"])).tolist()
+    [1, 1, 3]
+    """
+    if not pd.api.types.is_numeric_dtype(series):
+        series = series.replace(_PERIOD_NUMBERS)
+    return pd.to_numeric(series).to_numpy().astype(np.int64)
+
+
+def row_dates(
+    df: pd.DataFrame, page_date: date, record_interval: RecordInterval
+) -> np.ndarray:
+    """行ごとの日付 (datetime64[D]). 日ごとの値は 日 の列から, 半旬と旬は 月, 期間 の列から
+    期間の最初の日にする. 10分ごと, 1時間ごとの値はどの行もページの日付.
+    """
+    if record_interval is RecordInterval.one_day:
+        first_day = np.datetime64(page_date.replace(day=1), "D")
+        return first_day + (_numbers(df[DAY_COLUMN]) - 1)
+    if record_interval in _PERIOD_DAYS:
+        months = np.datetime64(f"{page_date.year}-01", "M") + (
+            _numbers(df[MONTH_COLUMN]) - 1
+        )
+        start_days = (_numbers(df[PERIOD_COLUMN]) - 1) * _PERIOD_DAYS[record_interval]
+        return months.astype("datetime64[D]") + start_days
+    return np.full(len(df), np.datetime64(page_date, "D"))
+
+
+def last_row_date(page_date: date, record_interval: RecordInterval) -> date:
+    """ページの最後の行の日付. 日ごとの値は月末, 半旬と旬は12月の最後の期間の最初の日.
+    >>> last_row_date(date(2024, 2, 1), RecordInterval.one_day)
+    datetime.date(2024, 2, 29)
+    >>> last_row_date(date(2022, 1, 1), RecordInterval.five_day_divide_for_each_month)
+    datetime.date(2022, 12, 26)
+    """
+    if record_interval is RecordInterval.one_day:
+        next_month = (page_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return next_month - timedelta(days=1)
+    if record_interval in _PERIOD_DAYS:
+        span = _PERIOD_DAYS[record_interval]
+        return date(page_date.year, 12, 1 + span * (30 // span - 1))
+    return page_date
+
+
+def complete_pages(table: pa.Table, record_interval: RecordInterval) -> List[date]:
+    """保存した行 (date と行ラベルの列) のうち, 最後の行まであるページの日付.
+    当日, 当月のページは取得した時点までの行しかないので含まない.
+    10分ごと, 1時間ごとの値は 24:00, 24時 の行があるページ.
+    """
+    dates = table[DATE_COLUMN]
+    if HOUR_MINUTES_COLUMN in table.column_names:
+        dates = dates.filter(pc.equal(table[HOUR_MINUTES_COLUMN], "24:00"))
+    elif HOUR_COLUMN in table.column_names:
+        dates = dates.filter(pc.equal(table[HOUR_COLUMN], 24))
+    days = set(dates.unique().to_pylist())
+    pages = {record_interval.page_date(d) for d in days}
+    return sorted(
+        page for page in pages if last_row_date(page, record_interval) in days
+    )
+
+
+def to_storage_table(
+    df: pd.DataFrame,
+    date_: date,
+    record_interval: RecordInterval = RecordInterval.ten_minutes,
+) -> pa.Table:
+    """1ページ分の整形済み DataFrame に行ごとの日付の列を足した Arrow Table.
+    値の列は float32, 天気などの文字列の列と時分は文字列, 時, 期間は整数にする.
+    日, 月は date の列に入れるので保存しない.
+    compact_frame の分の整数の時分, Categorical の風向も元の文字列で保存する.
+    """
+    layout = storage_layout(record_interval)
+    dates = row_dates(df, date_, record_interval)
+    columns: Dict[str, pa.Array] = {DATE_COLUMN: pa.array(dates, type=pa.date32())}
+    for col in df.columns:
+        series = df[col]
+        if col in (DAY_COLUMN, MONTH_COLUMN):
+            continue
+        if col == HOUR_MINUTES_COLUMN and pd.api.types.is_integer_dtype(series):
+            series = hour_minutes_text(series.to_numpy())
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(object)
+        if col == HOUR_MINUTES_COLUMN or col in layout.text_columns:
+            columns[col] = pa.array(series, type=pa.string(), from_pandas=True)
+        elif col in layout.label_column_names:
+            columns[col] = pa.array(_numbers(series), type=pa.int16())
+        elif col in layout.direction_columns and not pd.api.types.is_numeric_dtype(
+            series
+        ):
+            columns[col] = pa.array(series, type=pa.string(), from_pandas=True)
+        else:
+            columns[col] = pa.array(to_float32(series.to_numpy()), type=pa.float32())
+    return pa.table(columns)
+
+
+def _lock_for(path: Path) -> threading.Lock:
+    with _partition_locks_guard:
+        return _partition_locks[path]
+
+
+def _merge_partition(
+    path: Path, tables: List[pa.Table], keys: List[str], row_group_size: int
+) -> None:
+    parts = list(tables)
+    new_dates = pa.concat_arrays(
+        [chunk for table in parts for chunk in table[DATE_COLUMN].chunks]
+    ).unique()
+    if path.exists():
+        existing = pq.read_table(path)
+        # 書き直す日の行を除いてから足すので, 同じ日を何度書いても結果は同じ
+        keep = pc.invert(pc.is_in(existing[DATE_COLUMN], value_set=new_dates))
+        parts.insert(0, existing.filter(keep))
+
+    merged = pa.concat_tables(parts, promote_options="permissive").sort_by(
+        [(key, "ascending") for key in keys]
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".parquet.tmp")
+    pq.write_table(
+        merged,
+        tmp_path,
+        row_group_size=row_group_size,
+        compression="zstd",
+        write_statistics=True,
+    )
+    os.replace(tmp_path, path)
+
+
+def write_parquet_days(
+    frames: Iterable[Tuple[WriterSrcValues, pd.DataFrame]],
+    root: Path = JMA_PARQUET_DIR,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+) -> List[Path]:
+    """複数ページの DataFrame をパーティションごとにまとめて1回で書き込む. 書き込んだファイルを返す.
+    同じページを何度書いても, そのページの日付の行を置き換えるだけ.
+    """
+    by_partition: Dict[Path, Dict[date, pa.Table]] = defaultdict(dict)
+    intervals: Dict[Path, RecordInterval] = {}
+    for src_values, df in frames:
+        path = partition_dir(root, src_values) / PARTITION_FILE
+        record_interval = RecordInterval.from_literal(src_values.every_xx)
+        intervals[path] = record_interval
+        by_partition[path][src_values.date] = to_storage_table(
+            df, src_values.date, record_interval
+        )
+
+    for path, tables in by_partition.items():
+        keys = sort_keys(intervals[path])
+        with _lock_for(path):
+            _merge_partition(path, list(tables.values()), keys, row_group_size)
+    return list(by_partition)
+
+
+class DfLocalParquetWriter(Writer):
+    """観測地点/取得間隔/年 でパーティション分けした Parquet に1ページ分を書き込む.
+    同じページをもう一度書いた場合は置き換える.
+    書くたびに1年分のファイルを読み直して書き直すので, 数日分を書くときだけに使う.
+    バックフィルなどで多くのページを書くときは ParquetBatchWriter か write_parquet_days を使う.
+    """
+
+    def __init__(self, src_values: WriterSrcValues, root: Path = JMA_PARQUET_DIR):
+        super().__init__(src_values)
+        self.src_values = src_values
+        self.root = root
+
+    def write(self, src: pd.DataFrame, dst: Union[Path, None] = None) -> None:
+        """dst を指定した場合はそれをデータセットのルートディレクトリにする"""
+        write_parquet_days([(self.src_values, src)], root=dst or self.root)
+
+    def create_parquet_full_path(self) -> Path:
+        return partition_dir(self.root, self.src_values) / PARTITION_FILE
+
+
+@dataclass(eq=True, frozen=True)
+class ParquetBatchWriter:
+    """backfill の writer_factory に使う. ページを batch_pages ページずつ write_parquet_days で書き込むので,
+    パーティションのファイルを書き直すのは batch_pages ページごとに1回.
+    """
+
+    root: Path = JMA_PARQUET_DIR
+    batch_pages: int = DEFAULT_BATCH_PAGES
+
+    def __call__(self, src_values: WriterSrcValues) -> Writer:
+        return DfLocalParquetWriter(src_values, root=self.root)
+
+    def write_many(
+        self, frames: Sequence[Tuple[WriterSrcValues, pd.DataFrame]]
+    ) -> None:
+        write_parquet_days(frames, root=self.root)
@@ -0,0 +1,239 @@
+"""10分ごとの Parquet の隣に, 1時間ごと, 日ごと, 月ごとに集計した Parquet (ピラミッド) を置く.
+
+    station=hamamatsu/interval=every_10_minutes/year=2022/data.parquet  10分ごとの値
+    station=hamamatsu/pyramid=hourly/year=2022/data.parquet
+    station=hamamatsu/pyramid=daily/year=2022/data.parquet
+    station=hamamatsu/pyramid=monthly/year=2022/data.parquet
+
+新しい日を書き込んだら update_pyramid でその日の1時間ごと, 日ごとの値と, その日を含む月の値だけを作り直す.
+粗い粒度の問い合わせは read_pyramid でピラミッドだけを読み, 10分ごとの行は読まない.
+"""
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from jma_scraper.core.aggregation import (
+    Level,
+    aggregate_10minutes,
+    aggregate_daily,
+    month_start,
+)
+from jma_scraper.core.location_spec import RecordInterval
+from jma_scraper.core.metrics import timed
+from jma_scraper.core.repository import Writer, WriterSrcValues
+from jma_scraper.infrastracture.parquet import (
+    DATE_COLUMN,
+    JMA_PARQUET_DIR,
+    PARTITION_FILE,
+    DfLocalParquetWriter,
+    ParquetBatchWriter,
+    _lock_for,
+    partition_dir,
+    write_parquet_days,
+)
+
+RAW_INTERVAL = RecordInterval.ten_minutes.to_literal()
+
+
+def pyramid_path(root: Path, location_name: str, level: Level, year: int) -> Path:
+    """
+    >>> pyramid_path(Path("root"), "hamamatsu", Level.daily, 2022).as_posix()
+    'root/station=hamamatsu/pyramid=daily/year=2022/data.parquet'
+    """
+    return (
+        root
+        / f"station={location_name}"
+        / f"pyramid={level}"
+        / f"year={year}"
+        / PARTITION_FILE
+    )
+
+
+def _raw_path(root: Path, location_name: str, year: int) -> Path:
+    src_values = WriterSrcValues(
+        date=date(year, 1, 1), location_name=location_name, every_xx=RAW_INTERVAL
+    )
+    return partition_dir(root, src_values) / PARTITION_FILE
+
+
+def _by_year(days: Iterable[date]) -> Dict[int, List[date]]:
+    years: Dict[int, List[date]] = defaultdict(list)
+    for day in sorted(set(days)):
+        years[day.year].append(day)
+    return years
+
+
+def _read(
+    path: Path, start: Optional[date] = None, end: Optional[date] = None
+) -> Optional[pa.Table]:
+    """start から end まで (両端を含む) の行だけを読む. ファイルがなければ None"""
+    if not path.exists():
+        return None
+    filters = []
+    if start is not None:
+        filters.append((DATE_COLUMN, ">=", start))
+    if end is not None:
+        filters.append((DATE_COLUMN, "<=", end))
+    return pq.read_table(path, filters=filters or None)
+
+
+def _concat(tables: Iterable[Optional[pa.Table]]) -> pd.DataFrame:
+    found = [table for table in tables if table is not None]
+    if not found:
+        return pd.DataFrame()
+    return pa.concat_tables(found, promote_options="permissive").to_pandas()
+
+
+def _read_raw_days(
+    root: Path, location_name: str, days: Sequence[date]
+) -> pd.DataFrame:
+    """days の10分ごとの値. 最大1時間降水量の計算のために, それぞれの前日の分も読む"""
+    needed = set(days) | {day - timedelta(days=1) for day in days}
+    tables = []
+    for year, year_days in _by_year(needed).items():
+        path = _raw_path(root, location_name, year)
+        if path.exists():
+            tables.append(pq.read_table(path, filters=[(DATE_COLUMN, "in", year_days)]))
+    return _concat(tables)
+
+
+def _replace_rows(
+    path: Path, df: pd.DataFrame, replaced: Sequence[date], level: Level
+) -> None:
+    """path のうち replaced の日付の行を df で置き換える. df にない日付の行は消える"""
+    parts = []
+    if path.exists():
+        existing = pq.read_table(path)
+        dates = pa.array(replaced, type=pa.date32())
+        parts.append(
+            existing.filter(pc.invert(pc.is_in(existing[DATE_COLUMN], value_set=dates)))
+        )
+    if len(df):
+        parts.append(pa.Table.from_pandas(df, preserve_index=False))
+    if not parts:
+        return
+    merged = pa.concat_tables(parts, promote_options="permissive").sort_by(
+        [(key, "ascending") for key in level.keys]
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".parquet.tmp")
+    pq.write_table(merged, tmp_path, compression="zstd", write_statistics=True)
+    os.replace(tmp_path, path)
+
+
+def _only(df: pd.DataFrame, days: Sequence[date]) -> pd.DataFrame:
+    return df[df[DATE_COLUMN].isin(days)] if len(df) else df
+
+
+@timed("update_pyramid")
+def update_pyramid(
+    location_name: str, days: Iterable[date], root: Path = JMA_PARQUET_DIR
+) -> List[Path]:
+    """days の1時間ごと, 日ごとの値と, days を含む月の値を作り直す. 書き込んだファイルを返す.
+    翌日の最大1時間降水量は前日の値を使うので, 10分ごとの値が保存済みの翌日も作り直す.
+    """
+    days = sorted(set(days))
+    if not days:
+        return []
+    next_days = {day + timedelta(days=1) for day in days} - set(days)
+    raw = _read_raw_days(root, location_name, sorted(set(days) | next_days))
+    if len(raw):
+        days = sorted(set(days) | (next_days & set(raw[DATE_COLUMN])))
+    written: List[Path] = []
+    for level in (Level.hourly, Level.daily):
+        aggregated = aggregate_10minutes(raw, level) if len(raw) else raw
+        for year, year_days in _by_year(days).items():
+            path = pyramid_path(root, location_name, level, year)
+            with _lock_for(path):
+                _replace_rows(path, _only(aggregated, year_days), year_days, level)
+            written.append(path)
+
+    months = sorted({day.replace(day=1) for day in days})
+    for year, year_months in _by_year(months).items():
+        path = pyramid_path(root, location_name, Level.monthly, year)
+        daily_path = pyramid_path(root, location_name, Level.daily, year)
+        # 同じ月の別の日を書き込むスレッドと競合しないよう, 日ごとの値はロックの中で読む
+        with _lock_for(path):
+            daily = _concat([_read(daily_path, year_months[0])])
+            if len(daily):
+                daily = daily[month_start(daily[DATE_COLUMN]).isin(year_months)]
+            monthly = aggregate_daily(daily) if len(daily) else daily
+            _replace_rows(path, monthly, year_months, Level.monthly)
+        written.append(path)
+    return written
+
+
+def rebuild_pyramid(location_name: str, root: Path = JMA_PARQUET_DIR) -> List[Path]:
+    """保存済みの10分ごとの値の全期間からピラミッドを作り直す. 1年分ずつ処理する"""
+    written: List[Path] = []
+    pattern = f"station={location_name}/interval={RAW_INTERVAL}/year=*/{PARTITION_FILE}"
+    for raw_path in sorted(root.glob(pattern)):
+        days = pq.read_table(raw_path, columns=[DATE_COLUMN])[DATE_COLUMN].unique()
+        written += update_pyramid(location_name, days.to_pylist(), root)
+    return sorted(set(written))
+
+
+@timed("read_pyramid")
+def read_pyramid(
+    location_name: str,
+    level: Union[Level, str],
+    start: date,
+    end: date,
+    root: Path = JMA_PARQUET_DIR,
+    columns: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    """start から end まで (両端を含む) の集計済みの値. 月ごとの値は月の1日の日付で選ぶ.
+    読むのはピラミッドの該当する年のファイルだけ.
+    """
+    level = Level(level)
+    tables = []
+    for year in range(start.year, end.year + 1):
+        table = _read(pyramid_path(root, location_name, level, year), start, end)
+        if table is not None and columns is not None:
+            table = table.select([*level.keys, *columns])
+        tables.append(table)
+    return _concat(tables).reset_index(drop=True)
+
+
+def write_parquet_days_with_pyramid(
+    frames: Iterable[Tuple[WriterSrcValues, pd.DataFrame]],
+    root: Path = JMA_PARQUET_DIR,
+) -> List[Path]:
+    """write_parquet_days で書き込んでから, 10分ごとの値の日のピラミッドを観測地点ごとにまとめて作り直す"""
+    frames = list(frames)
+    written = write_parquet_days(frames, root)
+    days: Dict[str, List[date]] = defaultdict(list)
+    for src_values, _ in frames:
+        if src_values.every_xx == RAW_INTERVAL:
+            days[src_values.location_name].append(src_values.date)
+    for location_name, location_days in days.items():
+        written += update_pyramid(location_name, location_days, root)
+    return written
+
+
+class DfLocalParquetPyramidWriter(DfLocalParquetWriter):
+    """DfLocalParquetWriter と同じく1日分を書き込み, 10分ごとの値ならその日のピラミッドも作り直す"""
+
+    def write(self, src: pd.DataFrame, dst: Union[Path, None] = None) -> None:
+        write_parquet_days_with_pyramid([(self.src_values, src)], root=dst or self.root)
+
+
+@dataclass(eq=True, frozen=True)
+class ParquetPyramidBatchWriter(ParquetBatchWriter):
+    """ParquetBatchWriter と同じくまとめて書き込み, ピラミッドもまとめて作り直す"""
+
+    def __call__(self, src_values: WriterSrcValues) -> Writer:
+        return DfLocalParquetPyramidWriter(src_values, root=self.root)
+
+    def write_many(
+        self, frames: Sequence[Tuple[WriterSrcValues, pd.DataFrame]]
+    ) -> None:
+        write_parquet_days_with_pyramid(frames, root=self.root)
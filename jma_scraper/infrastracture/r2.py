@@ -1,15 +1,64 @@
+import gzip
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from enum import StrEnum
+from functools import lru_cache
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import IO, TYPE_CHECKING, Any, Iterable, List, Optional, Tuple, Union
 
 import boto3
+import pandas as pd
+import pyarrow.parquet as pq
+import zstandard
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 
 if TYPE_CHECKING:
-    from mypy_boto3_s3 import S3ServiceResource
+    from mypy_boto3_s3 import S3Client, S3ServiceResource
     from mypy_boto3_s3.service_resource import Bucket
 
 from pydantic import BaseSettings, Field
 
+from jma_scraper.core.location_spec import RecordInterval
+from jma_scraper.core.metrics import METRICS
 from jma_scraper.core.repository import Writer, WriterSrcValues
+from jma_scraper.infrastracture.parquet import to_storage_table
+
+DEFAULT_MAX_WORKERS = 16
+
+# 1日分のCSVは数十KBなので, 1ファイルを分割するより複数ファイルを並行に送る方が効く.
+# 大きいファイル (Parquet の年パーティションなど) だけ 8MB ごとのマルチパートにする.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=4,
+    use_threads=True,
+)
+
+# これより大きいオブジェクトだけ一時ファイルに書き出し, 小さいものはメモリ上で送る
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def _cached_client(
+    endpoint_url: str,
+    access_key_id: str,
+    access_key_secret: str,
+    max_pool_connections: int,
+) -> "S3Client":
+    # boto3 の client はスレッドセーフなので, 設定ごとに1つを使い回す
+    return boto3.session.Session().client(
+        "s3",
+        endpoint_url=endpoint_url,
+        aws_access_key_id=access_key_id,
+        aws_secret_access_key=access_key_secret,
+        region_name="auto",  # R2 ではautoになる.
+        config=Config(
+            max_pool_connections=max_pool_connections,
+            retries={"max_attempts": 5, "mode": "adaptive"},
+        ),
+    )
 
 
 class R2Conf(BaseSettings):
@@ -24,14 +73,29 @@ class R2Conf(BaseSettings):
         regex=r"^[a-z0-9]+(?:-[a-z0-9]+)*$",
         description="バケット名を指定記号で始まるの禁止, アンダースコア禁止などいくつか注意点あり",
     )
+    ENDPOINT_URL: Optional[str] = Field(
+        default=None,
+        description="R2 の代わりに使う S3互換のエンドポイント. 例: ローカルの MinIO http://localhost:9000",
+    )
 
     class Config:
         env_file = str(Path(__file__).parents[2] / ".env")
 
     @property
     def endpoint_url(self) -> str:
+        if self.ENDPOINT_URL is not None:
+            return self.ENDPOINT_URL
         return f"https://{self.ACCOUNT_ID}.r2.cloudflarestorage.com"
 
+    def client(self, max_pool_connections: int = DEFAULT_MAX_WORKERS) -> "S3Client":
+        """同じ設定なら同じ client を返す"""
+        return _cached_client(
+            self.endpoint_url,
+            self.AWS_ACCESS_KEY_ID,
+            self.AWS_ACCESS_KEY_SECRET,
+            max_pool_connections,
+        )
+
     @property
     def boto3_resource(self) -> "S3ServiceResource":
         return boto3.resource(
@@ -54,7 +118,9 @@ class R2Conf(BaseSettings):
         return f"{self.bucket_url}/{dst_key}"
 
     def write(self, src_file: str | Path, dst_key: str) -> None:
-        self.bucket.upload_file(str(src_file), dst_key)
+        self.client().upload_file(
+            str(src_file), self.BUCKET_NAME, dst_key, Config=TRANSFER_CONFIG
+        )
 
 
 class LocalToR2Writer(Writer):
@@ -72,3 +138,159 @@ class LocalToR2Writer(Writer):
 
     def write(self, src: Path, dst: str) -> None:
         self.r2_conf.write(src, dst)
+
+
+@dataclass(eq=True, frozen=True)
+class R2UploadResult:
+    src: Path
+    dst_key: str
+    url: str
+    error: Union[str, None] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class R2BulkUploader:
+    """1つの client を共有して, 複数のファイルを max_workers 個のスレッドで並行にアップロードする.
+    失敗しても例外は送出せず, ファイルごとの結果を返す.
+
+    >>> uploader = R2BulkUploader(R2Conf(BUCKET_NAME="00-hq"))  # doctest: +SKIP
+    >>> results = uploader.upload([(Path("a.csv"), "__data__/jma_csv/a.csv")])  # doctest: +SKIP
+    """
+
+    def __init__(
+        self,
+        r2_conf: R2Conf,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        transfer_config: TransferConfig = TRANSFER_CONFIG,
+        client: Any = None,
+    ):
+        """client は S3互換のスタンドインなどに差し替えるときに渡す"""
+        if max_workers < 1:
+            raise ValueError(f"max_workers should be 1 or more, got {max_workers}")
+        self.r2_conf = r2_conf
+        self.max_workers = max_workers
+        self.transfer_config = transfer_config
+        # コネクションプールがワーカー数より小さいとプールの空き待ちになる
+        self.client = client if client is not None else r2_conf.client(max_workers)
+
+    def _upload_one(self, src: Path, dst_key: str) -> R2UploadResult:
+        url = self.r2_conf.create_dst_url(dst_key)
+        try:
+            with METRICS.timer("r2_upload"):
+                self.client.upload_file(
+                    str(src),
+                    self.r2_conf.BUCKET_NAME,
+                    dst_key,
+                    Config=self.transfer_config,
+                )
+        except Exception as e:
+            METRICS.inc("r2_upload_failed")
+            return R2UploadResult(src=src, dst_key=dst_key, url=url, error=str(e))
+        if METRICS.enabled:
+            METRICS.add_bytes("r2_upload", "out", src.stat().st_size)
+        return R2UploadResult(src=src, dst_key=dst_key, url=url)
+
+    def upload(self, items: Iterable[Tuple[Path, str]]) -> List[R2UploadResult]:
+        """(ローカルのファイル, アップロード先のキー) の組を並行にアップロードする. 結果は items の順"""
+        items = list(items)
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="r2-upload"
+        ) as executor:
+            return list(executor.map(lambda item: self._upload_one(*item), items))
+
+
+class R2ObjectFormat(StrEnum):
+    """DfR2Writer が書き出す形式. 値はキーの拡張子"""
+
+    csv = "csv"
+    csv_gzip = "csv.gz"
+    csv_zstd = "csv.zst"
+    parquet = "parquet"
+
+
+_CONTENT_TYPES = {
+    R2ObjectFormat.csv: "text/csv",
+    R2ObjectFormat.csv_gzip: "application/gzip",
+    R2ObjectFormat.csv_zstd: "application/zstd",
+    R2ObjectFormat.parquet: "application/vnd.apache.parquet",
+}
+
+
+def serialize_df(
+    df: pd.DataFrame,
+    fmt: R2ObjectFormat,
+    buffer: IO[bytes],
+    src_values: WriterSrcValues,
+) -> None:
+    """df を fmt で buffer に書き込む. Parquet は DfLocalParquetWriter と同じ列の型にする"""
+    if fmt == R2ObjectFormat.parquet:
+        pq.write_table(
+            to_storage_table(
+                df, src_values.date, RecordInterval.from_literal(src_values.every_xx)
+            ),
+            buffer,
+            compression="zstd",
+        )
+        return
+    csv_bytes = df.to_csv(index=False).encode("utf-8")
+    if fmt == R2ObjectFormat.csv_gzip:
+        buffer.write(gzip.compress(csv_bytes))
+    elif fmt == R2ObjectFormat.csv_zstd:
+        buffer.write(zstandard.ZstdCompressor(level=10).compress(csv_bytes))
+    else:
+        buffer.write(csv_bytes)
+
+
+class DfR2Writer(Writer):
+    """DataFrame をローカルのファイルを経由せずに R2 にアップロードする.
+    小さいオブジェクトはメモリ上, SPOOL_MAX_BYTES を超えたら一時ファイルにためてから送る.
+
+    backfill の writer_factory に使う場合:
+    >>> writer_factory = functools.partial(DfR2Writer, r2_conf=r2_conf)  # doctest: +SKIP
+    """
+
+    def __init__(
+        self,
+        src_values: WriterSrcValues,
+        r2_conf: R2Conf,
+        fmt: R2ObjectFormat = R2ObjectFormat.csv,
+        prefix: str = "jma",
+        client: Any = None,
+    ):
+        """client は S3互換のスタンドインなどに差し替えるときに渡す"""
+        super().__init__(src_values)
+        self.src_values = src_values
+        self.r2_conf = r2_conf
+        self.fmt = fmt
+        self.prefix = prefix
+        self.client = client if client is not None else r2_conf.client()
+
+    def create_dst_key(self) -> str:
+        """
+        >>> from datetime import date
+        >>> src = WriterSrcValues(date=date(2022, 1, 1), location_name='hamamatsu', every_xx='every_10_minutes')
+        >>> DfR2Writer(src, r2_conf=None, fmt=R2ObjectFormat.csv_gzip, client=object()).create_dst_key()
+        'jma/2022-01-01__hamamatsu__every_10_minutes.csv.gz'
+        """
+        return f"{self.prefix}/{self.src_values.format()}.{self.fmt}"
+
+    def create_dst_url(self) -> str:
+        return self.r2_conf.create_dst_url(self.create_dst_key())
+
+    def write(self, src: pd.DataFrame, dst: Union[str, None] = None) -> None:
+        """dst を指定した場合はそれをキーにする"""
+        key = dst if dst is not None else self.create_dst_key()
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as buffer:
+            serialize_df(src, self.fmt, buffer, self.src_values)  # type: ignore[arg-type]
+            METRICS.add_bytes("r2_upload", "out", buffer.tell())
+            buffer.seek(0)
+            self.client.upload_fileobj(
+                buffer,
+                self.r2_conf.BUCKET_NAME,
+                key,
+                ExtraArgs={"ContentType": _CONTENT_TYPES[self.fmt]},
+                Config=TRANSFER_CONFIG,
+            )
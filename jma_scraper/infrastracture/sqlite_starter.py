@@ -1,17 +1,31 @@
-from typing import Annotated
+import logging
+import time
+from pathlib import Path
+from typing import Annotated, Dict, Union
 
 from pydantic import Field, validate_arguments
+from sqlalchemy import event, inspect, text
 from sqlalchemy.engine import Engine
 from sqlmodel import Session, SQLModel, create_engine
 
+from jma_scraper.core.metrics import METRICS, Metrics
+from jma_scraper.infrastracture.db_tables import FetchedHtml
 from jma_scraper.infrastracture.localfile import RESOURCE_ROOT
 
-DB_FILE_DIR = RESOURCE_ROOT / "jma_db"
-DB_FILE_DIR.mkdir(exist_ok=True)
+DB_FILE_DIR = RESOURCE_ROOT / "jma_db"  # 最初に engine を作るときに作られる
 
 DB_PATH = DB_FILE_DIR / "jma_app.db"
 DB_LOG = DB_FILE_DIR / "jma_app.log"
 
+# 書き込みを読み込みと並行にできるよう WAL にし, fsync は checkpoint のときだけにする
+SQLITE_PRAGMAS: Dict[str, Union[str, int]] = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,  # ミリ秒. 他の接続が書き込み中なら待つ
+    "temp_store": "MEMORY",
+    "cache_size": -16000,  # 負の値はKB単位. 16MB
+}
+
 
 @validate_arguments
 def create_sql_url(
@@ -20,14 +34,102 @@ def create_sql_url(
     return f"sqlite:///{file_name}"
 
 
-def create_engine_all(sqlite_url: str) -> Engine:
-    return create_engine(sqlite_url, echo=True)
+def set_sqlite_pragmas(engine: Engine) -> Engine:
+    """接続するたびに SQLITE_PRAGMAS を設定する"""
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, _connection_record) -> None:  # type: ignore
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+
+def instrument_sql(engine: Engine, metrics: Metrics = METRICS) -> Engine:
+    """SQL の実行を "sql_execute", commit を "sql_commit" として計測する.
+    metrics が無効の間は時刻を取るだけで記録しない.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_execute(conn, *_args) -> None:  # type: ignore
+        conn.info["jma_execute_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_execute(conn, *_args) -> None:  # type: ignore
+        started = conn.info.pop("jma_execute_started", None)
+        if metrics.enabled and started is not None:
+            metrics.observe("sql_execute", time.perf_counter() - started)
+
+    # commit の完了を知らせるイベントはないので, DBAPI の commit を包む
+    dialect = engine.dialect
+    do_commit = dialect.do_commit
+
+    def _timed_commit(dbapi_connection) -> None:  # type: ignore
+        with metrics.timer("sql_commit"):
+            do_commit(dbapi_connection)
+
+    dialect.do_commit = _timed_commit  # type: ignore[method-assign]
+    return engine
+
+
+def enable_sql_echo(log_path: Path = DB_LOG) -> None:
+    """発行したSQLを log_path に書き出す. 遅くなるので調査のときだけ使う"""
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    sql_logger = logging.getLogger("sqlalchemy.engine")
+    sql_logger.setLevel(logging.INFO)
+    sql_logger.addHandler(logging.FileHandler(log_path, encoding="utf-8"))
+
+
+def create_engine_all(sqlite_url: str, echo: bool = False) -> Engine:
+    """WAL などの pragma を設定した engine. echo=True の場合は SQL を DB_LOG に書き出す"""
+    if echo:
+        enable_sql_echo()
+    engine = create_engine(sqlite_url, connect_args={"check_same_thread": False})
+    if engine.url.database not in (None, "", ":memory:"):
+        Path(engine.url.database).parent.mkdir(parents=True, exist_ok=True)
+    return instrument_sql(set_sqlite_pragmas(engine))
 
 
 def create_session(engine: Engine) -> Session:
     return Session(engine)
 
 
+def create_indexes(engine: Engine) -> None:
+    """create_all は既存のテーブルにインデックスを足さないので, 足りないものを作る"""
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+def migrate_fetched_html(engine: Engine) -> None:
+    """HtmlCache 導入前の fetchedhtml に digest の列を足し, html_content を NULL 可にする.
+    SQLite は列の制約を変えられないので, テーブルを作り直して行を移す.
+    """
+    table = FetchedHtml.__tablename__
+    inspector = inspect(engine)
+    if not inspector.has_table(table):
+        return
+    columns = {column["name"]: column for column in inspector.get_columns(table)}
+    with engine.begin() as conn:
+        if "digest" not in columns:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN digest VARCHAR"))
+        if columns["html_content"]["nullable"]:
+            return
+        old = f"_{table}_old"
+        conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+        # インデックスは名前が同じなので, 新しいテーブルを作る前に消す
+        for index in inspector.get_indexes(table):
+            conn.execute(text(f"DROP INDEX {index['name']}"))
+        FetchedHtml.__table__.create(conn)  # type: ignore[attr-defined]
+        names = ", ".join(column.name for column in FetchedHtml.__table__.columns)  # type: ignore[attr-defined]
+        conn.execute(text(f"INSERT INTO {table} ({names}) SELECT {names} FROM {old}"))
+        conn.execute(text(f"DROP TABLE {old}"))
+
+
 def create_db_and_tables(engine: Engine) -> Engine:
     SQLModel.metadata.create_all(engine)
+    migrate_fetched_html(engine)
+    create_indexes(engine)
     return engine
@@ -1,23 +1,25 @@
+"""コマンドラインの入口.
+CLI は何度も呼ばれるので, pandas, httpx などの重いモジュールは実際に取得するときに読み込む.
+--help だけなら標準ライブラリ, typer と観測地点の定義しか読み込まない.
+"""
 import re
 import sys
 from datetime import date, datetime
 from pathlib import Path
-from typing import Dict, Literal, Optional
+from typing import IO, TYPE_CHECKING, Dict, List, Literal, Optional
 
-from typer import Option
+from typer import BadParameter, Exit, Option
 
-from jma_scraper.core.html_to_dataframe import fetch_df
 from jma_scraper.core.location_instances import (
     HAMAMATSU,
     IWATA,
     SHIZUOKA,
-    HAMAMATSU_10Minutes_COLUMNS,
-    IWATA_10Minutes_COLUMNS,
-    SHIZUOKA_10Minutes_COLUMNS,
+    TEN_MINUTES_COLUMNS,
 )
-from jma_scraper.core.location_spec import Columns, Location, RecordInterval
-from jma_scraper.core.url_formatter import QueryParamsForJma
-from jma_scraper.infrastracture.http_client import fetch_html
+from jma_scraper.core.location_spec import Location, RecordInterval
+
+if TYPE_CHECKING:
+    from jma_scraper.core.repository import Fetcher, HtmlCache
 
 LOCATION_OK = Literal["hamamatsu", "iwata", "shizuoka"]
 LOCATION_MAPPING: Dict[LOCATION_OK, Location] = {
@@ -26,15 +28,13 @@ LOCATION_MAPPING: Dict[LOCATION_OK, Location] = {
     "shizuoka": SHIZUOKA,
 }
 
-EVERY = Literal["10m"]
-INTERVAL_MAPPINGS = {"10m": RecordInterval.ten_minutes}
-
-LocationAndInterval = Literal["hamamatsu 10m", "iwata 10m", "shizuoka 10m"]
-
-COLUMN_MAPPING: Dict[LocationAndInterval, Columns] = {
-    "hamamatsu 10m": HAMAMATSU_10Minutes_COLUMNS,
-    "iwata 10m": IWATA_10Minutes_COLUMNS,
-    "shizuoka 10m": SHIZUOKA_10Minutes_COLUMNS,
+EVERY = Literal["10m", "1h", "1d", "5d", "10d"]
+INTERVAL_MAPPINGS: Dict[EVERY, RecordInterval] = {
+    "10m": RecordInterval.ten_minutes,
+    "1h": RecordInterval.one_hour,
+    "1d": RecordInterval.one_day,  # 1ページに1ヶ月分
+    "5d": RecordInterval.five_day_divide_for_each_month,  # 1ページに1年分
+    "10d": RecordInterval.ten_day_divide_for_each_mont,  # 1ページに1年分
 }
 
 pattern = re.compile(r"\d{4}-\d{2}-\d{2}")
@@ -79,7 +79,17 @@ def to_csv(
     echo: bool,
     save_local: bool,
     dst_path: Optional[Path] = None,
+    fetcher: Optional["Fetcher"] = None,
+    cache: Optional["HtmlCache"] = None,
 ) -> None:
+    """fetcher を省略した場合は fetch_html"""
+    from jma_scraper.core.html_to_dataframe import fetch_df
+    from jma_scraper.core.table_decoder import fetch_decoded_df
+    from jma_scraper.core.url_formatter import QueryParamsForJma
+    from jma_scraper.infrastracture.http_client import fetch_html
+
+    if fetcher is None:
+        fetcher = fetch_html
     # -- 事前条件
     date_ = is_string_past_date(date_str)
     check_location_name(location_name)
@@ -88,18 +98,24 @@ def to_csv(
     location: Location = LOCATION_MAPPING[location_name]
     print(f"{location.name}-{location.en_name}")
 
+    record_interval = INTERVAL_MAPPINGS[every]
     qp = QueryParamsForJma(
-        date=date_,
+        date=record_interval.page_date(date_),
         block_no=location.location_no,
         prefecture_no=location.prefecture_no,
-        record_interval=INTERVAL_MAPPINGS[every],
+        record_interval=record_interval,
         location_col_type=location.col_type,
     )
     url = qp.query_url
     print(f"Fetching this url: {url}")
-    cols: Columns = COLUMN_MAPPING[f"{location_name} {every}"]  # type: ignore
-    after = cols.after_columns
-    df = fetch_df(qp=qp, after_columns=after, fetcher=fetch_html, time_out_sec=2.0)
+    if record_interval == RecordInterval.ten_minutes:
+        after = TEN_MINUTES_COLUMNS[location.col_type].after_columns
+        df = fetch_df(
+            qp=qp, after_columns=after, fetcher=fetcher, time_out_sec=2.0, cache=cache
+        )
+    else:
+        # 1時間, 日, 半旬, 旬ごとの値は table_decoder のレイアウトで直接デコードする
+        df = fetch_decoded_df(qp=qp, fetcher=fetcher, time_out_sec=2.0, cache=cache)
     if echo:
         df.to_csv(sys.stdout, index=False)
 
@@ -129,15 +145,94 @@ def create_dst_csv_path(
     return Path(f"{date_str}_{location_name}__every_{every}.csv")
 
 
+OUTPUT_FORMATS = ("csv", "jsonl", "parquet")
+
+
+def to_stream(
+    start_str: str,
+    end_str: str,
+    location_names: List[str],
+    every: EVERY,
+    jobs: int = 4,
+    output_format: str = "csv",
+    dst_path: Optional[Path] = None,
+    cache: Optional["HtmlCache"] = None,
+    min_interval_sec: float = 0.5,
+) -> int:
+    """start_str から end_str まで (両端を含む) の location_names のページを jobs 個並行に取得し,
+    (観測地点, 日付) の順に dst_path, または標準出力に書き出す. 失敗したページの数を返す.
+    日ごとの値などは1ページ (1ヶ月, 1年) 単位で書き出すので, 期間の外の日も含む.
+    """
+    import asyncio
+
+    from jma_scraper.infrastracture.http_client import AsyncJmaHttpClient
+    from jma_scraper.usecase.backfill import BackfillTarget, PolitenessBudget
+    from jma_scraper.usecase.export import ExportFormat, export, plan_export
+
+    # -- 事前条件
+    start_date = is_string_past_date(start_str).date()
+    end_date = is_string_past_date(end_str).date()
+    if end_date < start_date:
+        raise ValueError(
+            f"end should be on or after start, got {start_str=}, {end_str=}"
+        )
+    for location_name in location_names:
+        check_location_name(location_name)
+    check_input_interval_arg(every)
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Allowed format is one of {list(OUTPUT_FORMATS)}")
+
+    record_interval = INTERVAL_MAPPINGS[every]
+    targets = [
+        BackfillTarget(
+            location=LOCATION_MAPPING[name],  # type: ignore[index]
+            columns=TEN_MINUTES_COLUMNS[LOCATION_MAPPING[name].col_type]  # type: ignore[index]
+            if record_interval == RecordInterval.ten_minutes
+            else None,
+            record_interval=record_interval,
+        )
+        for name in dict.fromkeys(location_names)  # 重複を除いて順番は保つ
+    ]
+
+    async def run(out: IO[bytes]) -> int:
+        async with AsyncJmaHttpClient(max_connections=jobs) as client:
+            results = await export(
+                plan_export(targets, start_date, end_date),
+                client,
+                out,
+                ExportFormat(output_format),
+                jobs=jobs,
+                budget=PolitenessBudget(min_interval_sec),
+                cache=cache,
+            )
+        return sum(not result.ok for result in results)
+
+    if dst_path is None:
+        return asyncio.run(run(sys.stdout.buffer))
+    with dst_path.open("wb") as out:
+        return asyncio.run(run(out))
+
+
 def to_csv_with_typer(
-    date: str = Option(..., help="過去のデータの日付, 例: 2023-01-01"),
+    date: Optional[str] = Option(
+        None, help="過去のデータの日付, 例: 2023-01-01. 期間で取得する場合は --start, --end"
+    ),
+    start: Optional[str] = Option(None, help="期間の最初の日. 指定した場合は期間モードになる. 例: 2023-01-01"),
+    end: Optional[str] = Option(None, help="期間の最後の日 (含む). 省略した場合は --start と同じ日"),
+    jobs: int = Option(4, min=1, help="期間モードで同時に取得するページ数"),
+    output_format: str = Option(
+        "csv",
+        "--format",
+        help=f"期間モードの出力形式. allowed input: {list(OUTPUT_FORMATS)}",
+    ),
     dst_path: Optional[Path] = Option(
         None, help="保存するファイルパス", dir_okay=True, resolve_path=True
     ),
-    location_name: str = Option(
-        default="hamamatsu",
+    location_name: List[str] = Option(
+        default=["hamamatsu"],
         help=f"""
                       allowed input: {list(LOCATION_MAPPING.keys())}
+                      複数回指定した場合は期間モードで観測地点ごとに順に出力する
                       """,
     ),
     every: str = Option(
@@ -154,15 +249,48 @@ def to_csv_with_typer(
                       """,
     ),
     echo: bool = Option(default=True, help="標準出力に出力するかどうか"),
+    cache_dir: Optional[Path] = Option(
+        None,
+        help="取得したhtmlのキャッシュを置くディレクトリ. 指定した場合はキャッシュにあるページを再取得しない",
+        file_okay=False,
+        resolve_path=True,
+    ),
 ) -> None:
     """
     気象庁の過去データをコマンドラインから実行してCSV形式で取得,(保存する)
+
+    期間モード (--start を指定, または --location-name を複数指定) では, ページを並行に取得して
+    (観測地点, 日付) の順に --dst-path, または標準出力に書き出す.
     """
+    from jma_scraper.infrastracture.html_cache import PackedHtmlCache
+
+    cache = PackedHtmlCache(cache_dir) if cache_dir is not None else None
+    if start is not None or len(location_name) > 1:
+        first = start or date
+        if first is None:
+            raise BadParameter("--date か --start を指定してください")
+        failed = to_stream(
+            start_str=first,
+            end_str=end or first,
+            location_names=location_name,
+            every=every,  # type: ignore
+            jobs=jobs,
+            output_format=output_format,
+            dst_path=dst_path,
+            cache=cache,
+        )
+        if failed:
+            raise Exit(code=1)
+        return
+
+    if date is None:
+        raise BadParameter("--date か --start を指定してください")
     to_csv(
         date_str=date,
-        location_name=location_name,  # type: ignore
+        location_name=location_name[0],  # type: ignore
         dst_path=dst_path,
         every=every,  # type: ignore
         echo=echo,
         save_local=save_local,
+        cache=cache,
     )
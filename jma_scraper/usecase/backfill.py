@@ -0,0 +1,445 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import (
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import pandas as pd
+from loguru import logger
+
+from jma_scraper.core.compact import compact_frame
+from jma_scraper.core.errors import PageUrlError
+from jma_scraper.core.html_to_dataframe import parse_html_to_df
+from jma_scraper.core.location_spec import Columns, Location, RecordInterval
+from jma_scraper.core.metrics import METRICS
+from jma_scraper.core.repository import (
+    AsyncFetcher,
+    AuditLog,
+    BatchWriter,
+    HtmlCache,
+    Writer,
+    WriterSrcValues,
+)
+from jma_scraper.core.table_decoder import decode_table, layout_for
+from jma_scraper.core.timestamps import with_jst_index
+from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.infrastracture.db_tables import FetchedHtml, FetchFailed
+from jma_scraper.infrastracture.html_cache import html_digest
+
+WriterFactory = Callable[[WriterSrcValues], Writer]
+
+
+@dataclass(eq=True, frozen=True)
+class BackfillTarget:
+    """バックフィル対象の観測地点と, そのページのカラム仕様.
+    columns を省略した場合は table_decoder のレイアウトでデコードする.
+    compact=True の場合は compact_frame の型 (float32, 風向の Categorical, 時分の int16) で返す.
+    """
+
+    location: Location
+    columns: Optional[Columns] = None
+    record_interval: RecordInterval = RecordInterval.ten_minutes
+    compact: bool = False
+
+    def parse(self, html_text: str, date_: Optional[date] = None) -> pd.DataFrame:
+        """date_ を渡した場合は時分の列から JST の DatetimeIndex を付ける"""
+        if self.columns is not None:
+            df = parse_html_to_df(
+                html_text, self.columns.after_columns, compact=self.compact
+            )
+        else:
+            layout = layout_for(self.record_interval, self.location.col_type)
+            df = decode_table(html_text, layout).to_frame()
+            if self.compact:
+                df = compact_frame(df, layout)
+        return df if date_ is None else with_jst_index(df, date_)
+
+
+@dataclass(eq=True, frozen=True)
+class BackfillResult:
+    target: BackfillTarget
+    date: date
+    error: Union[str, None] = None
+    # 再試行するかどうかの判断に使う. 比較には含めない
+    exception: Optional[BaseException] = field(default=None, compare=False, repr=False)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class PolitenessBudget:
+    """全ワーカー共通のリクエスト開始間隔.
+    並行数を上げても気象庁のサーバーへのリクエストは min_interval_sec 以上の間隔をあける.
+    """
+
+    def __init__(self, min_interval_sec: float = 0.5):
+        if min_interval_sec < 0:
+            raise ValueError(
+                f"min_interval_sec should be non-negative, got {min_interval_sec}"
+            )
+        self.min_interval_sec = min_interval_sec
+        self._lock = asyncio.Lock()
+        self._next_start_at = 0.0
+
+    async def wait(self) -> None:
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._next_start_at > now:
+                await asyncio.sleep(self._next_start_at - now)
+                now = loop.time()
+            self._next_start_at = now + self.min_interval_sec
+
+
+def date_range(start_date: date, end_date: date) -> Iterator[date]:
+    """start_date から end_date までの日付 (両端を含む) を新しい順に返す.
+    >>> list(date_range(date(2022, 1, 1), date(2022, 1, 3)))
+    [datetime.date(2022, 1, 3), datetime.date(2022, 1, 2), datetime.date(2022, 1, 1)]
+    """
+    if end_date < start_date:
+        raise ValueError(
+            f"end_date should be on or after start_date, got {start_date=}, {end_date=}"
+        )
+    current_day = end_date
+    while current_day >= start_date:
+        yield current_day
+        current_day = current_day - timedelta(days=1)
+
+
+@dataclass(eq=True, frozen=True)
+class FetchedPage:
+    """fetch_page で取得した (またはキャッシュにあった) 1ページ"""
+
+    target: BackfillTarget
+    date: date
+    html_text: str
+
+
+@dataclass(eq=True, frozen=True)
+class _ParsedPage:
+    target: BackfillTarget
+    date: date
+    df: pd.DataFrame = field(compare=False)
+
+
+def parse_process_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """backfill の parse_executor に渡すプロセスプール. 既定はCPUのコア数.
+    監査ログのスレッドなどを持つプロセスを fork しないよう spawn で起動する.
+    """
+    return ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def parse_page(target: BackfillTarget, html_text: str, date_: date) -> pd.DataFrame:
+    """target.parse と同じ. プロセスプールに渡すので pickle できるモジュールの関数にする"""
+    return target.parse(html_text, date_)
+
+
+async def fetch_page(
+    target: BackfillTarget,
+    date_: date,
+    fetcher: AsyncFetcher,
+    budget: PolitenessBudget,
+    time_out_sec: float,
+    audit: Optional[AuditLog],
+    cache: Optional[HtmlCache],
+) -> Union[FetchedPage, BackfillResult]:
+    """1ページを budget の間隔を守って取得する. cache にあれば取得しない.
+    取得できたページ, または失敗した BackfillResult を返し, 例外は送出しない.
+    """
+    try:
+        q_jma = QueryParamsForJma.from_location_spec(
+            target.location, date_, target.record_interval
+        )
+    except ValueError as e:
+        # 未来の日付などは何度試してもURLを作れない
+        error = e if isinstance(e, PageUrlError) else PageUrlError(str(e))
+        return BackfillResult(target=target, date=date_, error=str(e), exception=error)
+
+    key = str(q_jma.query_url)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        # キャッシュにあるページは気象庁に問い合わせないので budget も消費しない
+        METRICS.inc("html_cache_hit")
+        return FetchedPage(target=target, date=date_, html_text=cached)
+
+    if cache is not None:
+        METRICS.inc("html_cache_miss")
+    with METRICS.timer("politeness_wait"):
+        await budget.wait()
+    try:
+        html_text = await fetcher(q_jma, time_out_sec=time_out_sec)
+    except Exception as e:
+        if audit is not None:
+            audit.record(FetchFailed(url=q_jma.query_url, message=str(e)))
+        return BackfillResult(target=target, date=date_, error=str(e), exception=e)
+
+    digest = cache.put(key, html_text) if cache is not None else html_digest(html_text)
+    if audit is not None:
+        audit.record(FetchedHtml(url=q_jma.query_url, digest=digest))
+    return FetchedPage(target=target, date=date_, html_text=html_text)
+
+
+T = TypeVar("T")
+
+
+async def run_jobs(
+    jobs: Iterable[T], handle: Callable[[T], Awaitable[None]], concurrency: int
+) -> None:
+    """concurrency 個のワーカーが jobs を先頭から1つずつ取り出して handle を await する"""
+    remaining = iter(jobs)
+
+    async def worker() -> None:
+        # シングルスレッドのイベントループ上なので remaining の共有にロックは不要
+        for job in remaining:
+            await handle(job)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def _src_values(page: _ParsedPage) -> WriterSrcValues:
+    return WriterSrcValues(
+        date=page.date,
+        location_name=page.target.location.en_name,
+        every_xx=page.target.record_interval.to_literal(),
+    )
+
+
+def _write_page(page: _ParsedPage, writer_factory: WriterFactory) -> None:
+    writer_factory(_src_values(page)).write(page.df, None)
+
+
+def _write_batch(pages: List[_ParsedPage], writer: BatchWriter) -> None:
+    writer.write_many([(_src_values(page), page.df) for page in pages])
+
+
+async def backfill_pages(
+    pages: Sequence[Tuple[date, BackfillTarget]],
+    fetcher: AsyncFetcher,
+    writer_factory: WriterFactory,
+    *,
+    concurrency: int = 4,
+    budget: Union[PolitenessBudget, None] = None,
+    time_out_sec: float = 2.0,
+    audit: Optional[AuditLog] = None,
+    cache: Optional[HtmlCache] = None,
+    parse_executor: Optional[Executor] = None,
+    parse_concurrency: Optional[int] = None,
+    queue_size: Optional[int] = None,
+) -> List[BackfillResult]:
+    """(ページの日付, 観測地点) の組を 取得 → パース → 保存 のパイプラインで処理する.
+    引数は backfill と同じ. 渡した順に取得する.
+
+    各段階は上限つきのキューでつなぐので, パースや保存が遅いと取得が待つ.
+    何年分を流してもメモリに載るのはキューの長さ分のページだけ.
+    """
+    if concurrency < 1:
+        raise ValueError(f"concurrency should be 1 or more, got {concurrency}")
+    pacer = budget if budget is not None else PolitenessBudget()
+    if parse_concurrency is None:
+        # Executor の並列数は公開されていないので, プールの既定と同じコア数にする
+        parse_concurrency = (
+            concurrency if parse_executor is None else (os.cpu_count() or 1)
+        )
+    if parse_concurrency < 1:
+        raise ValueError(
+            f"parse_concurrency should be 1 or more, got {parse_concurrency}"
+        )
+    queue_size = queue_size if queue_size is not None else 2 * parse_concurrency
+
+    # None はそれ以上流れてこないことを下流に知らせる
+    fetched: "asyncio.Queue[Optional[FetchedPage]]" = asyncio.Queue(queue_size)
+    parsed: "asyncio.Queue[Optional[_ParsedPage]]" = asyncio.Queue(queue_size)
+    results: List[BackfillResult] = []
+    loop = asyncio.get_running_loop()
+
+    def finish(result: BackfillResult) -> None:
+        METRICS.inc("pages_ok" if result.ok else "pages_failed")
+        if result.ok:
+            logger.info("{} {} done", result.target.location.en_name, result.date)
+        else:
+            logger.error(
+                "{} {} failed: {}",
+                result.target.location.en_name,
+                result.date,
+                result.error,
+            )
+        results.append(result)
+
+    async def fetch(job: Tuple[date, BackfillTarget]) -> None:
+        date_, target = job
+        page = await fetch_page(
+            target, date_, fetcher, pacer, time_out_sec, audit, cache
+        )
+        if isinstance(page, BackfillResult):
+            finish(page)
+        else:
+            await fetched.put(page)
+
+    async def fetch_stage() -> None:
+        await run_jobs(pages, fetch, concurrency)
+        for _ in range(parse_concurrency):
+            await fetched.put(None)
+
+    async def parse_worker() -> None:
+        while (page := await fetched.get()) is not None:
+            try:
+                # パースはCPUを使うので, プロセスプールがあればそちらで並列に
+                with METRICS.timer("parse"):
+                    df = await loop.run_in_executor(
+                        parse_executor,
+                        parse_page,
+                        page.target,
+                        page.html_text,
+                        page.date,
+                    )
+            except Exception as e:
+                finish(
+                    BackfillResult(
+                        target=page.target, date=page.date, error=str(e), exception=e
+                    )
+                )
+                continue
+            await parsed.put(_ParsedPage(target=page.target, date=page.date, df=df))
+
+    async def write_worker() -> None:
+        while (page := await parsed.get()) is not None:
+            try:
+                # ファイル書き込みはブロッキングなのでイベントループを止めないよう別スレッドで
+                await asyncio.to_thread(_write_page, page, writer_factory)
+            except Exception as e:
+                finish(
+                    BackfillResult(
+                        target=page.target, date=page.date, error=str(e), exception=e
+                    )
+                )
+                continue
+            finish(BackfillResult(target=page.target, date=page.date))
+
+    async def parse_stage() -> None:
+        await asyncio.gather(*(parse_worker() for _ in range(parse_concurrency)))
+        for _ in range(concurrency):
+            await parsed.put(None)
+
+    async def batch_write_worker(writer: BatchWriter) -> None:
+        # 1ページずつ書くと書くたびにパーティションを書き直すので, まとめて書く
+        batch: List[_ParsedPage] = []
+        done = False
+        while not done:
+            page = await parsed.get()
+            if page is None:
+                done = True
+            else:
+                batch.append(page)
+            if batch and (done or len(batch) >= writer.batch_pages):
+                try:
+                    await asyncio.to_thread(_write_batch, batch, writer)
+                    error: Optional[Exception] = None
+                except Exception as e:
+                    error = e
+                for written in batch:
+                    finish(
+                        BackfillResult(
+                            target=written.target,
+                            date=written.date,
+                            error=None if error is None else str(error),
+                            exception=error,
+                        )
+                    )
+                batch = []
+
+    async def write_stage() -> None:
+        if isinstance(writer_factory, BatchWriter):
+            # 終わりの印は concurrency 個届くので, 最初の1つで書き出してから残りを読み捨てる
+            await batch_write_worker(writer_factory)
+            for _ in range(concurrency - 1):
+                await parsed.get()
+            return
+        await asyncio.gather(*(write_worker() for _ in range(concurrency)))
+
+    async with asyncio.TaskGroup() as group:
+        group.create_task(fetch_stage())
+        group.create_task(parse_stage())
+        group.create_task(write_stage())
+    return results
+
+
+def plan_pages(
+    targets: Sequence[BackfillTarget], start_date: date, end_date: date
+) -> List[Tuple[date, BackfillTarget]]:
+    """期間内に取得するページを新しい順に並べる.
+    日ごとの値などは1ページに複数日が入っているので, ページ単位で1回だけ取得する.
+    """
+    if end_date < start_date:
+        raise ValueError(
+            f"end_date should be on or after start_date, got {start_date=}, {end_date=}"
+        )
+    pages = [
+        (page_date, target)
+        for target in targets
+        for page_date in target.record_interval.page_dates(start_date, end_date)
+    ]
+    pages.sort(key=lambda page: page[0], reverse=True)
+    return pages
+
+
+async def backfill(
+    targets: Sequence[BackfillTarget],
+    start_date: date,
+    end_date: date,
+    fetcher: AsyncFetcher,
+    writer_factory: WriterFactory,
+    *,
+    concurrency: int = 4,
+    budget: Union[PolitenessBudget, None] = None,
+    time_out_sec: float = 2.0,
+    audit: Optional[AuditLog] = None,
+    cache: Optional[HtmlCache] = None,
+    parse_executor: Optional[Executor] = None,
+    parse_concurrency: Optional[int] = None,
+) -> List[BackfillResult]:
+    """(観測地点, ページの日付) の組を concurrency 個のワーカーで並行に取得, 変換, 保存する.
+
+    :param targets: 観測地点とカラム仕様
+    :param start_date: 取得する最初の日 (含む)
+    :param end_date: 取得する最後の日 (含む)
+    :param fetcher: AsyncFetcher
+    :param writer_factory: WriterSrcValues から Writer を作る callable. 例: DfLocalCsvWriter.
+        BatchWriter (例: ParquetBatchWriter) の場合はページをまとめて write_many で書き込む
+    :param concurrency: 同時に処理する (観測地点, 日付) の最大数
+    :param budget: 全ワーカーで共有するリクエスト間隔. Noneの場合は 0.5秒間隔
+    :param audit: 渡した場合は FetchedHtml, FetchFailed を記録する. 例: AuditLogWriter
+    :param cache: 渡した場合はキャッシュにあるページを取得せずに使い, 取得したページを保存する
+    :param parse_executor: パースを実行する Executor. 例: parse_process_pool().
+        Noneの場合はイベントループの既定のスレッドプール
+    :param parse_concurrency: 同時にパースするページの最大数. parse_process_pool(n) には n を渡す.
+        Noneの場合は parse_executor があればCPUのコア数, なければ concurrency
+    :return: (観測地点, 日付) ごとの結果. 失敗しても例外は送出せず error に記録する.
+    """
+    return await backfill_pages(
+        plan_pages(targets, start_date, end_date),
+        fetcher,
+        writer_factory,
+        concurrency=concurrency,
+        budget=budget,
+        time_out_sec=time_out_sec,
+        audit=audit,
+        cache=cache,
+        parse_executor=parse_executor,
+        parse_concurrency=parse_concurrency,
+    )
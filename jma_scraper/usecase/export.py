@@ -0,0 +1,302 @@
+"""複数の観測地点, 日付のページを並行に取得し, (観測地点, 日付) の順に1つのストリームへ書き出す.
+
+取得の終わる順番はばらばらなので, 並べ替えバッファで順番がそろったものから書き出す.
+取得済みで未出力のページは window 個までに抑えるので, 期間の長さによらずメモリは一定.
+
+$ python main.py --start 2022-01-01 --end 2022-01-31 --location-name hamamatsu --location-name iwata --jobs 8 --format jsonl
+"""
+import asyncio
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from datetime import date
+from enum import StrEnum
+from typing import (
+    IO,
+    AsyncIterator,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+
+from jma_scraper.core.repository import AsyncFetcher, HtmlCache
+from jma_scraper.infrastracture.parquet import (
+    DATE_COLUMN,
+    row_dates,
+    to_storage_table,
+)
+from jma_scraper.usecase.backfill import (
+    BackfillResult,
+    BackfillTarget,
+    PolitenessBudget,
+    fetch_page,
+    parse_page,
+)
+
+STATION_COLUMN = "station"
+
+T = TypeVar("T")
+
+
+class ReorderBuffer(Generic[T]):
+    """番号つきで届いたものを 0, 1, 2, ... の順に取り出す.
+
+    >>> buffer = ReorderBuffer()
+    >>> buffer.put(1, "b")
+    >>> list(buffer.pop_ready())
+    []
+    >>> buffer.put(0, "a")
+    >>> list(buffer.pop_ready())
+    ['a', 'b']
+    >>> len(buffer)
+    0
+    """
+
+    def __init__(self) -> None:
+        self.next_index = 0
+        self._pending: Dict[int, T] = {}
+
+    def put(self, index: int, item: T) -> None:
+        if index < self.next_index or index in self._pending:
+            raise ValueError(f"index {index} is already taken")
+        self._pending[index] = item
+
+    def pop_ready(self) -> Iterator[T]:
+        while self.next_index in self._pending:
+            yield self._pending.pop(self.next_index)
+            self.next_index += 1
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+@dataclass(eq=True, frozen=True)
+class PageFrame:
+    target: BackfillTarget
+    date: date
+    df: Optional[pd.DataFrame] = field(default=None, compare=False)
+    error: Union[str, None] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def to_result(self) -> BackfillResult:
+        return BackfillResult(target=self.target, date=self.date, error=self.error)
+
+
+def plan_export(
+    targets: Sequence[BackfillTarget], start_date: date, end_date: date
+) -> List[Tuple[date, BackfillTarget]]:
+    """targets の順, 各観測地点の中では日付の古い順に, 取得するページを並べる.
+    日ごとの値などは1ページに複数日が入っているので, ページ単位で1回だけ取得する.
+    """
+    return [
+        (page_date, target)
+        for target in targets
+        for page_date in reversed(
+            target.record_interval.page_dates(start_date, end_date)
+        )
+    ]
+
+
+async def fetch_in_order(
+    pages: Sequence[Tuple[date, BackfillTarget]],
+    fetcher: AsyncFetcher,
+    *,
+    jobs: int = 4,
+    window: Optional[int] = None,
+    budget: Union[PolitenessBudget, None] = None,
+    time_out_sec: float = 2.0,
+    cache: Optional[HtmlCache] = None,
+    parse_executor: Optional[Executor] = None,
+) -> AsyncIterator[PageFrame]:
+    """pages を jobs 個のワーカーで取得, パースし, pages の順に返す.
+    失敗したページも順番どおり error つきで返す.
+
+    :param window: 取得を始めてまだ返していないページの上限. 既定は jobs の4倍.
+        先頭のページが遅れても, 後ろのページはこれ以上先に進まない.
+    """
+    if jobs < 1:
+        raise ValueError(f"jobs should be 1 or more, got {jobs}")
+    window = window if window is not None else 4 * jobs
+    if window < jobs:
+        raise ValueError(f"window should be jobs ({jobs}) or more, got {window}")
+    pacer = budget if budget is not None else PolitenessBudget()
+
+    numbered = iter(enumerate(pages))
+    slots = asyncio.Semaphore(window)
+    buffer: ReorderBuffer[PageFrame] = ReorderBuffer()
+    arrived = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    async def fetch_and_parse(target: BackfillTarget, date_: date) -> PageFrame:
+        page = await fetch_page(
+            target, date_, fetcher, pacer, time_out_sec, None, cache
+        )
+        if isinstance(page, BackfillResult):
+            return PageFrame(target=target, date=date_, error=page.error)
+        try:
+            df = await loop.run_in_executor(
+                parse_executor, parse_page, target, page.html_text, date_
+            )
+        except Exception as e:
+            return PageFrame(target=target, date=date_, error=str(e))
+        return PageFrame(target=target, date=date_, df=df)
+
+    async def worker() -> None:
+        try:
+            while True:
+                # 先に枠を取ってから番号を取るので, 先頭のページは必ずどこかのワーカーが持つ
+                await slots.acquire()
+                try:
+                    index, (date_, target) = next(numbered)
+                except StopIteration:
+                    slots.release()
+                    return
+                buffer.put(index, await fetch_and_parse(target, date_))
+                arrived.set()
+        finally:
+            # 予期しない例外で止まった場合も待っている側を起こす
+            arrived.set()
+
+    workers = [asyncio.create_task(worker()) for _ in range(jobs)]
+    try:
+        emitted = 0
+        while emitted < len(pages):
+            await arrived.wait()
+            arrived.clear()
+            for frame in buffer.pop_ready():
+                slots.release()
+                emitted += 1
+                yield frame
+            for task in workers:
+                if task.done() and not task.cancelled() and task.exception():
+                    raise task.exception()  # type: ignore[misc]
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+class ExportFormat(StrEnum):
+    csv = "csv"
+    jsonl = "jsonl"
+    parquet = "parquet"
+
+
+def _with_keys(frame: PageFrame) -> pd.DataFrame:
+    """先頭に観測地点と日付の列を足す. 日付は Parquet と同じく row_dates の行ごとの日付.
+    float32 の列は表示どおりの値の float64 にするので, JSON に 21.9 が 21.8999996185 と書かれない.
+    """
+    df = frame.df.copy()  # type: ignore[union-attr]
+    for name in df.columns[df.dtypes == np.float32]:
+        df[name] = df[name].astype(str).astype(np.float64)
+    dates = row_dates(df, frame.date, frame.target.record_interval)  # type: ignore[arg-type]
+    df.insert(0, DATE_COLUMN, np.datetime_as_string(dates, unit="D"))
+    df.insert(0, STATION_COLUMN, frame.target.location.en_name)
+    return df
+
+
+class FrameSink:
+    """PageFrame を順に out に書き出す. out はバイナリのストリーム (sys.stdout.buffer など)"""
+
+    def __init__(self, out: IO[bytes], fmt: ExportFormat):
+        self.out = out
+        self.fmt = fmt
+        self._csv_columns: Optional[List[str]] = None
+        self._parquet: Optional[pq.ParquetWriter] = None
+
+    def write(self, frame: PageFrame) -> None:
+        if self.fmt == ExportFormat.parquet:
+            self._write_parquet(frame)
+            return
+        df = _with_keys(frame)
+        if self.fmt == ExportFormat.jsonl:
+            text = df.to_json(orient="records", lines=True, force_ascii=False)
+            self.out.write(text.encode("utf-8"))
+            if not text.endswith("\n"):
+                self.out.write(b"\n")
+        else:
+            # 観測地点によって列が違うので, 列が変わったところでだけヘッダーを書く
+            columns = list(df.columns)
+            header = columns != self._csv_columns
+            self._csv_columns = columns
+            self.out.write(df.to_csv(index=False, header=header).encode("utf-8"))
+        self.out.flush()
+
+    def _write_parquet(self, frame: PageFrame) -> None:
+        table = to_storage_table(
+            frame.df, frame.date, frame.target.record_interval  # type: ignore[arg-type]
+        )
+        table = table.add_column(
+            0,
+            STATION_COLUMN,
+            pa.array([frame.target.location.en_name] * len(table), type=pa.string()),
+        )
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self.out, table.schema, compression="zstd")
+        elif not table.schema.equals(self._parquet.schema):
+            raise ValueError(
+                "Parquet output needs the same columns for every page. "
+                f"{frame.target.location.en_name} {frame.date} differs, use csv or jsonl instead."
+            )
+        self._parquet.write_table(table)
+
+    def close(self) -> None:
+        if self._parquet is not None:
+            self._parquet.close()
+        self.out.flush()
+
+
+async def export(
+    pages: Sequence[Tuple[date, BackfillTarget]],
+    fetcher: AsyncFetcher,
+    out: IO[bytes],
+    fmt: ExportFormat = ExportFormat.csv,
+    *,
+    jobs: int = 4,
+    window: Optional[int] = None,
+    budget: Union[PolitenessBudget, None] = None,
+    time_out_sec: float = 2.0,
+    cache: Optional[HtmlCache] = None,
+) -> List[BackfillResult]:
+    """pages を取得して (観測地点, 日付) の順に out へ書き出す.
+    失敗したページは飛ばしてログに残し, 結果として返す.
+    """
+    sink = FrameSink(out, fmt)
+    results: List[BackfillResult] = []
+    try:
+        async for frame in fetch_in_order(
+            pages,
+            fetcher,
+            jobs=jobs,
+            window=window,
+            budget=budget,
+            time_out_sec=time_out_sec,
+            cache=cache,
+        ):
+            if frame.ok:
+                sink.write(frame)
+            else:
+                logger.error(
+                    "{} {} failed: {}",
+                    frame.target.location.en_name,
+                    frame.date,
+                    frame.error,
+                )
+            results.append(frame.to_result())
+    finally:
+        sink.close()
+    return results
@@ -1,21 +1,17 @@
 from datetime import date
-from typing import Any
+from typing import Any, Optional
 
 import pandas as pd
 from sqlmodel import Session
 
-from jma_scraper.core.html_to_dataframe import (
-    flatten_columns,
-    format_columns,
-    pluck_table_from_html,
-    read_html_table,
-)
+from jma_scraper.core.html_to_dataframe import parse_html_to_df
 
 from ...core.location_instances import HAMAMATSU, HAMAMATSU_10Minutes_COLUMNS
 from ...core.location_spec import RecordInterval
-from ...core.repository import Fetcher, Writer
+from ...core.repository import Fetcher, HtmlCache, Writer
 from ...core.url_formatter import QueryParamsForJma
 from ...infrastracture.db_tables import FetchedHtml, FetchFailed
+from ...infrastracture.html_cache import html_digest
 
 
 def fetch_and_write_hamamatsu_10_minutes_table(
@@ -26,7 +22,11 @@ def fetch_and_write_hamamatsu_10_minutes_table(
     writer: Writer,
     dst: Any = None,
     session: Session,
+    cache: Optional[HtmlCache] = None,
 ) -> None:
+    """cache を渡した場合はキャッシュにあるページは取得せずに使い,
+    取得したページはキャッシュに保存する. FetchedHtml にはダイジェストだけを記録する.
+    """
     q_jma = QueryParamsForJma(
         date=target_date,
         prefecture_no=HAMAMATSU.prefecture_no,
@@ -34,24 +34,32 @@ def fetch_and_write_hamamatsu_10_minutes_table(
         record_interval=RecordInterval.from_literal("every_10_minutes"),
     )
 
-    try:
-        html_text = fetcher(query_param=q_jma, time_out_sec=http_time_out_sec)
-        data: FetchedHtml = FetchedHtml(url=q_jma.query_url, html_content=html_text)
-        session.add(data)
-        session.commit()
-    except Exception as e:
-        message = str(e)
-        failed = FetchFailed(url=q_jma.query_url, message=message)
-        session.add(failed)
-        raise
-
-    html_table: str = pluck_table_from_html(html_text)
-
-    df: pd.DataFrame = read_html_table(html_table, pd.read_html)
-    df = flatten_columns(df)
-    assert list(df.columns) == HAMAMATSU_10Minutes_COLUMNS.original_columns
-    df = format_columns(df, HAMAMATSU_10Minutes_COLUMNS.after_columns)
-    assert list(df.columns) == HAMAMATSU_10Minutes_COLUMNS.after_columns
+    key = str(q_jma.query_url)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        html_text = cached
+    else:
+        try:
+            html_text = fetcher(query_param=q_jma, time_out_sec=http_time_out_sec)
+            digest = (
+                cache.put(key, html_text)
+                if cache is not None
+                else html_digest(html_text)
+            )
+            data: FetchedHtml = FetchedHtml(url=q_jma.query_url, digest=digest)
+            session.add(data)
+            session.commit()
+        except Exception as e:
+            message = str(e)
+            failed = FetchFailed(url=q_jma.query_url, message=message)
+            session.add(failed)
+            # 送出する前に commit しないと失敗の記録が消える
+            session.commit()
+            raise
+
+    df: pd.DataFrame = parse_html_to_df(
+        html_text, HAMAMATSU_10Minutes_COLUMNS.after_columns
+    )
 
     writer.write(df, dst=dst)
     session.close()
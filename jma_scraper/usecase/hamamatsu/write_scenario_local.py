@@ -4,17 +4,22 @@ from pathlib import Path
 from sqlmodel import Session
 
 from jma_scraper.core.location_instances import HAMAMATSU
-from jma_scraper.core.repository import WriterSrcValues
+from jma_scraper.core.repository import Fetcher, HtmlCache, WriterSrcValues
 from jma_scraper.infrastracture.db_tables import LocalFileSaved
+from jma_scraper.infrastracture.html_cache import PackedHtmlCache
 from jma_scraper.infrastracture.http_client import fetch_html
-from jma_scraper.infrastracture.localfile import DfLocalCsvWriter
+from jma_scraper.infrastracture.localfile import JMA_HTML_CACHE_DIR, DfLocalCsvWriter
 from jma_scraper.usecase.hamamatsu.write_scenario_interface import (
     fetch_and_write_hamamatsu_10_minutes_table,
 )
 
 
 def write_scenario_local(
-    date_: date, session: Session, dst: Path | None = None
+    date_: date,
+    session: Session,
+    dst: Path | None = None,
+    fetcher: Fetcher = fetch_html,
+    cache: HtmlCache | None = None,
 ) -> None:
     src_values = WriterSrcValues(
         date=date_, location_name=HAMAMATSU.en_name, every_xx="every_10_minutes"
@@ -23,14 +28,17 @@ def write_scenario_local(
     writer = DfLocalCsvWriter(src_values)
     if dst is None:
         dst = writer.create_csv_full_path()
+    if cache is None:
+        cache = PackedHtmlCache(JMA_HTML_CACHE_DIR)
 
     try:
         fetch_and_write_hamamatsu_10_minutes_table(
-            fetcher=fetch_html,
+            fetcher=fetcher,
             target_date=date_,
             writer=writer,
             dst=dst,
             session=session,
+            cache=cache,
         )
         data = LocalFileSaved(file_path=str(dst))
         session.add(data)
@@ -1,22 +1,79 @@
+import asyncio
 from datetime import date
+from functools import partial
 from pathlib import Path
-from typing import Union
+from typing import Iterable, List, Tuple, Union
 
 from botocore.exceptions import EndpointConnectionError
+from loguru import logger
 from pydantic import HttpUrl, validate_arguments
-from sqlmodel import Session, create_engine
+from sqlmodel import Session
 
-from jma_scraper.core.location_instances import HAMAMATSU
+from jma_scraper.core.location_instances import HAMAMATSU, HAMAMATSU_10Minutes_COLUMNS
 from jma_scraper.core.repository import WriterSrcValues
 from jma_scraper.infrastracture.db_tables import R2UploadFailed, R2UploadSucceeded
+from jma_scraper.infrastracture.http_client import AsyncJmaHttpClient
 from jma_scraper.infrastracture.localfile import JMA_CSV_DIR, RESOURCE_ROOT
-from jma_scraper.infrastracture.r2 import LocalToR2Writer, R2Conf
+from jma_scraper.infrastracture.r2 import (
+    DEFAULT_MAX_WORKERS,
+    DfR2Writer,
+    LocalToR2Writer,
+    R2BulkUploader,
+    R2Conf,
+    R2ObjectFormat,
+    R2UploadResult,
+)
 from jma_scraper.infrastracture.sqlite_starter import (
     DB_PATH,
     create_db_and_tables,
+    create_engine_all,
     create_session,
     create_sql_url,
 )
+from jma_scraper.usecase.backfill import (
+    BackfillResult,
+    BackfillTarget,
+    PolitenessBudget,
+    backfill,
+)
+
+
+def r2_key_for_local_csv(src: Path) -> str:
+    """
+    >>> r2_key_for_local_csv(Path("/x/2022-01-01__hamamatsu__every_10_minutes.csv"))
+    '__data__/jma_csv/2022-01-01__hamamatsu__every_10_minutes.csv'
+    """
+    return f"{RESOURCE_ROOT.name}/{JMA_CSV_DIR.name}/{src.name}"
+
+
+def record_r2_results(results: Iterable[R2UploadResult], session: Session) -> None:
+    """アップロードの結果をまとめて1回の commit で記録する"""
+    rows: List[Union[R2UploadSucceeded, R2UploadFailed]] = []
+    for result in results:
+        url = HttpUrl(result.url, scheme="https")
+        if result.ok:
+            rows.append(R2UploadSucceeded(url=url))
+        else:
+            rows.append(R2UploadFailed(url=url, message=result.error or ""))
+    session.add_all(rows)
+    session.commit()
+
+
+def write_many_from_local_to_r2(
+    srcs: Iterable[Path],
+    r2_conf: R2Conf,
+    *,
+    session: Session,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    uploader: Union[R2BulkUploader, None] = None,
+) -> List[R2UploadResult]:
+    """ローカルのCSVを並行にアップロードし, 結果を R2UploadSucceeded/R2UploadFailed に記録する"""
+    if uploader is None:
+        uploader = R2BulkUploader(r2_conf, max_workers=max_workers)
+    items: List[Tuple[Path, str]] = [(src, r2_key_for_local_csv(src)) for src in srcs]
+    results = uploader.upload(items)
+    record_r2_results(results, session)
+    return results
 
 
 def write_from_local_to_r2(
@@ -57,7 +114,7 @@ def write_from_local_to_r2(
 @validate_arguments
 def main(date_: date, src_csv_file: str) -> None:
     sqlite_url = create_sql_url(str(DB_PATH))
-    engine = create_engine(sqlite_url, echo=True)
+    engine = create_engine_all(sqlite_url)
     create_db_and_tables(engine)
 
     session = create_session(engine)
@@ -67,3 +124,60 @@ def main(date_: date, src_csv_file: str) -> None:
         src=JMA_CSV_DIR / src_csv_file,
         session=session,
     )
+
+
+@validate_arguments
+def main_bulk(pattern: str = "*.csv", max_workers: int = DEFAULT_MAX_WORKERS) -> None:
+    """JMA_CSV_DIR の pattern に合うCSVをまとめてアップロードする. 例: pattern="2022-*__hamamatsu__*.csv" """
+    sqlite_url = create_sql_url(str(DB_PATH))
+    engine = create_engine_all(sqlite_url)
+    create_db_and_tables(engine)
+
+    with create_session(engine) as session:
+        write_many_from_local_to_r2(
+            sorted(JMA_CSV_DIR.glob(pattern)),
+            R2Conf(BUCKET_NAME="00-hq"),
+            session=session,
+            max_workers=max_workers,
+        )
+
+
+async def _backfill_to_r2(
+    start_date: date,
+    end_date: date,
+    r2_conf: R2Conf,
+    fmt: R2ObjectFormat,
+    concurrency: int,
+) -> List[BackfillResult]:
+    target = BackfillTarget(location=HAMAMATSU, columns=HAMAMATSU_10Minutes_COLUMNS)
+    async with AsyncJmaHttpClient(max_connections=concurrency) as client:
+        return await backfill(
+            [target],
+            start_date,
+            end_date,
+            fetcher=client,
+            writer_factory=partial(DfR2Writer, r2_conf=r2_conf, fmt=fmt),
+            concurrency=concurrency,
+            budget=PolitenessBudget(),
+        )
+
+
+@validate_arguments
+def main_stream(
+    start_date: date,
+    end_date: date,
+    fmt: R2ObjectFormat = R2ObjectFormat.csv_zstd,
+    concurrency: int = 4,
+) -> None:
+    """浜松10分ごとのデータを取得して, ローカルに保存せずに直接 R2 に書き込む.
+    ローカルのファイルにも SQLite にも書かないので, 書き込み可能なボリュームのないコンテナでも動く.
+    """
+    results = asyncio.run(
+        _backfill_to_r2(
+            start_date, end_date, R2Conf(BUCKET_NAME="00-hq"), fmt, concurrency
+        )
+    )
+    failed = [result for result in results if not result.ok]
+    if failed:
+        # DB も使わないので, 失敗は標準エラーのログにだけ残す
+        logger.error("{} of {} days failed", len(failed), len(results))
@@ -0,0 +1,267 @@
+"""取得に失敗したページの再試行キュー.
+
+RetryJob テーブルに url ごとの試行回数と次に試せる時刻を持ち,
+期限の来たものだけを backfill_pages で並行に取り直す.
+一時的なエラーは指数バックオフ (ジッター付き, Retry-After を優先) で再試行し,
+恒久的なエラーと試行回数の上限に達したものは dead にして以降は取らない.
+"""
+import random
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import List, Optional, Sequence, Tuple, Union
+
+import httpx
+from loguru import logger
+from sqlmodel import Session, select
+
+from jma_scraper.core.errors import PermanentPageError
+from jma_scraper.core.repository import AsyncFetcher, AuditLog, HtmlCache
+from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.infrastracture.db_tables import FetchFailed, RetryJob, RetryStatus
+from jma_scraper.usecase.backfill import (
+    BackfillResult,
+    BackfillTarget,
+    PolitenessBudget,
+    WriterFactory,
+    backfill_pages,
+)
+
+# 再試行しても結果の変わらないステータスコード
+PERMANENT_STATUS_CODES = frozenset({400, 401, 403, 404, 405, 410, 414, 501})
+
+
+def parse_retry_after(
+    value: Optional[str], now_utc: Optional[datetime] = None
+) -> Optional[float]:
+    """Retry-After ヘッダーの秒数. 秒数と HTTP-date の両方の形式を受け付ける.
+    >>> parse_retry_after("120")
+    120.0
+    >>> parse_retry_after("Sun, 01 Jan 2023 00:01:00 GMT", datetime(2023, 1, 1, tzinfo=timezone.utc))
+    60.0
+    >>> parse_retry_after("soon") is None
+    True
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    now_utc = now_utc or datetime.now(timezone.utc)
+    return max((retry_at - now_utc).total_seconds(), 0.0)
+
+
+def classify_error(exc: Optional[BaseException]) -> Tuple[bool, Optional[float]]:
+    """(恒久的なエラーか, Retry-After の秒数) を返す.
+    HTTP の 4xx (429 を除く) と, レイアウトやURLが不正な PermanentPageError は恒久的とみなす.
+    タイムアウト, 接続エラー, 429, 5xx, メンテナンス中のページなどのそれ以外のエラーは一時的とみなす.
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        response = exc.response
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        return response.status_code in PERMANENT_STATUS_CODES, retry_after
+    if isinstance(exc, httpx.TransportError):
+        return False, None
+    if isinstance(exc, PermanentPageError):
+        return True, None
+    return False, None
+
+
+@dataclass(eq=True, frozen=True)
+class RetryPolicy:
+    """base_delay_sec * 2 ** (attempts - 1) を上限にした full jitter の待ち時間"""
+
+    base_delay_sec: float = 60.0
+    max_delay_sec: float = 6 * 60 * 60
+    max_attempts: int = 8
+
+    def delay_sec(
+        self,
+        attempts: int,
+        retry_after_sec: Optional[float] = None,
+        rng: Union[random.Random, None] = None,
+    ) -> float:
+        """
+        >>> policy = RetryPolicy(base_delay_sec=10, max_delay_sec=100)
+        >>> 0 <= policy.delay_sec(1) <= 10
+        True
+        >>> policy.delay_sec(3, retry_after_sec=300)
+        300
+        """
+        ceiling = min(self.max_delay_sec, self.base_delay_sec * 2 ** (attempts - 1))
+        delay = (rng or random).uniform(0, ceiling)
+        if retry_after_sec is not None:
+            return max(retry_after_sec, delay)
+        return delay
+
+
+class RetryQueue:
+    """RetryJob テーブルを使った永続的な再試行キュー"""
+
+    def __init__(
+        self,
+        session: Session,
+        policy: RetryPolicy = RetryPolicy(),
+        rng: Union[random.Random, None] = None,
+    ):
+        self.session = session
+        self.policy = policy
+        self.rng = rng or random.Random()
+
+    def get(self, url: str) -> Optional[RetryJob]:
+        return self.session.exec(select(RetryJob).where(RetryJob.url == url)).first()
+
+    def _fail(
+        self, url: str, error: str, exc: Optional[BaseException], now: datetime
+    ) -> RetryJob:
+        job = self.get(url) or RetryJob(url=url, next_attempt_at=now)
+        permanent, retry_after = classify_error(exc)
+        job.attempts += 1
+        job.last_error = error
+        job.permanent = permanent
+        if permanent or job.attempts >= self.policy.max_attempts:
+            job.status = RetryStatus.dead
+        else:
+            job.status = RetryStatus.pending
+            delay = self.policy.delay_sec(job.attempts, retry_after, self.rng)
+            job.next_attempt_at = now + timedelta(seconds=delay)
+        self.session.add(job)
+        return job
+
+    def _resolve(self, url: str, now: datetime) -> None:
+        job = self.get(url)
+        if job is None or job.status == RetryStatus.resolved:
+            return
+        job.status = RetryStatus.resolved
+        job.resolved_at = now
+        self.session.add(job)
+
+    def enqueue(
+        self,
+        url: str,
+        error: str,
+        exc: Optional[BaseException] = None,
+        now: Optional[datetime] = None,
+    ) -> RetryJob:
+        """失敗を記録する. 既にある url は試行回数を増やして次の時刻を決め直す"""
+        job = self._fail(url, error, exc, now or datetime.now())
+        self.session.commit()
+        return job
+
+    def record_results(
+        self, results: Sequence[BackfillResult], now: Optional[datetime] = None
+    ) -> None:
+        """backfill の結果を反映する. 成功したページの RetryJob は resolved にする"""
+        now = now or datetime.now()
+        for result in results:
+            try:
+                url = str(
+                    QueryParamsForJma.from_location_spec(
+                        result.target.location,
+                        result.date,
+                        result.target.record_interval,
+                    ).query_url
+                )
+            except ValueError:
+                # 未来の日付などURLを作れないものはキューに入れても取れない
+                continue
+            if result.ok:
+                self._resolve(url, now)
+            else:
+                self._fail(url, result.error or "", result.exception, now)
+        self.session.commit()
+
+    def import_fetch_failed(self, now: Optional[datetime] = None) -> int:
+        """RetryJob の導入前に記録された FetchFailed をキューに入れる. 入れた数を返す.
+        既にキューにある url は入れないので, 何度呼んでも同じ行は1回しか入らない.
+        """
+        now = now or datetime.now()
+        queued = set(self.session.exec(select(RetryJob.url)))
+        added = 0
+        for failed in self.session.exec(select(FetchFailed)):
+            url = str(failed.url)
+            if url in queued:
+                continue
+            queued.add(url)
+            self.session.add(
+                RetryJob(url=url, last_error=failed.message, next_attempt_at=now)
+            )
+            added += 1
+        self.session.commit()
+        return added
+
+    def due(self, now: Optional[datetime] = None, limit: int = 1000) -> List[RetryJob]:
+        """次の時刻を過ぎた pending の RetryJob を古い順に返す"""
+        statement = (
+            select(RetryJob)
+            .where(RetryJob.status == RetryStatus.pending)
+            .where(RetryJob.next_attempt_at <= (now or datetime.now()))
+            .order_by(RetryJob.next_attempt_at)
+            .limit(limit)
+        )
+        return list(self.session.exec(statement))
+
+
+def _page_for(
+    job: RetryJob, targets: Sequence[BackfillTarget]
+) -> Optional[Tuple[date, BackfillTarget]]:
+    try:
+        q_jma = QueryParamsForJma.from_url(job.url)
+    except (KeyError, ValueError):
+        return None
+    for target in targets:
+        if (
+            target.location.prefecture_no == q_jma.prefecture_no
+            and target.location.location_no == q_jma.block_no
+            and target.record_interval == q_jma.record_interval
+        ):
+            return q_jma.date, target
+    return None
+
+
+async def drain(
+    queue: RetryQueue,
+    targets: Sequence[BackfillTarget],
+    fetcher: AsyncFetcher,
+    writer_factory: WriterFactory,
+    *,
+    concurrency: int = 4,
+    budget: Union[PolitenessBudget, None] = None,
+    time_out_sec: float = 2.0,
+    audit: Optional[AuditLog] = None,
+    cache: Optional[HtmlCache] = None,
+    parse_executor: Optional[Executor] = None,
+    now: Optional[datetime] = None,
+    limit: int = 1000,
+) -> List[BackfillResult]:
+    """期限の来た RetryJob のうち targets の観測地点, 取得間隔のものを並行に取り直す.
+    targets にないページのジョブはそのまま残す.
+    """
+    now = now or datetime.now()
+    pages: List[Tuple[date, BackfillTarget]] = []
+    for job in queue.due(now, limit):
+        page = _page_for(job, targets)
+        if page is not None and page not in pages:
+            pages.append(page)
+    logger.info("Retrying {} pages", len(pages))
+
+    results = await backfill_pages(
+        pages,
+        fetcher,
+        writer_factory,
+        concurrency=concurrency,
+        budget=budget,
+        time_out_sec=time_out_sec,
+        audit=audit,
+        cache=cache,
+        parse_executor=parse_executor,
+    )
+    queue.record_results(results, now)
+    return results
@@ -0,0 +1,282 @@
+"""最近の日のページを取り直して, 気象庁が値を直したページだけを保存し直す再検証.
+
+気象庁は直近の値を後から直す (準正常値 ")" が確定する, 遅れて訂正が入るなど).
+ページごとに前回の ETag, Last-Modified と tablefix1 部分のハッシュを PageRevision に持ち,
+
+1. 条件つきリクエストで 304 が返れば本文も受け取らない
+2. 本文が返っても tablefix1 部分のハッシュが同じならパースも保存もしない
+3. 変わったページだけを backfill_pages でパースして保存 (アップロード) する
+
+何も変わっていない夜の「直近30日の取り直し」は, リクエストとハッシュの計算だけで終わる.
+"""
+import hashlib
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from enum import StrEnum
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from loguru import logger
+from sqlmodel import Session, select
+
+from jma_scraper.core.html_to_dataframe import pluck_table_from_html
+from jma_scraper.core.metrics import METRICS
+from jma_scraper.core.repository import (
+    AsyncFetcher,
+    AuditLog,
+    ConditionalFetcher,
+    HtmlCache,
+)
+from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.infrastracture.db_tables import FetchedHtml, FetchFailed, PageRevision
+from jma_scraper.infrastracture.html_cache import html_digest
+from jma_scraper.usecase.backfill import (
+    BackfillTarget,
+    PolitenessBudget,
+    WriterFactory,
+    backfill_pages,
+    plan_pages,
+    run_jobs,
+)
+
+
+def table_digest(html_text: str) -> str:
+    """ページ全体ではなく tablefix1 部分のsha256. 表の外の広告や更新時刻の違いは無視する"""
+    return hashlib.sha256(pluck_table_from_html(html_text).encode("utf-8")).hexdigest()
+
+
+class RevisionStatus(StrEnum):
+    not_modified = "not_modified"  # 304. 本文を受け取っていない
+    unchanged = "unchanged"  # 本文は受け取ったが tablefix1 は前回と同じ
+    changed = "changed"  # 前回と違う, または初めて確かめたので保存し直した
+    failed = "failed"
+
+
+@dataclass(eq=True, frozen=True)
+class RevalidationResult:
+    target: BackfillTarget
+    date: date
+    status: RevisionStatus
+    error: Union[str, None] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status != RevisionStatus.failed
+
+
+class RevisionIndex:
+    """PageRevision テーブルを url ごとの辞書として読み込み, まとめて書き戻す"""
+
+    def __init__(self, session: Session):
+        self.session = session
+        self._revisions: Dict[str, PageRevision] = {
+            revision.url: revision for revision in session.exec(select(PageRevision))
+        }
+
+    def __len__(self) -> int:
+        return len(self._revisions)
+
+    def get(self, url: str) -> Optional[PageRevision]:
+        return self._revisions.get(url)
+
+    def checked(
+        self,
+        url: str,
+        now: datetime,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """変わっていなかったページ. 新しい検証子が返ってきていれば入れ替える"""
+        revision = self._revisions[url]
+        revision.checked_at = now
+        revision.etag = etag or revision.etag
+        revision.last_modified = last_modified or revision.last_modified
+        self.session.add(revision)
+
+    def changed(
+        self,
+        url: str,
+        digest: str,
+        now: datetime,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """保存し直したページ"""
+        revision = self._revisions.get(url) or PageRevision(
+            url=url, table_digest=digest
+        )
+        revision.table_digest = digest
+        revision.etag = etag
+        revision.last_modified = last_modified
+        revision.checked_at = revision.changed_at = now
+        self._revisions[url] = revision
+        self.session.add(revision)
+
+    def commit(self) -> None:
+        self.session.commit()
+
+
+@dataclass(frozen=True)
+class _Changed:
+    date: date
+    target: BackfillTarget
+    url: str
+    html_text: str
+    digest: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class _Prefetched:
+    """確認のときに受け取った本文を backfill_pages に渡す HtmlCache. 渡したら手放す"""
+
+    def __init__(self, pages: Dict[str, str]):
+        self.pages = pages
+
+    def get(self, key: str) -> Optional[str]:
+        return self.pages.pop(key, None)
+
+    def put(self, key: str, html_text: str) -> str:
+        return html_digest(html_text)
+
+
+def _query(target: BackfillTarget, date_: date) -> QueryParamsForJma:
+    return QueryParamsForJma.from_location_spec(
+        target.location, date_, target.record_interval
+    )
+
+
+def _page_url(target: BackfillTarget, date_: date) -> str:
+    return str(_query(target, date_).query_url)
+
+
+def plan_revalidation(
+    targets: Sequence[BackfillTarget], days: int, today: Optional[date] = None
+) -> List[Tuple[date, BackfillTarget]]:
+    """today までの days 日を含むページを新しい順に並べる"""
+    if days < 1:
+        raise ValueError(f"days should be 1 or more, got {days}")
+    today = today if today is not None else date.today()
+    return plan_pages(targets, today - timedelta(days=days - 1), today)
+
+
+async def revalidate(
+    targets: Sequence[BackfillTarget],
+    fetcher: AsyncFetcher,
+    writer_factory: WriterFactory,
+    revisions: RevisionIndex,
+    *,
+    days: int = 30,
+    today: Optional[date] = None,
+    concurrency: int = 4,
+    budget: Union[PolitenessBudget, None] = None,
+    time_out_sec: float = 2.0,
+    audit: Optional[AuditLog] = None,
+    cache: Optional[HtmlCache] = None,
+    parse_executor: Optional[Executor] = None,
+    now: Optional[datetime] = None,
+) -> List[RevalidationResult]:
+    """today までの days 日分のページを取り直し, 変わったページだけをパースして保存する.
+    fetcher が ConditionalFetcher なら前回の検証子を送る. それ以外の引数は backfill と同じ.
+    cache は読まずに, 変わったページの新しい本文を書き込むだけ.
+    保存に失敗したページは PageRevision を更新しないので, 次回も変わったページとして扱う.
+    """
+    if concurrency < 1:
+        raise ValueError(f"concurrency should be 1 or more, got {concurrency}")
+    now = now or datetime.now()
+    pacer = budget if budget is not None else PolitenessBudget()
+    pages = plan_revalidation(targets, days, today)
+    results: List[RevalidationResult] = []
+    changed: Dict[str, _Changed] = {}  # url ごと. BackfillTarget はハッシュできない
+
+    async def check(
+        date_: date, target: BackfillTarget, q_jma: QueryParamsForJma
+    ) -> None:
+        url = str(q_jma.query_url)
+        previous = revisions.get(url)
+        with METRICS.timer("politeness_wait"):
+            await pacer.wait()
+        if isinstance(fetcher, ConditionalFetcher):
+            # 初回は検証子を送らないが, 返ってきた ETag などは次回のために残す
+            page = await fetcher.fetch_if_modified(
+                q_jma,
+                previous.etag if previous else None,
+                previous.last_modified if previous else None,
+                time_out_sec,
+            )
+            if page.html_text is None:
+                METRICS.inc("revalidate_not_modified")
+                revisions.checked(url, now, page.etag, page.last_modified)
+                results.append(
+                    RevalidationResult(target, date_, RevisionStatus.not_modified)
+                )
+                return
+            html_text, etag, last_modified = (
+                page.html_text,
+                page.etag,
+                page.last_modified,
+            )
+        else:
+            html_text = await fetcher(q_jma, time_out_sec=time_out_sec)
+            etag = last_modified = None
+        if audit is not None:
+            audit.record(
+                FetchedHtml(url=q_jma.query_url, digest=html_digest(html_text))
+            )
+
+        digest = table_digest(html_text)
+        if previous is not None and previous.table_digest == digest:
+            METRICS.inc("revalidate_unchanged")
+            revisions.checked(url, now, etag, last_modified)
+            results.append(RevalidationResult(target, date_, RevisionStatus.unchanged))
+            return
+        METRICS.inc("revalidate_changed")
+        if cache is not None:
+            cache.put(url, html_text)
+        changed[url] = _Changed(
+            date_, target, url, html_text, digest, etag, last_modified
+        )
+
+    async def check_or_fail(job: Tuple[date, BackfillTarget]) -> None:
+        date_, target = job
+        q_jma: Optional[QueryParamsForJma] = None
+        try:
+            q_jma = _query(target, date_)
+            await check(date_, target, q_jma)
+        except Exception as e:
+            logger.error("{} {} failed: {}", target.location.en_name, date_, e)
+            if audit is not None and q_jma is not None:
+                audit.record(FetchFailed(url=q_jma.query_url, message=str(e)))
+            results.append(
+                RevalidationResult(target, date_, RevisionStatus.failed, str(e))
+            )
+
+    await run_jobs(pages, check_or_fail, concurrency)
+
+    if changed:
+        logger.info("{} of {} pages changed", len(changed), len(pages))
+        written = await backfill_pages(
+            [(page.date, page.target) for page in changed.values()],
+            fetcher,
+            writer_factory,
+            concurrency=concurrency,
+            # 本文は取得済みなので気象庁には問い合わせない
+            budget=PolitenessBudget(0.0),
+            time_out_sec=time_out_sec,
+            cache=_Prefetched({page.url: page.html_text for page in changed.values()}),
+            parse_executor=parse_executor,
+        )
+        for result in written:
+            page = changed[_page_url(result.target, result.date)]
+            if result.ok:
+                revisions.changed(
+                    page.url, page.digest, now, page.etag, page.last_modified
+                )
+                status = RevisionStatus.changed
+            else:
+                status = RevisionStatus.failed
+            results.append(
+                RevalidationResult(result.target, result.date, status, result.error)
+            )
+    revisions.commit()
+    return results
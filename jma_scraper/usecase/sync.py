@@ -0,0 +1,260 @@
+"""保存済みのページとの差分だけを取得する同期処理.
+
+観測地点, 取得間隔ごとに「保存済みの日」をビットマップで持つ CoverageIndex を作り,
+指定した期間のページのうち未保存 (取得失敗を含む) のものだけを backfill_pages に渡す.
+"""
+from collections import defaultdict
+from concurrent.futures import Executor
+from datetime import date
+from pathlib import Path
+from typing import DefaultDict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pyarrow.parquet as pq
+from sqlmodel import Session, select
+
+from jma_scraper.core.location_spec import RecordInterval
+from jma_scraper.core.repository import (
+    AsyncFetcher,
+    AuditLog,
+    HtmlCache,
+    WriterSrcValues,
+)
+from jma_scraper.infrastracture.db_tables import LocalFileSaved
+from jma_scraper.infrastracture.parquet import (
+    PARTITION_FILE,
+    complete_pages,
+    sort_keys,
+)
+from jma_scraper.usecase.backfill import (
+    BackfillResult,
+    BackfillTarget,
+    PolitenessBudget,
+    WriterFactory,
+    backfill_pages,
+    plan_pages,
+)
+
+# 気象庁の最も古い記録より前の日. ビットマップの0番目の日
+EPOCH = date(1872, 1, 1)
+
+CoverageKey = Tuple[str, str]  # (location_name, every_xx)
+
+
+def _offset(date_: date) -> int:
+    return date_.toordinal() - EPOCH.toordinal()
+
+
+def is_partial_page(page_date: date, every_xx: str, saved_on: date) -> bool:
+    """saved_on に保存したページがまだ値の揃っていない (saved_on を含む) ページか.
+    >>> is_partial_page(date(2022, 12, 1), "every_1_days", date(2022, 12, 15))
+    True
+    >>> is_partial_page(date(2022, 12, 1), "every_1_days", date(2023, 1, 2))
+    False
+    """
+    return page_date == RecordInterval.from_literal(every_xx).page_date(saved_on)
+
+
+class CoverageIndex:
+    """(観測地点, 取得間隔) ごとに, EPOCH からの日数を添字にした保存済みフラグの配列.
+    日ごと以上の取得間隔ではページの日付 (月初, 年初) に印を付ける.
+    保存した日を含むページは途中までの値なので印を付けない.
+    20年分でも1系列7KB程度なので, 全部メモリに載せて numpy でまとめて引く.
+
+    >>> index = CoverageIndex()
+    >>> index.mark("hamamatsu", "every_10_minutes", date(2022, 1, 2))
+    >>> index.missing("hamamatsu", "every_10_minutes", [date(2022, 1, 1), date(2022, 1, 2)])
+    [datetime.date(2022, 1, 1)]
+    """
+
+    def __init__(self) -> None:
+        self._bitmaps: DefaultDict[CoverageKey, np.ndarray] = defaultdict(
+            lambda: np.zeros(0, dtype=bool)
+        )
+
+    def __len__(self) -> int:
+        return sum(int(bitmap.sum()) for bitmap in self._bitmaps.values())
+
+    def _bitmap_for(self, key: CoverageKey, size: int) -> np.ndarray:
+        bitmap = self._bitmaps[key]
+        if bitmap.size < size:
+            # 伸ばすたびにコピーしないよう1年分ずつ余分に確保する
+            grown = np.zeros(size + 366, dtype=bool)
+            grown[: bitmap.size] = bitmap
+            self._bitmaps[key] = bitmap = grown
+        return bitmap
+
+    def mark(self, location_name: str, every_xx: str, date_: date) -> None:
+        self.mark_many(location_name, every_xx, [date_])
+
+    def mark_many(
+        self, location_name: str, every_xx: str, dates: Iterable[date]
+    ) -> None:
+        offsets = np.fromiter((_offset(d) for d in dates), dtype=np.int64)
+        if offsets.size == 0:
+            return
+        if offsets.min() < 0:
+            raise ValueError(f"Dates before {EPOCH} can not be recorded")
+        bitmap = self._bitmap_for((location_name, every_xx), int(offsets.max()) + 1)
+        bitmap[offsets] = True
+
+    def mark_src_values(
+        self, src_values: WriterSrcValues, saved_on: Optional[date] = None
+    ) -> None:
+        """saved_on (保存した日) を含むページには印を付けない"""
+        if saved_on is not None and is_partial_page(
+            src_values.date, src_values.every_xx, saved_on
+        ):
+            return
+        self.mark(src_values.location_name, src_values.every_xx, src_values.date)
+
+    def covered(self, location_name: str, every_xx: str, date_: date) -> bool:
+        bitmap = self._bitmaps.get((location_name, every_xx))
+        offset = _offset(date_)
+        return bitmap is not None and 0 <= offset < bitmap.size and bool(bitmap[offset])
+
+    def missing(
+        self, location_name: str, every_xx: str, dates: Sequence[date]
+    ) -> List[date]:
+        """dates のうち保存されていない日を, 渡した順のまま返す"""
+        bitmap = self._bitmaps.get((location_name, every_xx))
+        if bitmap is None:
+            return list(dates)
+        offsets = np.fromiter((_offset(d) for d in dates), dtype=np.int64)
+        in_range = (offsets >= 0) & (offsets < bitmap.size)
+        covered = np.zeros(offsets.size, dtype=bool)
+        covered[in_range] = bitmap[offsets[in_range]]
+        return [
+            d for d, is_covered in zip(dates, covered, strict=True) if not is_covered
+        ]
+
+    @staticmethod
+    def parse_file_name(file_path: Union[str, Path]) -> Optional[WriterSrcValues]:
+        """WriterSrcValues.format() で作ったファイル名から保存した日などを戻す.
+        >>> CoverageIndex.parse_file_name("/tmp/2022-01-01__hamamatsu__every_10_minutes.csv")
+        WriterSrcValues(date=datetime.date(2022, 1, 1), location_name='hamamatsu', every_xx='every_10_minutes')
+        >>> CoverageIndex.parse_file_name("memo.txt") is None
+        True
+        """
+        parts = Path(file_path).stem.split("__")
+        if len(parts) != 3:
+            return None
+        try:
+            return WriterSrcValues(
+                date=date.fromisoformat(parts[0]),
+                location_name=parts[1],
+                every_xx=parts[2],
+            )
+        except ValueError:
+            return None
+
+    def add_files(
+        self, file_paths: Iterable[Union[str, Path, Tuple[Union[str, Path], date]]]
+    ) -> "CoverageIndex":
+        """ファイル名, または (ファイル名, 保存した日) から保存済みのページを記録する"""
+        for item in file_paths:
+            file_path, saved_on = item if isinstance(item, tuple) else (item, None)
+            src_values = self.parse_file_name(file_path)
+            if src_values is not None:
+                self.mark_src_values(src_values, saved_on)
+        return self
+
+    def add_csv_dir(self, csv_dir: Path) -> "CoverageIndex":
+        """DfLocalCsvWriter の保存先. ファイル名と更新日時だけを見るので中身は読まない"""
+        return self.add_files(
+            (path, date.fromtimestamp(path.stat().st_mtime))
+            for path in csv_dir.glob("*.csv")
+        )
+
+    def add_local_file_saved(self, session: Session) -> "CoverageIndex":
+        """LocalFileSaved の記録. 記録後に消されたファイルも保存済みとみなす"""
+        rows = session.exec(
+            select(LocalFileSaved.file_path, LocalFileSaved.recorded_at)
+        )
+        return self.add_files(
+            (file_path, recorded_at.date()) for file_path, recorded_at in rows
+        )
+
+    def add_parquet_dataset(self, root: Path) -> "CoverageIndex":
+        """DfLocalParquetWriter の保存先. 各パーティションの日付と行ラベルの列だけを読み,
+        最後の行まであるページを記録する (complete_pages).
+        """
+        for path in root.glob(f"station=*/interval=*/year=*/{PARTITION_FILE}"):
+            location_name = path.parents[2].name.split("=", 1)[1]
+            every_xx = path.parents[1].name.split("=", 1)[1]
+            record_interval = RecordInterval.from_literal(every_xx)
+            table = pq.read_table(path, columns=sort_keys(record_interval))
+            self.mark_many(
+                location_name, every_xx, complete_pages(table, record_interval)
+            )
+        return self
+
+
+def plan_sync(
+    targets: Sequence[BackfillTarget],
+    start_date: date,
+    end_date: date,
+    coverage: CoverageIndex,
+    today: Optional[date] = None,
+) -> List[Tuple[date, BackfillTarget]]:
+    """期間内のページのうち, 未保存のものと today を含むページを新しい順に返す.
+    today を含むページはまだ値が揃っていないので保存済みでも取り直す.
+    """
+    today = today if today is not None else date.today()
+    planned = []
+    for page_date, target in plan_pages(targets, start_date, end_date):
+        every_xx = target.record_interval.to_literal()
+        is_current = page_date == target.record_interval.page_date(today)
+        if is_current or not coverage.covered(
+            target.location.en_name, every_xx, page_date
+        ):
+            planned.append((page_date, target))
+    return planned
+
+
+async def sync(
+    targets: Sequence[BackfillTarget],
+    start_date: date,
+    end_date: date,
+    fetcher: AsyncFetcher,
+    writer_factory: WriterFactory,
+    coverage: CoverageIndex,
+    *,
+    concurrency: int = 4,
+    budget: Union[PolitenessBudget, None] = None,
+    time_out_sec: float = 2.0,
+    audit: Optional[AuditLog] = None,
+    cache: Optional[HtmlCache] = None,
+    parse_executor: Optional[Executor] = None,
+    parse_concurrency: Optional[int] = None,
+    today: Optional[date] = None,
+) -> List[BackfillResult]:
+    """backfill の差分版. coverage にないページだけを取得し, 保存できたページを coverage に記録する.
+    today を含むページは途中までの値なので記録せず, 次の同期で取り直す.
+    引数は backfill と同じ.
+    """
+    pages = plan_sync(targets, start_date, end_date, coverage, today)
+    results = await backfill_pages(
+        pages,
+        fetcher,
+        writer_factory,
+        concurrency=concurrency,
+        budget=budget,
+        time_out_sec=time_out_sec,
+        audit=audit,
+        cache=cache,
+        parse_executor=parse_executor,
+        parse_concurrency=parse_concurrency,
+    )
+    today = today if today is not None else date.today()
+    for result in results:
+        if result.ok:
+            coverage.mark_src_values(
+                WriterSrcValues(
+                    date=result.date,
+                    location_name=result.target.location.en_name,
+                    every_xx=result.target.record_interval.to_literal(),
+                ),
+                saved_on=today,
+            )
+    return results
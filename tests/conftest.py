@@ -3,11 +3,18 @@ from pathlib import Path
 
 import pandas as pd
 from _pytest.fixtures import fixture
-
-from jma_scraper.core.html_to_dataframe import pluck_table_from_html, read_html_table
-from jma_scraper.core.location_instances import HAMAMATSU
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
+from jma_scraper.core.html_to_dataframe import (
+    parse_html_to_df,
+    pluck_table_from_html,
+    read_html_table,
+)
+from jma_scraper.core.location_instances import HAMAMATSU, HAMAMATSU_10Minutes_COLUMNS
 from jma_scraper.core.location_spec import RecordInterval
 from jma_scraper.core.url_formatter import QueryParamsForJma
+from tests.helpers import ListWriter
 
 this_dir = Path(__file__).parent
 
@@ -24,6 +31,29 @@ def raw_multi_column_df(hamamatsu_html) -> pd.DataFrame:
     return read_html_table(html_table_txt, pd.read_html)
 
 
+@fixture
+def formatted_df(hamamatsu_html) -> pd.DataFrame:
+    return parse_html_to_df(hamamatsu_html, HAMAMATSU_10Minutes_COLUMNS.after_columns)
+
+
+@fixture(autouse=True)
+def clear_written():
+    ListWriter.written = []
+
+
+@fixture(name="session")
+def in_memory_session():
+    engine = create_engine(
+        "sqlite://",  # in memory database
+        echo=True,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
 @fixture
 def hamamatsu_qp_every_10_minuets():
     return QueryParamsForJma.from_location_spec(
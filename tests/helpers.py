@@ -0,0 +1,91 @@
+"""複数のテストファイルで使うテスト用の部品"""
+import asyncio
+from datetime import date
+from typing import Any, List
+
+import pandas as pd
+
+from jma_scraper.core.location_instances import (
+    HAMAMATSU,
+    SHIZUOKA,
+    HAMAMATSU_10Minutes_COLUMNS,
+    SHIZUOKA_10Minutes_COLUMNS,
+)
+from jma_scraper.core.location_spec import TYPE_EVERY_XX
+from jma_scraper.core.repository import Writer, WriterSrcValues
+from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.usecase.backfill import BackfillTarget
+
+TARGETS = [
+    BackfillTarget(location=HAMAMATSU, columns=HAMAMATSU_10Minutes_COLUMNS),
+    BackfillTarget(location=SHIZUOKA, columns=SHIZUOKA_10Minutes_COLUMNS),
+]
+
+
+class FakeFetcher:
+    def __init__(self, html: str, fail_dates=()):
+        self.html = html
+        self.fail_dates = set(fail_dates)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fetched: List[QueryParamsForJma] = []
+
+    async def __call__(self, query_param: QueryParamsForJma, time_out_sec=2.0) -> str:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        self.fetched.append(query_param)
+        if query_param.date in self.fail_dates:
+            raise ValueError("fetch failed")
+        return self.html
+
+
+class ListWriter(Writer):
+    written: List[Any] = []
+
+    def __init__(self, src_values: WriterSrcValues):
+        super().__init__(src_values)
+        self.src_values = src_values
+
+    def write(self, src: pd.DataFrame, dst: Any = None) -> None:
+        self.written.append((self.src_values, src))
+
+
+def src(
+    date_: date,
+    location_name: str = "hamamatsu",
+    every_xx: TYPE_EVERY_XX = "every_10_minutes",
+) -> WriterSrcValues:
+    """1ページ分の WriterSrcValues. 省略した場合は10分ごとの値の1日分"""
+    return WriterSrcValues(date=date_, location_name=location_name, every_xx=every_xx)
+
+
+def table_html(header_cells: int, rows) -> str:
+    header = "<tr>" + "<th>h</th>" * header_cells + "</tr>"
+    body = "".join("<tr>" + "".join(rows_) + "</tr>" for rows_ in rows)
+    return f'<html><body><table id="tablefix1">{header}{body}</table></body></html>'
+
+
+def td(value: str) -> str:
+    return f'<td class="data_0_0">{value}</td>'
+
+
+def hourly_row(hour: int):
+    cells = ["1013.0", "1019.0", "--", "5.1)", "-2.0", "5.3", "45", "3.2", "北西"]
+    cells += ["1.0", "0.52", "--", "0", '<img alt="晴れ" src="x.gif"/>', "2", "20.0"]
+    return [td(str(hour))] + [td(c) for c in cells]
+
+
+def daily_row(day: int):
+    cells = ["1015.0", "1021.0", "0.5", "0.5", "0.5", "6.0", "11.0", "1.0", "55", "30"]
+    cells += ["3.0", "7.0", "西", "12.0", "西北西", "西", "8.0", "--", "--"]
+    cells += ["晴", "晴一時曇"]
+    return [td(str(day))] + [td(c) for c in cells]
+
+
+def period_values(layout):
+    return [
+        td("北" if col in layout.direction_columns else "1.0")
+        for col in layout.value_columns
+    ]
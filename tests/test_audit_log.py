@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlmodel import Session, select
+
+from jma_scraper.core.repository import AuditLog
+from jma_scraper.infrastracture.audit_log import AuditLogWriter
+from jma_scraper.infrastracture.db_tables import FetchedHtml, FetchFailed
+from jma_scraper.infrastracture.sqlite_starter import (
+    create_db_and_tables,
+    create_engine_all,
+    create_sql_url,
+)
+
+URL = "https://www.data.jma.go.jp/obd/stats/etrn/view/10min_s1.php?prec_no=50&block_no=47654&year=2021&month=1&day=1"
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine_all(create_sql_url(str(tmp_path / "audit.db")))
+    create_db_and_tables(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_engine_uses_wal(engine):
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+
+
+def test_audit_tables_have_indexes(engine):
+    indexed = {
+        tuple(index["column_names"])
+        for index in inspect(engine).get_indexes(FetchFailed.__tablename__)
+    }
+    assert {("url",), ("recorded_at",)} <= indexed
+
+
+def test_indexes_are_added_to_existing_tables(engine):
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_fetchedhtml_url"))
+    create_db_and_tables(engine)
+    names = {i["name"] for i in inspect(engine).get_indexes(FetchedHtml.__tablename__)}
+    assert "ix_fetchedhtml_url" in names
+
+
+def test_writer_batches_rows_from_many_threads(engine):
+    with AuditLogWriter(engine, batch_size=50, flush_interval_sec=0.05) as audit:
+        assert isinstance(audit, AuditLog)
+
+        def record_many(n: int) -> None:
+            for i in range(100):
+                audit.record(FetchedHtml(url=URL, digest=f"{n}-{i}"))
+
+        threads = [threading.Thread(target=record_many, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        audit.flush()
+
+        with Session(engine) as session:
+            assert len(session.exec(select(FetchedHtml)).all()) == 400
+
+    with pytest.raises(RuntimeError):
+        audit.record(FetchedHtml(url=URL))
+
+
+def test_failed_batch_does_not_stop_writer(engine):
+    with AuditLogWriter(engine, batch_size=1) as audit:
+        broken = FetchFailed(url=URL, message="x")
+        broken.message = None  # NOT NULL 制約違反
+        audit.record(broken)
+        audit.record(FetchFailed(url=URL, message="timeout"))
+
+    with Session(engine) as session:
+        assert [f.message for f in session.exec(select(FetchFailed))] == ["timeout"]
+
+
+def test_one_bad_row_does_not_drop_its_batch(engine):
+    with AuditLogWriter(engine, batch_size=10, flush_interval_sec=1.0) as audit:
+        audit.record(FetchFailed(url=URL, message="first"))
+        broken = FetchFailed(url=URL, message="x")
+        broken.message = None  # NOT NULL 制約違反
+        audit.record(broken)
+        audit.record(FetchFailed(url=URL, message="last"))
+        audit.flush()
+
+        with Session(engine) as session:
+            messages = [f.message for f in session.exec(select(FetchFailed))]
+    assert sorted(messages) == ["first", "last"]
@@ -0,0 +1,244 @@
+import asyncio
+import time
+from datetime import date
+from typing import List
+
+import pytest
+
+from jma_scraper import app
+from jma_scraper.core.location_instances import HAMAMATSU_10Minutes_COLUMNS
+from jma_scraper.core.repository import (
+    AsyncFetcher,
+    BatchWriter,
+    Writer,
+    WriterSrcValues,
+)
+from jma_scraper.infrastracture.html_cache import PackedHtmlCache
+from jma_scraper.usecase.backfill import (
+    PolitenessBudget,
+    backfill,
+    backfill_pages,
+    date_range,
+    parse_process_pool,
+    plan_pages,
+)
+from tests.helpers import TARGETS, FakeFetcher, ListWriter
+
+
+def test_fake_fetcher_is_async_fetcher(hamamatsu_html):
+    assert isinstance(FakeFetcher(hamamatsu_html), AsyncFetcher)
+
+
+def test_date_range_is_inclusive():
+    assert list(date_range(date(2022, 1, 1), date(2022, 1, 1))) == [date(2022, 1, 1)]
+    with pytest.raises(ValueError):
+        list(date_range(date(2022, 1, 2), date(2022, 1, 1)))
+
+
+def test_app_accepts_a_single_day(monkeypatch, session):
+    calls = []
+
+    async def fake_backfill(start_date, end_date, *args):
+        calls.append((start_date, end_date))
+        return []
+
+    monkeypatch.setattr(app, "_backfill_hamamatsu_10minutes", fake_backfill)
+    day = date(2022, 1, 1)
+    app.hamamatsu_10minutes_save_as_csv(day, day, session=session)
+    assert calls == [(day, day)]
+    with pytest.raises(ValueError):
+        app.hamamatsu_10minutes_save_as_csv(date(2022, 1, 2), day, session=session)
+
+
+def test_backfill_fans_out_station_and_dates(hamamatsu_html):
+    fetcher = FakeFetcher(hamamatsu_html)
+    results = asyncio.run(
+        backfill(
+            TARGETS,
+            date(2022, 1, 1),
+            date(2022, 1, 5),
+            fetcher=fetcher,
+            writer_factory=ListWriter,
+            concurrency=3,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    assert len(results) == 10
+    assert all(r.ok for r in results)
+    assert 1 < fetcher.max_in_flight <= 3
+
+    written = {(v.location_name, v.date) for v, _ in ListWriter.written}
+    assert ("shizuoka", date(2022, 1, 3)) in written
+    assert len(written) == 10
+    _, df = ListWriter.written[0]
+    assert list(df.columns) == HAMAMATSU_10Minutes_COLUMNS.after_columns
+
+
+def test_backfill_records_failures_and_continues(hamamatsu_html):
+    fetcher = FakeFetcher(hamamatsu_html, fail_dates=[date(2022, 1, 2)])
+    results = asyncio.run(
+        backfill(
+            TARGETS[:1],
+            date(2022, 1, 1),
+            date(2022, 1, 3),
+            fetcher=fetcher,
+            writer_factory=ListWriter,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    failed = [r for r in results if not r.ok]
+    assert [r.date for r in failed] == [date(2022, 1, 2)]
+    assert failed[0].error == "fetch failed"
+    assert len(ListWriter.written) == 2
+
+
+def test_politeness_budget_spaces_requests(hamamatsu_html):
+    fetcher = FakeFetcher(hamamatsu_html)
+
+    async def timed() -> float:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await backfill(
+            TARGETS[:1],
+            date(2022, 1, 1),
+            date(2022, 1, 4),
+            fetcher=fetcher,
+            writer_factory=ListWriter,
+            concurrency=4,
+            budget=PolitenessBudget(0.05),
+        )
+        return loop.time() - started
+
+    # 4リクエストの開始間隔が 0.05秒 以上あく
+    assert asyncio.run(timed()) >= 0.15
+
+
+def test_backfill_uses_cache_before_network(tmp_path, hamamatsu_html):
+    cache = PackedHtmlCache(tmp_path)
+    fetcher = FakeFetcher(hamamatsu_html)
+    kwargs = {
+        "fetcher": fetcher,
+        "writer_factory": ListWriter,
+        "budget": PolitenessBudget(0.0),
+        "cache": cache,
+    }
+    asyncio.run(backfill(TARGETS[:1], date(2022, 1, 1), date(2022, 1, 2), **kwargs))
+    assert len(fetcher.fetched) == 2
+
+    results = asyncio.run(
+        backfill(TARGETS[:1], date(2022, 1, 1), date(2022, 1, 3), **kwargs)
+    )
+    assert all(r.ok for r in results)
+    assert [qp.date for qp in fetcher.fetched[2:]] == [date(2022, 1, 3)]
+    assert len(ListWriter.written) == 5
+
+
+def test_backfill_parses_in_a_process_pool(hamamatsu_html):
+    fetcher = FakeFetcher(hamamatsu_html)
+    with parse_process_pool(max_workers=2) as parse_executor:
+        results = asyncio.run(
+            backfill(
+                TARGETS,
+                date(2022, 1, 1),
+                date(2022, 1, 3),
+                fetcher=fetcher,
+                writer_factory=ListWriter,
+                budget=PolitenessBudget(0.0),
+                parse_executor=parse_executor,
+                parse_concurrency=2,
+            )
+        )
+    assert len(results) == 6
+    assert all(r.ok for r in results)
+    _, df = ListWriter.written[0]
+    assert list(df.columns) == HAMAMATSU_10Minutes_COLUMNS.after_columns
+
+
+def test_parse_failures_are_recorded(hamamatsu_html):
+    class BrokenPageFetcher(FakeFetcher):
+        async def __call__(self, query_param, time_out_sec=2.0):
+            html = await super().__call__(query_param, time_out_sec)
+            return "<html></html>" if query_param.date.day == 2 else html
+
+    results = asyncio.run(
+        backfill(
+            TARGETS[:1],
+            date(2022, 1, 1),
+            date(2022, 1, 3),
+            fetcher=BrokenPageFetcher(hamamatsu_html),
+            writer_factory=ListWriter,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    failed = [r for r in results if not r.ok]
+    assert [r.date for r in failed] == [date(2022, 1, 2)]
+    assert "tablefix1" in failed[0].error
+    assert len(ListWriter.written) == 2
+
+
+def test_slow_writer_holds_back_fetching(hamamatsu_html):
+    fetcher = FakeFetcher(hamamatsu_html)
+    outstanding = []
+
+    class SlowWriter(ListWriter):
+        def write(self, src, dst=None):
+            outstanding.append(len(fetcher.fetched) - len(self.written))
+            time.sleep(0.01)
+            super().write(src, dst)
+
+    results = asyncio.run(
+        backfill_pages(
+            plan_pages(TARGETS[:1], date(2022, 1, 1), date(2022, 1, 20)),
+            fetcher,
+            SlowWriter,
+            concurrency=1,
+            budget=PolitenessBudget(0.0),
+            parse_concurrency=1,
+            queue_size=1,
+        )
+    )
+    assert len(results) == 20
+    assert all(r.ok for r in results)
+    # 取得済みで未保存のページは各段階のワーカーとキューの分だけ
+    assert max(outstanding) <= 5
+
+
+class ListBatchWriter:
+    def __init__(self, batch_pages: int, fail: bool = False):
+        self.batch_pages = batch_pages
+        self.fail = fail
+        self.batches: List[List[date]] = []
+
+    def __call__(self, src_values: WriterSrcValues) -> Writer:
+        return ListWriter(src_values)
+
+    def write_many(self, frames) -> None:
+        if self.fail:
+            raise OSError("disk full")
+        self.batches.append([src_values.date for src_values, _ in frames])
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_batch_writer_gets_pages_in_batches(hamamatsu_html, fail):
+    writer = ListBatchWriter(batch_pages=2, fail=fail)
+    results = asyncio.run(
+        backfill(
+            TARGETS[:1],
+            date(2022, 1, 1),
+            date(2022, 1, 5),
+            fetcher=FakeFetcher(hamamatsu_html),
+            writer_factory=writer,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    assert isinstance(writer, BatchWriter)
+    assert len(results) == 5
+    assert ListWriter.written == []
+    if fail:
+        assert {r.error for r in results} == {"disk full"}
+    else:
+        assert all(r.ok for r in results)
+        assert [len(batch) for batch in writer.batches] == [2, 2, 1]
+        assert sorted(d for batch in writer.batches for d in batch) == [
+            date(2022, 1, d) for d in range(1, 6)
+        ]
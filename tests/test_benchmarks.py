@@ -0,0 +1,54 @@
+from datetime import date
+
+from benchmarks.corpus import fixture_html, synthetic_corpus, synthetic_page
+from benchmarks.pipeline import STAGES, compare, run_benchmarks
+from jma_scraper.core.html_to_dataframe import parse_html_to_df
+from jma_scraper.core.location_instances import HAMAMATSU_10Minutes_COLUMNS
+
+
+def test_synthetic_pages_are_parseable_and_differ_by_date():
+    template = fixture_html()
+    page_1 = synthetic_page(template, date(2020, 1, 1))
+    assert page_1 == synthetic_page(template, date(2020, 1, 1))
+    assert "浜松　2020年1月1日" in page_1
+
+    df_1 = parse_html_to_df(page_1, HAMAMATSU_10Minutes_COLUMNS.after_columns)
+    df_2 = parse_html_to_df(
+        synthetic_page(template, date(2020, 1, 2)),
+        HAMAMATSU_10Minutes_COLUMNS.after_columns,
+    )
+    assert len(df_1) == 144
+    assert not df_1.equals(df_2)
+
+
+def test_synthetic_corpus_is_lazy():
+    corpus = synthetic_corpus(date(2000, 1, 1), days=365 * 20)
+    assert next(corpus)[0] == date(2000, 1, 1)
+    assert next(corpus)[0] == date(2000, 1, 2)
+
+
+def test_run_benchmarks_reports_every_stage():
+    results = run_benchmarks(days=2, repeat=1)
+    assert list(results["stages"]) == [stage.name for stage in STAGES]
+    for stage in results["stages"].values():
+        assert stage["items"] == 2
+        assert stage["per_sec"] > 0
+        assert stage["peak_bytes"] >= 0
+    assert compare(results, results) == []
+
+
+def test_compare_flags_memory_growth_and_missing_stages():
+    base = {
+        "stages": {
+            "pluck": {"per_sec": 100.0, "peak_bytes": 1000},
+            "write": {"per_sec": 10.0, "peak_bytes": 1000},
+        }
+    }
+    current = {"stages": {"pluck": {"per_sec": 100.0, "peak_bytes": 2000}}}
+    assert compare(base, current) == [
+        "pluck: peak memory 2000 bytes is 100% above the baseline 1000 bytes",
+        "write: missing in the current results",
+    ]
+    assert compare(base, current, max_memory_growth=1.5)[:1] == [
+        "write: missing in the current results"
+    ]
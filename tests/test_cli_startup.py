@@ -0,0 +1,86 @@
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+from typing import Dict
+
+from jma_scraper.core.repository import WriterSrcValues
+from jma_scraper.infrastracture.localfile import DfLocalCsvWriter
+
+PROJECT_ROOT = Path(__file__).parents[1]
+
+# python -X importtime main.py --help で計測した command_line の累積 (マイクロ秒) は 12ms 前後.
+# 重いモジュールを読み込むようになると数百ms になるので, 余裕を見てこの値で止める
+STARTUP_BUDGET_US = 150_000
+
+HEAVY_MODULES = {
+    "pandas",
+    "numpy",
+    "httpx",
+    "bs4",
+    "lxml",
+    "pydantic",
+    "sqlalchemy",
+    "sqlmodel",
+    "boto3",
+    "pyarrow",
+}
+
+
+def import_times(*args: str) -> Dict[str, int]:
+    """python -X importtime の出力を {モジュール名: 累積マイクロ秒} にする"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_help_does_not_import_heavy_modules():
+    times = import_times("main.py", "--help")
+    top_level = {name.split(".")[0] for name in times}
+    assert top_level.isdisjoint(HEAVY_MODULES), top_level & HEAVY_MODULES
+    assert times["jma_scraper.input_inferfaces.command_line"] < STARTUP_BUDGET_US
+
+
+def test_import_has_no_filesystem_or_db_side_effects():
+    code = textwrap.dedent(
+        """
+        import pathlib
+        import sqlite3
+        import sys
+
+        calls = []
+        pathlib.Path.mkdir = lambda self, *args, **kwargs: calls.append(str(self))
+        sqlite3.connect = lambda *args, **kwargs: calls.append("sqlite3.connect")
+        stdout = sys.stdout
+
+        import jma_scraper.app
+        import jma_scraper.infrastracture.localfile
+        import jma_scraper.infrastracture.sqlite_starter
+        import jma_scraper.usecase.hamamatsu.write_scenario_local
+        import jma_scraper.usecase.hamamatsu.write_scenario_r2
+
+        assert calls == [], calls
+        assert sys.stdout is stdout
+        """
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, check=True)
+
+
+def test_csv_writer_creates_the_directory_on_first_write(tmp_path, raw_df):
+    src_values = WriterSrcValues(
+        date="2022-01-01", location_name="hamamatsu", every_xx="every_10_minutes"
+    )
+    dst = tmp_path / "not" / "yet" / "there.csv"
+    DfLocalCsvWriter(src_values).write(raw_df, dst)
+    assert dst.exists()
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from jma_scraper.core.location_instances import HAMAMATSU, IWATA
+from jma_scraper.core.location_spec import (
+    LocationColumnType,
+    MainColumnsDailyFormatted,
+    MainColumnsHourlyFormatted,
+    RecordInterval,
+)
+from jma_scraper.core.table_decoder import QualityFlag, decode_table, layout_for
+from jma_scraper.input_inferfaces.command_line import to_csv
+from jma_scraper.usecase.backfill import BackfillTarget, PolitenessBudget, backfill
+from tests.helpers import (
+    ListWriter,
+    daily_row,
+    hourly_row,
+    period_values,
+    table_html,
+    td,
+)
+
+PERIOD_LAYOUT = layout_for(
+    RecordInterval.ten_day_divide_for_each_mont, LocationColumnType.few
+)
+
+
+def test_hourly_layout_decodes_weather_icon_and_flags():
+    html = table_html(17, [hourly_row(h) for h in range(1, 25)])
+    decoded = decode_table(
+        html, layout_for(RecordInterval.one_hour, LocationColumnType.main)
+    )
+    df = decoded.to_frame()
+
+    assert list(df.columns) == list(MainColumnsHourlyFormatted)
+    assert len(df) == 24
+    assert set(df["天気"]) == {"晴れ"}
+    assert set(df["雲量"]) == {"2"}
+    assert (df["風向"] == 315.0).all()
+    assert (decoded.flags_frame()["気温(ºC)"] == QualityFlag.quasi_normal).all()
+
+
+def test_daily_layout_one_page_per_month():
+    html = table_html(22, [daily_row(d) for d in range(1, 32)])
+    df = decode_table(
+        html, layout_for(RecordInterval.one_day, LocationColumnType.main)
+    ).to_frame()
+    assert list(df.columns) == list(MainColumnsDailyFormatted)
+    assert list(df["日"]) == [str(d) for d in range(1, 32)]
+    assert set(df["天気概況_夜"]) == {"晴一時曇"}
+
+
+def test_period_layout_carries_rowspan_month_label():
+    values = period_values(PERIOD_LAYOUT)
+    rows = []
+    for month in (1, 2):
+        rows.append([f'<td rowspan="3">{month}</td>', td("上旬")] + values)
+        rows.append([td("中旬")] + values)
+        rows.append([td("下旬")] + values)
+    html = table_html(len(PERIOD_LAYOUT.columns), rows)
+
+    df = decode_table(html, PERIOD_LAYOUT).to_frame()
+    assert list(df["月"]) == ["1", "1", "1", "2", "2", "2"]
+    assert list(df["期間"]) == ["上旬", "中旬", "下旬"] * 2
+
+
+def test_backfill_daily_fetches_one_page_per_month():
+    html = table_html(22, [daily_row(d) for d in range(1, 32)])
+    fetched = []
+
+    async def fetcher(query_param, time_out_sec=2.0):
+        fetched.append(query_param.date)
+        return html
+
+    ListWriter.written = []
+    results = asyncio.run(
+        backfill(
+            [BackfillTarget(HAMAMATSU, record_interval=RecordInterval.one_day)],
+            date(2022, 1, 10),
+            date(2022, 3, 5),
+            fetcher=fetcher,
+            writer_factory=ListWriter,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    assert all(r.ok for r in results)
+    assert sorted(fetched) == [date(2022, 1, 1), date(2022, 2, 1), date(2022, 3, 1)]
+    assert {v.every_xx for v, _ in ListWriter.written} == {"every_1_days"}
+
+
+def test_to_csv_coarse_interval(capsys):
+    rows = [[td("1"), td("上旬")] + period_values(PERIOD_LAYOUT)]
+
+    def fetcher(query_param, time_out_sec=2.0):
+        assert query_param.date == date(2022, 1, 1)
+        assert "10daily_a1.php" in query_param.query_url
+        return table_html(len(PERIOD_LAYOUT.columns), rows)
+
+    to_csv("2022-05-05", IWATA.en_name, "10d", True, False, fetcher=fetcher)
+    assert "月,期間,降水量_合計(mm)" in capsys.readouterr().out
+
+
+def test_layout_mismatch_is_reported():
+    html = table_html(17, [hourly_row(1)])
+    with pytest.raises(ValueError, match="layout"):
+        decode_table(html, layout_for(RecordInterval.one_hour, LocationColumnType.few))
@@ -0,0 +1,146 @@
+import pytest
+
+from jma_scraper.core import column_plan
+from jma_scraper.core.column_plan import (
+    ColumnPlanRegistry,
+    TableLayout,
+    build_plan,
+    flatten_header,
+    header_cells,
+    header_fingerprint,
+)
+from jma_scraper.core.errors import LayoutMismatchError
+from jma_scraper.core.html_to_dataframe import parse_html_to_df, pluck_table_from_html
+from jma_scraper.core.location_instances import (
+    HAMAMATSU_10Minutes_COLUMNS,
+    IWATA_10Minutes_COLUMNS,
+)
+from jma_scraper.core.location_spec import (
+    FewColumns10Minutes,
+    LocationColumnType,
+    MainColumns10Minutes,
+    RecordInterval,
+)
+from jma_scraper.core.table_decoder import decode_table, layout_for
+from tests.helpers import hourly_row, table_html
+
+IWATA_HEADER = (
+    '<table id="tablefix1">'
+    '<tr><th rowspan="3">時分</th><th rowspan="3">降水量<br>(mm)</th>'
+    '<th rowspan="3">気温<br>(℃)</th><th rowspan="3">相対湿度<br>(％)</th>'
+    '<th colspan="4">風向・風速</th><th rowspan="3">日照<br>時間<br>(min)</th></tr>'
+    '<tr><th colspan="2">平均</th><th colspan="2">最大瞬間</th></tr>'
+    "<tr><th>風速(m/s)</th><th>風向</th><th>風速(m/s)</th><th>風向</th></tr>"
+)
+
+
+def iwata_table(rows: int) -> str:
+    row = "<tr>" + "<td>00:10</td><td>0.0</td><td>5.0</td><td>60</td>"
+    row += "<td>1.0</td><td>北</td><td>2.0</td><td>北北西</td><td></td></tr>"
+    return IWATA_HEADER + row * rows + "</table>"
+
+
+def test_raw_columns_match_read_html_for_both_station_types(hamamatsu_html):
+    table = pluck_table_from_html(hamamatsu_html)
+    main = flatten_header(header_cells(table))
+    # pandas は rowspan の見出しを "時分_時分" のように繰り返すが, 計画では1回だけにする
+    assert main[0] == "時分"
+    assert main[1:3] == tuple(MainColumns10Minutes)[1:3]
+    assert main[-2] == "風向・風速(m/s)_風向.1"
+
+    few = flatten_header(header_cells(iwata_table(1)))
+    assert few[4:8] == tuple(FewColumns10Minutes)[4:8]
+
+
+def test_plan_is_built_once_per_layout(hamamatsu_html):
+    registry = ColumnPlanRegistry()
+    layout = TableLayout(tuple(HAMAMATSU_10Minutes_COLUMNS.after_columns))
+    table = pluck_table_from_html(hamamatsu_html)
+    plan = registry.plan_for(table, layout)
+
+    # 本体の行数が違っても見出しが同じなら同じ計画
+    shorter = table.replace(table[table.index("<tr", table.index("<td")) :], "</table>")
+    assert registry.plan_for(shorter, layout) is plan
+    assert len(registry) == 1
+    assert plan.mapping["気圧(hPa)_現地"] == "現地_気圧(hPa)"
+
+
+def test_unknown_layout_is_derived_from_the_header():
+    plan = ColumnPlanRegistry().plan_for(iwata_table(1))
+    assert plan.derived
+    assert plan.columns == (
+        "時分",
+        "降水量(mm)",
+        "気温(ºC)",
+        "相対湿度(%)",
+        "風向・風速_平均_風速(m/s)",
+        "風向・風速_平均_風向",
+        "風向・風速_最大瞬間_風速(m/s)",
+        "風向・風速_最大瞬間_風向",
+        "日照時間(min)",
+    )
+    assert plan.layout.direction_columns == {
+        "風向・風速_平均_風向",
+        "風向・風速_最大瞬間_風向",
+    }
+
+    df = decode_table(iwata_table(3)).to_frame()
+    assert list(df.columns) == list(plan.columns)
+    assert list(df["風向・風速_最大瞬間_風向"]) == [337.5] * 3
+
+
+def test_layout_mismatch_is_found_before_the_body():
+    # 本体の行は列数が合っていても, 見出しが合わなければ読まない
+    html = table_html(16, [hourly_row(1)])
+    with pytest.raises(ValueError, match="header has 16 columns"):
+        decode_table(html, layout_for(RecordInterval.one_hour, LocationColumnType.main))
+
+
+def test_same_header_ignores_attributes():
+    plain = header_cells("<tr><th>時</th><th>気温</th></tr><tr><td>1</td></tr>")
+    styled = header_cells(
+        '<tr class="mtx"><th scope="col">時</th><th style="x">気温</th></tr>'
+    )
+    assert header_fingerprint(plain) == header_fingerprint(styled)
+
+
+def test_parse_html_to_df_uses_the_plan_columns():
+    df = parse_html_to_df(iwata_table(2), IWATA_10Minutes_COLUMNS.after_columns)
+    assert list(df.columns) == IWATA_10Minutes_COLUMNS.after_columns
+    assert len(df) == 2
+
+
+TEMPERATURE_HUMIDITY = '気温<br/>(℃)</th><th rowspan="2" scope="col">相対湿度<br/>(％)'
+
+
+@pytest.mark.parametrize(
+    "before, after",
+    [
+        # 気温と相対湿度の入れ替わり
+        (
+            TEMPERATURE_HUMIDITY,
+            '相対湿度<br/>(％)</th><th rowspan="2" scope="col">気温<br/>(℃)',
+        ),
+        ("気温<br/>(℃)", "露点温度<br/>(℃)"),
+    ],
+)
+def test_header_that_differs_from_the_layout_is_rejected_once(
+    hamamatsu_html, monkeypatch, before, after
+):
+    table = pluck_table_from_html(hamamatsu_html)
+    assert before in table
+    changed = table.replace(before, after)
+    with pytest.raises(LayoutMismatchError, match="does not match the layout"):
+        parse_html_to_df(changed, HAMAMATSU_10Minutes_COLUMNS.after_columns)
+
+    registry = ColumnPlanRegistry()
+    layout = layout_for(RecordInterval.ten_minutes, LocationColumnType.main)
+    built = []
+    monkeypatch.setattr(
+        column_plan, "build_plan", lambda *args: built.append(args) or build_plan(*args)
+    )
+    for _ in range(2):
+        with pytest.raises(LayoutMismatchError):
+            registry.plan_for(changed, layout)
+    assert len(built) == 1
+    assert len(registry) == 0
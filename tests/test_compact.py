@@ -0,0 +1,81 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from jma_scraper.core.compact import (
+    WIND_DIRECTION_DTYPE,
+    compact_frame,
+    direction_degrees,
+    hour_minutes_text,
+    to_wind_direction,
+)
+from jma_scraper.core.html_to_dataframe import parse_html_to_df
+from jma_scraper.core.location_instances import HAMAMATSU, HAMAMATSU_10Minutes_COLUMNS
+from jma_scraper.core.table_decoder import WIND_DIRECTION_DEGREES
+from jma_scraper.infrastracture.parquet import to_storage_table
+from jma_scraper.usecase.backfill import BackfillTarget
+
+
+def test_wind_direction_categories_are_ordered_by_degrees():
+    names = list(WIND_DIRECTION_DTYPE.categories)
+    assert names[0] == "静穏"
+    assert names[1] == "北北東"
+    assert names[-1] == "北"
+    assert [WIND_DIRECTION_DEGREES[name] for name in names] == sorted(
+        WIND_DIRECTION_DEGREES.values()
+    )
+    directions = to_wind_direction(["北", "東", "南"])
+    assert directions.min() == "東"
+    assert directions.max() == "北"
+
+
+def test_degrees_round_trip():
+    degrees = np.array([*WIND_DIRECTION_DEGREES.values(), np.nan], dtype=np.float32)
+    directions = to_wind_direction(degrees)
+    np.testing.assert_array_equal(direction_degrees(directions), degrees)
+    np.testing.assert_array_equal(
+        direction_degrees(pd.Series(to_wind_direction(list(WIND_DIRECTION_DEGREES)))),
+        degrees[:-1],
+    )
+
+
+def test_compact_frame_dtypes_and_memory(formatted_df):
+    compacted = compact_frame(formatted_df)
+    assert compacted["時分"].dtype == np.int16
+    assert compacted["時分"].iloc[-1] == 1440
+    assert compacted["平均_風向"].dtype == WIND_DIRECTION_DTYPE
+    assert compacted["気温(ºC)"].dtype == np.float32
+    np.testing.assert_allclose(compacted["気温(ºC)"], formatted_df["気温(ºC)"], rtol=1e-6)
+    assert compacted["平均_風向"].astype(object).tolist() == (
+        formatted_df["平均_風向"].tolist()
+    )
+    assert (
+        compacted.memory_usage(deep=True).sum() * 4
+        < formatted_df.memory_usage(deep=True).sum()
+    )
+    assert hour_minutes_text(compacted["時分"]).tolist() == formatted_df["時分"].tolist()
+
+
+def test_decoded_and_read_html_pages_compact_the_same(hamamatsu_html):
+    read_html = BackfillTarget(HAMAMATSU, HAMAMATSU_10Minutes_COLUMNS, compact=True)
+    decoded = BackfillTarget(HAMAMATSU, compact=True)
+    day = date(2022, 1, 1)
+    expected = read_html.parse(hamamatsu_html, day)
+    actual = decoded.parse(hamamatsu_html, day)
+    assert actual.index[0] == pd.Timestamp("2022-01-01 00:10", tz="Asia/Tokyo")
+    pd.testing.assert_frame_equal(
+        actual, expected, check_column_type=False, check_names=False
+    )
+
+
+def test_compact_pages_are_stored_as_before(hamamatsu_html, formatted_df):
+    day = date(2022, 1, 1)
+    compacted = parse_html_to_df(
+        hamamatsu_html, HAMAMATSU_10Minutes_COLUMNS.after_columns, compact=True
+    )
+    stored = to_storage_table(compacted, day)
+    assert stored.schema == to_storage_table(formatted_df, day).schema
+    pd.testing.assert_frame_equal(
+        stored.to_pandas(), to_storage_table(formatted_df, day).to_pandas()
+    )
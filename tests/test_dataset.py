@@ -0,0 +1,133 @@
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from jma_scraper.core.aggregation import Level
+from jma_scraper.core.html_to_dataframe import parse_html_to_df
+from jma_scraper.core.location_instances import HAMAMATSU_10Minutes_COLUMNS
+from jma_scraper.core.location_spec import LocationColumnType, RecordInterval
+from jma_scraper.core.table_decoder import decode_table, layout_for
+from jma_scraper.infrastracture.dataset import JmaDataset
+from jma_scraper.infrastracture.parquet import write_parquet_days
+from jma_scraper.infrastracture.pyramid import write_parquet_days_with_pyramid
+from tests.helpers import period_values, src, table_html, td
+
+TEMPERATURE = "気温(ºC)"
+
+
+def year_of_days(year: int):
+    day = date(year, 1, 1)
+    while day.year == year:
+        yield day
+        day += timedelta(days=1)
+
+
+@pytest.fixture(scope="module")
+def archive(tmp_path_factory):
+    """hamamatsu は2022年の1年分と前年の大晦日. iwata は年末年始だけで, 気圧の列がない"""
+    html = (Path(__file__).parent / "input_examples/hamamatsu_jma.html").read_text()
+    df = parse_html_to_df(html, HAMAMATSU_10Minutes_COLUMNS.after_columns)
+    few = df.drop(columns=["現地_気圧(hPa)", "海面_気圧(hPa)"])
+    hamamatsu_days = [date(2021, 12, 31), *year_of_days(2022)]
+    iwata_days = [date(2021, 12, 31), date(2022, 1, 1), date(2022, 12, 31)]
+    frames = [(src(day), df.copy()) for day in hamamatsu_days] + [
+        (src(day, "iwata"), few.copy()) for day in iwata_days
+    ]
+    root = tmp_path_factory.mktemp("archive")
+    write_parquet_days(frames, root)
+    return root
+
+
+def test_selecting_reads_nothing(tmp_path):
+    ds = JmaDataset(tmp_path / "missing").select("hamamatsu", TEMPERATURE)
+    assert ds.files() == []
+    assert ds.to_arrow().column_names == ["station", "date"]
+
+
+def test_one_variable_one_station_one_month(archive):
+    ds = JmaDataset(archive).select(
+        "hamamatsu", TEMPERATURE, date(2022, 3, 1), date(2022, 3, 31)
+    )
+    [fragment] = ds.fragments()
+    assert fragment.path.parent.name == "year=2022"
+    assert fragment.columns == ("date", "時分", TEMPERATURE)
+    # 10分ごとの値の row group は約1ヶ月分なので, 1年分のうちの一部だけを読む
+    assert 0 < len(fragment.row_groups) <= 2
+    archive_bytes = sum(path.stat().st_size for path in archive.rglob("*.parquet"))
+    assert ds.scanned_bytes() < archive_bytes / 20
+
+    df = ds.to_pandas()
+    assert df.columns.tolist() == ["station", "date", "時分", TEMPERATURE]
+    assert len(df) == 31 * 144
+    assert df["date"].min() == date(2022, 3, 1)
+    assert df["date"].max() == date(2022, 3, 31)
+
+
+def test_stations_with_different_columns(archive):
+    ds = JmaDataset(archive).select(
+        variables=["現地_気圧(hPa)", TEMPERATURE],
+        start=date(2021, 12, 31),
+        end=date(2022, 1, 1),
+    )
+    assert [station for station, _ in ds.files()] == [
+        "hamamatsu",
+        "hamamatsu",
+        "iwata",
+        "iwata",
+    ]
+    df = ds.to_pandas()
+    assert df.groupby("station").size().to_dict() == {"hamamatsu": 288, "iwata": 288}
+    assert df.loc[df["station"] == "iwata", "現地_気圧(hPa)"].isna().all()
+    assert df.loc[df["station"] == "hamamatsu", "現地_気圧(hPa)"].notna().all()
+
+    with pytest.raises(ValueError, match="Unknown variables"):
+        ds.select(variables="気温").to_arrow()
+
+
+def test_timestamp_index(archive):
+    df = (
+        JmaDataset(archive)
+        .select("iwata", TEMPERATURE, date(2022, 12, 31), date(2022, 12, 31))
+        .to_pandas(timestamp_index=True)
+    )
+    assert df.index[0] == pd.Timestamp("2022-12-31 00:10", tz="Asia/Tokyo")
+    assert df.index[-1] == pd.Timestamp("2023-01-01 00:00", tz="Asia/Tokyo")
+
+
+def test_pyramid_levels(tmp_path, formatted_df):
+    days = [date(2022, 1, 1), date(2022, 1, 2), date(2022, 2, 1)]
+    write_parquet_days_with_pyramid(
+        [(src(day), formatted_df.copy()) for day in days], tmp_path
+    )
+    monthly = JmaDataset(tmp_path, Level.monthly).select(variables="平均_気温(ºC)")
+    assert monthly.to_pandas()["date"].tolist() == [date(2022, 1, 1), date(2022, 2, 1)]
+    hourly = (
+        JmaDataset(tmp_path, Level.hourly)
+        .select(variables="最高_気温(ºC)", start=date(2022, 2, 1))
+        .to_pandas(timestamp_index=True)
+    )
+    assert hourly.columns.tolist() == ["station", "date", "時", "最高_気温(ºC)"]
+    assert len(hourly) == 24
+    assert hourly.index[-1] == pd.Timestamp("2022-02-02 00:00", tz="Asia/Tokyo")
+
+
+def test_period_partition_keeps_period_column(tmp_path):
+    layout = layout_for(
+        RecordInterval.ten_day_divide_for_each_mont, LocationColumnType.few
+    )
+    rows = [[td("1"), td(period)] + period_values(layout) for period in ("上旬", "中旬")]
+    df = decode_table(table_html(len(layout.columns), rows), layout).to_frame()
+    every_xx = RecordInterval.ten_day_divide_for_each_mont.to_literal()
+    write_parquet_days([(src(date(2022, 1, 1), every_xx=every_xx), df)], tmp_path)
+
+    variable = layout.value_columns[0]
+    table = (
+        JmaDataset(tmp_path, source=every_xx)
+        .select("hamamatsu", variable, date(2022, 1, 5), date(2022, 1, 31))
+        .to_arrow()
+    )
+    assert table.column_names == ["station", "date", "期間", variable]
+    assert table["date"].to_pylist() == [date(2022, 1, 11)]
+    assert table["期間"].to_pylist() == [2]
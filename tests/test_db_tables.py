@@ -1,10 +1,15 @@
 from pathlib import Path
 
 from pytest import fixture
-from sqlmodel import Session, SQLModel, create_engine
-from sqlmodel.pool import StaticPool
+from sqlalchemy import inspect, text
+from sqlmodel import Session, select
 
 from jma_scraper.infrastracture.db_tables import FetchedHtml
+from jma_scraper.infrastracture.sqlite_starter import (
+    create_db_and_tables,
+    create_engine_all,
+    create_sql_url,
+)
 
 
 @fixture
@@ -17,19 +22,6 @@ def html_table_example() -> str:
     return text_path.read_text()
 
 
-@fixture(name="session")
-def in_memory_session():
-    engine = create_engine(
-        "sqlite://",  # in memory database
-        echo=True,
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-    )
-    SQLModel.metadata.create_all(engine)
-    with Session(engine) as session:
-        yield session
-
-
 def test_fetched_html_tables(html_table_example):
     table_content = FetchedHtml(
         url="https://example.com",
@@ -54,3 +46,37 @@ def test_fetched_html_recorded_to_sqlite_table(session, html_table_example):
         assert got_data is not None
         assert isinstance(got_data, FetchedHtml)
         assert got_data.html_content == html_table_example
+
+
+def test_old_fetched_html_table_is_migrated(tmp_path):
+    engine = create_engine_all(create_sql_url(str(tmp_path / "old.db")))
+    with engine.begin() as conn:
+        # HtmlCache 導入前のテーブル
+        conn.execute(
+            text(
+                "CREATE TABLE fetchedhtml (id VARCHAR NOT NULL, recorded_at DATETIME NOT NULL, "
+                "url VARCHAR NOT NULL, html_content VARCHAR NOT NULL, PRIMARY KEY (id))"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO fetchedhtml VALUES "
+                "('old', '2022-01-01 00:00:00', 'https://example.com/old', '<html/>')"
+            )
+        )
+
+    for _ in range(2):
+        create_db_and_tables(engine)
+
+    with Session(engine) as session:
+        session.add(FetchedHtml(url="https://example.com/new", digest="abc"))
+        session.commit()
+        rows = {row.id: row for row in session.exec(select(FetchedHtml))}
+    assert rows.pop("old").html_content == "<html/>"
+    [new] = rows.values()
+    assert new.digest == "abc"
+    assert new.html_content is None
+    index_names = {
+        index["name"] for index in inspect(engine).get_indexes("fetchedhtml")
+    }
+    assert "ix_fetchedhtml_url" in index_names
@@ -0,0 +1,241 @@
+import asyncio
+import io
+import json
+from datetime import date
+from typing import List
+
+import pyarrow.parquet as pq
+import pytest
+import typer
+from typer.testing import CliRunner
+
+from jma_scraper.core.location_instances import (
+    HAMAMATSU,
+    SHIZUOKA,
+    HAMAMATSU_10Minutes_COLUMNS,
+    SHIZUOKA_10Minutes_COLUMNS,
+)
+from jma_scraper.core.location_spec import RecordInterval
+from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.input_inferfaces.command_line import to_csv_with_typer
+from jma_scraper.usecase.backfill import BackfillTarget, PolitenessBudget
+from jma_scraper.usecase.export import (
+    ExportFormat,
+    ReorderBuffer,
+    export,
+    fetch_in_order,
+    plan_export,
+)
+from tests.helpers import daily_row, hourly_row, table_html
+
+TARGETS = [
+    BackfillTarget(location=HAMAMATSU, columns=HAMAMATSU_10Minutes_COLUMNS),
+    BackfillTarget(location=SHIZUOKA, columns=SHIZUOKA_10Minutes_COLUMNS),
+]
+
+
+class ShuffledFetcher:
+    """新しい日付ほど早く返す. fail_dates の日は失敗する"""
+
+    def __init__(self, html: str, fail_dates=(), slow_first_sec: float = 0.0):
+        self.html = html
+        self.fail_dates = set(fail_dates)
+        self.slow_first_sec = slow_first_sec
+        self.started: List[QueryParamsForJma] = []
+
+    async def __call__(self, query_param: QueryParamsForJma, time_out_sec=2.0) -> str:
+        self.started.append(query_param)
+        if len(self.started) == 1 and self.slow_first_sec:
+            await asyncio.sleep(self.slow_first_sec)
+        await asyncio.sleep(0.01 * (32 - query_param.date.day) / 31)
+        if query_param.date in self.fail_dates:
+            raise ValueError("fetch failed")
+        return self.html
+
+
+def run_export(fetcher, fmt=ExportFormat.csv) -> bytes:
+    out = io.BytesIO()
+    asyncio.run(
+        export(
+            plan_export(TARGETS, date(2022, 1, 1), date(2022, 1, 4)),
+            fetcher,
+            out,
+            fmt,
+            jobs=4,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    return out.getvalue()
+
+
+def test_reorder_buffer_rejects_duplicates():
+    buffer = ReorderBuffer()
+    buffer.put(0, "a")
+    with pytest.raises(ValueError):
+        buffer.put(0, "b")
+    assert list(buffer.pop_ready()) == ["a"]
+    with pytest.raises(ValueError):
+        buffer.put(0, "c")
+
+
+def test_plan_export_orders_by_station_then_date():
+    pages = plan_export(TARGETS, date(2022, 1, 30), date(2022, 2, 1))
+    assert [(target.location.en_name, d.day) for d, target in pages] == [
+        ("hamamatsu", 30),
+        ("hamamatsu", 31),
+        ("hamamatsu", 1),
+        ("shizuoka", 30),
+        ("shizuoka", 31),
+        ("shizuoka", 1),
+    ]
+
+    daily = BackfillTarget(location=HAMAMATSU, record_interval=RecordInterval.one_day)
+    assert plan_export([daily], date(2022, 1, 20), date(2022, 3, 2)) == [
+        (date(2022, 1, 1), daily),
+        (date(2022, 2, 1), daily),
+        (date(2022, 3, 1), daily),
+    ]
+
+
+def test_csv_is_written_in_station_and_date_order(hamamatsu_html):
+    text = run_export(ShuffledFetcher(hamamatsu_html)).decode("utf-8")
+    lines = text.splitlines()
+    header = lines[0]
+    assert header.startswith("station,date,")
+    keys = [tuple(line.split(",")[:2]) for line in lines if line != header]
+    assert keys == sorted(keys, key=lambda key: (key[0] != "hamamatsu", key[1]))
+    assert len(keys) == 8 * 144
+    # 観測地点で列が変わるところでだけヘッダーを書き直す
+    assert lines.count(header) == 1
+
+
+def test_failed_pages_are_skipped_and_reported(hamamatsu_html):
+    fetcher = ShuffledFetcher(hamamatsu_html, fail_dates=[date(2022, 1, 2)])
+    out = io.BytesIO()
+    results = asyncio.run(
+        export(
+            plan_export(TARGETS[:1], date(2022, 1, 1), date(2022, 1, 3)),
+            fetcher,
+            out,
+            ExportFormat.jsonl,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    assert [(r.date.day, r.ok) for r in results] == [(1, True), (2, False), (3, True)]
+    records = [json.loads(line) for line in out.getvalue().decode().splitlines()]
+    assert {record["date"] for record in records} == {"2022-01-01", "2022-01-03"}
+    assert records[0]["station"] == "hamamatsu"
+
+
+def test_parquet_output_has_station_and_date(hamamatsu_html):
+    out = io.BytesIO()
+    asyncio.run(
+        export(
+            plan_export(TARGETS[:1], date(2022, 1, 1), date(2022, 1, 3)),
+            ShuffledFetcher(hamamatsu_html),
+            out,
+            ExportFormat.parquet,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    table = pq.read_table(io.BytesIO(out.getvalue()))
+    assert table.num_rows == 3 * 144
+    assert table.column_names[:2] == ["station", "date"]
+    assert table["date"].to_pylist()[0] == date(2022, 1, 1)
+
+
+def test_window_bounds_pages_ahead_of_a_slow_head(hamamatsu_html):
+    fetcher = ShuffledFetcher(hamamatsu_html, slow_first_sec=0.2)
+    pages = plan_export(TARGETS[:1], date(2022, 1, 1), date(2022, 1, 31))
+
+    async def consume() -> List[int]:
+        ahead = []
+        async for frame in fetch_in_order(
+            pages, fetcher, jobs=2, window=4, budget=PolitenessBudget(0.0)
+        ):
+            ahead.append(len(fetcher.started) - frame.date.day)
+        return ahead
+
+    ahead = asyncio.run(consume())
+    assert len(ahead) == 31
+    # 先頭が遅れている間も, 取得を始めたページは window の分しか先に進まない
+    assert max(ahead) <= 4 - 1
+
+
+def test_cli_needs_a_date_or_start():
+    app = typer.Typer()
+    app.command()(to_csv_with_typer)
+    result = CliRunner().invoke(
+        app, ["--location-name", "hamamatsu", "--location-name", "iwata"]
+    )
+    assert result.exit_code == 2
+
+
+def test_decoded_values_keep_their_digits_in_jsonl(hamamatsu_html):
+    out = io.BytesIO()
+    asyncio.run(
+        export(
+            plan_export(
+                [BackfillTarget(HAMAMATSU)], date(2022, 1, 1), date(2022, 1, 1)
+            ),
+            ShuffledFetcher(hamamatsu_html),
+            out,
+            ExportFormat.jsonl,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    records = [json.loads(line) for line in out.getvalue().decode().splitlines()]
+    read_html = [
+        json.loads(line)
+        for line in run_export(ShuffledFetcher(hamamatsu_html), ExportFormat.jsonl)
+        .decode()
+        .splitlines()
+    ]
+    assert records[0]["気温(ºC)"] == float(read_html[0]["気温(ºC)"])
+    assert records[0]["現地_気圧(hPa)"] == float(read_html[0]["現地_気圧(hPa)"])
+
+
+def test_parquet_output_of_hourly_pages():
+    html = table_html(17, [hourly_row(h) for h in range(1, 25)])
+
+    async def fetcher(query_param, time_out_sec=2.0):
+        return html
+
+    out = io.BytesIO()
+    target = BackfillTarget(HAMAMATSU, record_interval=RecordInterval.one_hour)
+    asyncio.run(
+        export(
+            plan_export([target], date(2022, 1, 1), date(2022, 1, 2)),
+            fetcher,
+            out,
+            ExportFormat.parquet,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    table = pq.read_table(io.BytesIO(out.getvalue()))
+    assert table.num_rows == 2 * 24
+    assert set(table["天気"].to_pylist()) == {"晴れ"}
+
+
+def test_daily_csv_rows_have_their_own_dates():
+    html = table_html(22, [daily_row(d) for d in range(1, 32)])
+
+    async def fetcher(query_param, time_out_sec=2.0):
+        return html
+
+    out = io.BytesIO()
+    target = BackfillTarget(HAMAMATSU, record_interval=RecordInterval.one_day)
+    asyncio.run(
+        export(
+            plan_export([target], date(2022, 1, 1), date(2022, 1, 31)),
+            fetcher,
+            out,
+            ExportFormat.csv,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    lines = out.getvalue().decode("utf-8").splitlines()
+    assert lines[0].startswith("station,date,日,")
+    assert [line.split(",")[1] for line in lines[1:]] == [
+        date(2022, 1, d).isoformat() for d in range(1, 32)
+    ]
@@ -0,0 +1,90 @@
+import pytest
+
+from jma_scraper.core.repository import HtmlCache
+from jma_scraper.infrastracture.html_cache import (
+    CachedFetcher,
+    PackedHtmlCache,
+    html_digest,
+)
+
+URL_1 = "https://www.data.jma.go.jp/obd/stats/etrn/view/10min_s1.php?prec_no=50&block_no=47654&year=2021&month=1&day=1"
+URL_2 = "https://www.data.jma.go.jp/obd/stats/etrn/view/10min_s1.php?prec_no=50&block_no=47654&year=2021&month=1&day=2"
+
+
+@pytest.fixture
+def cache(tmp_path) -> PackedHtmlCache:
+    return PackedHtmlCache(tmp_path / "html_cache")
+
+
+def test_packed_cache_is_html_cache(cache):
+    assert isinstance(cache, HtmlCache)
+
+
+def test_put_and_get_roundtrip(cache, hamamatsu_html):
+    assert cache.get(URL_1) is None
+
+    digest = cache.put(URL_1, hamamatsu_html)
+    assert digest == html_digest(hamamatsu_html)
+    assert cache.get(URL_1) == hamamatsu_html
+    assert URL_1 in cache
+    # 圧縮して保存されている
+    assert cache.pack_path.stat().st_size < len(hamamatsu_html.encode()) / 4
+
+
+def test_same_content_is_stored_once(cache, hamamatsu_html):
+    cache.put(URL_1, hamamatsu_html)
+    size = cache.pack_path.stat().st_size
+    cache.put(URL_2, hamamatsu_html)
+    cache.put(URL_1, hamamatsu_html)
+
+    assert cache.pack_path.stat().st_size == size
+    assert cache.get(URL_2) == hamamatsu_html
+
+
+def test_revised_page_replaces_key(cache, hamamatsu_html):
+    cache.put(URL_1, hamamatsu_html)
+    revised = hamamatsu_html.replace("1017.2", "1017.3")
+    cache.put(URL_1, revised)
+
+    assert cache.get(URL_1) == revised
+    assert cache.digest_of(URL_1) == html_digest(revised)
+
+
+def test_reopened_cache_reads_index(tmp_path, hamamatsu_html):
+    PackedHtmlCache(tmp_path).put(URL_1, hamamatsu_html)
+    with (tmp_path / PackedHtmlCache.INDEX_FILE).open("a") as f:
+        f.write("K\tbroken")  # 書き込み途中で落ちた行
+
+    reopened = PackedHtmlCache(tmp_path)
+    assert reopened.get(URL_1) == hamamatsu_html
+    assert reopened.get("broken") is None
+
+
+def test_trained_dictionary_keeps_old_pages_readable(tmp_path, hamamatsu_html):
+    cache = PackedHtmlCache(tmp_path)
+    cache.put(URL_1, hamamatsu_html)
+
+    samples = [hamamatsu_html.replace("1017", str(1000 + i)) for i in range(40)]
+    dict_id = cache.train_dictionary(samples, dict_size=16_384)
+    assert dict_id != 0
+    cache.put(URL_2, samples[0])
+
+    reopened = PackedHtmlCache(tmp_path)
+    assert reopened.get(URL_1) == hamamatsu_html
+    assert reopened.get(URL_2) == samples[0]
+
+
+def test_cached_fetcher_skips_network(
+    cache, hamamatsu_html, hamamatsu_qp_every_10_minuets
+):
+    calls = []
+
+    def fetcher(query_param, time_out_sec=2.0):
+        calls.append(query_param)
+        return hamamatsu_html
+
+    cached_fetcher = CachedFetcher(fetcher, cache)
+    assert cached_fetcher(hamamatsu_qp_every_10_minuets) == hamamatsu_html
+    assert cached_fetcher(hamamatsu_qp_every_10_minuets) == hamamatsu_html
+    assert len(calls) == 1
+    assert cache.get(str(hamamatsu_qp_every_10_minuets.query_url)) == hamamatsu_html
@@ -1,6 +1,12 @@
 import pandas as pd
+import pytest
+from bs4 import BeautifulSoup
 
-from jma_scraper.core.html_to_dataframe import pluck_table_from_html, read_html_table
+from jma_scraper.core.html_to_dataframe import (
+    pluck_table_element,
+    pluck_table_from_html,
+    read_html_table,
+)
 
 
 def test_html_txt_can_convert_to_dataframe(hamamatsu_html):
@@ -8,3 +14,29 @@ def test_html_txt_can_convert_to_dataframe(hamamatsu_html):
     df = read_html_table(html_table_txt, pd.read_html)
     assert type(df) == pd.DataFrame
     assert isinstance(df.columns, pd.MultiIndex)
+
+
+def test_pluck_table_from_html_matches_bs4_subtree(hamamatsu_html):
+    soup = BeautifulSoup(hamamatsu_html, features="html.parser")
+    expected = read_html_table(str(soup.find(id="tablefix1")), pd.read_html)
+
+    html_table_txt = pluck_table_from_html(hamamatsu_html)
+    assert html_table_txt.startswith('<table class="data2_s" id="tablefix1">')
+    assert html_table_txt.endswith("</table>")
+    pd.testing.assert_frame_equal(read_html_table(html_table_txt), expected)
+
+
+def test_pluck_table_element(hamamatsu_html):
+    element = pluck_table_element(hamamatsu_html)
+    assert element.tag == "table"
+    assert element.get("id") == "tablefix1"
+
+    # 閉じタグが欠けていても lxml にフォールバックして取り出せる
+    unclosed = hamamatsu_html.replace("</table>\n<div", "<div", 1)
+    assert pluck_table_element(unclosed).get("id") == "tablefix1"
+
+
+@pytest.mark.parametrize("html", ["", "<html><body><table></table></body></html>"])
+def test_pluck_table_from_html_raises_without_tablefix1(html):
+    with pytest.raises(ValueError, match="tablefix1"):
+        pluck_table_from_html(html)
@@ -0,0 +1,64 @@
+import asyncio
+
+import httpx
+import pytest
+
+from jma_scraper.core.repository import AsyncFetcher, Fetcher
+from jma_scraper.infrastracture.http_client import (
+    ACCEPT_ENCODING,
+    AsyncJmaHttpClient,
+    JmaHttpClient,
+)
+
+
+def html_handler(html: str, content_type: str = "text/html"):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(
+            200, content=html.encode(), headers={"content-type": content_type}
+        )
+
+    return handler, requests
+
+
+def test_client_implements_fetcher(hamamatsu_html, hamamatsu_qp_every_10_minuets):
+    handler, requests = html_handler(hamamatsu_html)
+    with JmaHttpClient(transport=httpx.MockTransport(handler)) as client:
+        assert isinstance(client, Fetcher)
+        for _ in range(3):
+            assert client(hamamatsu_qp_every_10_minuets) == hamamatsu_html
+
+    assert len(requests) == 3
+    assert requests[0].url == hamamatsu_qp_every_10_minuets.query_url
+    assert requests[0].headers["accept-encoding"] == ACCEPT_ENCODING
+
+
+def test_client_rejects_non_html(hamamatsu_html, hamamatsu_qp_every_10_minuets):
+    handler, _ = html_handler(hamamatsu_html, content_type="application/json")
+    with JmaHttpClient(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(ValueError, match="text/html"):
+            client(hamamatsu_qp_every_10_minuets)
+
+
+def test_client_rejects_invalid_pool_size():
+    with pytest.raises(ValueError, match="max_connections"):
+        JmaHttpClient(max_connections=0)
+
+
+def test_async_client_implements_async_fetcher(
+    hamamatsu_html, hamamatsu_qp_every_10_minuets
+):
+    handler, requests = html_handler(hamamatsu_html)
+
+    async def fetch_twice():
+        async with AsyncJmaHttpClient(transport=httpx.MockTransport(handler)) as client:
+            assert isinstance(client, AsyncFetcher)
+            return await asyncio.gather(
+                client(hamamatsu_qp_every_10_minuets),
+                client(hamamatsu_qp_every_10_minuets),
+            )
+
+    assert asyncio.run(fetch_twice()) == [hamamatsu_html, hamamatsu_html]
+    assert len(requests) == 2
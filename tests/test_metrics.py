@@ -0,0 +1,142 @@
+import json
+import time
+
+import httpx
+import pytest
+from sqlmodel import Session, SQLModel
+
+from jma_scraper.core.html_to_dataframe import parse_html_to_df
+from jma_scraper.core.location_instances import HAMAMATSU_10Minutes_COLUMNS
+from jma_scraper.core.metrics import METRICS, Metrics, SamplingProfiler, timed
+from jma_scraper.core.repository import Writer
+from jma_scraper.infrastracture.db_tables import LocalFileSaved
+from jma_scraper.infrastracture.http_client import JmaHttpClient
+from jma_scraper.infrastracture.sqlite_starter import create_engine_all
+
+
+@pytest.fixture
+def enabled_metrics():
+    METRICS.enabled = True
+    METRICS.reset()
+    yield METRICS
+    METRICS.enabled = False
+    METRICS.reset()
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics()
+
+    @timed("work", metrics=metrics)
+    def work(x):
+        return x * 2
+
+    with metrics.timer("block"):
+        pass
+    metrics.inc("pages_ok")
+    metrics.add_bytes("fetch", "in", 10)
+
+    assert work(2) == 4
+    assert metrics.summary()["stages"] == {}
+    assert metrics.summary()["counters"] == {}
+    assert metrics.summary()["bytes"] == {}
+
+
+def test_timed_records_even_when_the_function_raises():
+    metrics = Metrics(enabled=True)
+
+    @timed("work", metrics=metrics)
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        fail()
+    assert metrics.summary()["stages"]["work"]["count"] == 1
+
+
+def test_prometheus_buckets_are_cumulative():
+    metrics = Metrics(enabled=True)
+    for seconds in (0.0002, 0.02, 0.3, 20.0):
+        metrics.observe("fetch", seconds)
+    lines = metrics.to_prometheus().splitlines()
+
+    assert 'jma_stage_seconds_bucket{stage="fetch",le="0.0005"} 1' in lines
+    assert 'jma_stage_seconds_bucket{stage="fetch",le="0.5"} 3' in lines
+    assert 'jma_stage_seconds_bucket{stage="fetch",le="10.0"} 3' in lines
+    assert 'jma_stage_seconds_bucket{stage="fetch",le="+Inf"} 4' in lines
+    assert 'jma_stage_seconds_count{stage="fetch"} 4' in lines
+
+
+def test_write_exports_prometheus_and_json(tmp_path):
+    metrics = Metrics(enabled=True)
+    metrics.observe("fetch", 0.1)
+    metrics.inc("pages_ok", 3)
+    metrics.write(tmp_path / "metrics")
+
+    summary = json.loads((tmp_path / "metrics" / "run_summary.json").read_text())
+    assert summary["stages"]["fetch"]["count"] == 1
+    assert summary["counters"] == {"pages_ok": 3}
+    prom = (tmp_path / "metrics" / "metrics.prom").read_text()
+    assert 'jma_events_total{name="pages_ok"} 3' in prom
+
+
+def test_parse_stages_are_timed(enabled_metrics, hamamatsu_html):
+    parse_html_to_df(hamamatsu_html, HAMAMATSU_10Minutes_COLUMNS.after_columns)
+    stages = enabled_metrics.summary()["stages"]
+    for stage in ("pluck_table_from_html", "column_plan", "read_html_table"):
+        assert stages[stage]["count"] == 1
+
+
+def test_writer_subclasses_are_timed(enabled_metrics):
+    class ListWriter(Writer):
+        def write(self, src, dst=None):
+            self.written = src
+
+    writer = ListWriter.__new__(ListWriter)
+    writer.write("df")
+    assert writer.written == "df"
+    assert enabled_metrics.summary()["stages"]["write.ListWriter"]["count"] == 1
+
+
+def test_fetch_is_timed_with_bytes_in(
+    enabled_metrics, hamamatsu_html, hamamatsu_qp_every_10_minuets
+):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200, content=hamamatsu_html.encode(), headers={"content-type": "text/html"}
+        )
+
+    with JmaHttpClient(transport=httpx.MockTransport(handler)) as client:
+        client(hamamatsu_qp_every_10_minuets)
+
+    summary = enabled_metrics.summary()
+    assert summary["stages"]["fetch"]["count"] == 1
+    assert summary["bytes"]["fetch.in"] == len(hamamatsu_html.encode())
+
+
+def test_sql_commits_are_timed(enabled_metrics, tmp_path):
+    engine = create_engine_all(f"sqlite:///{tmp_path / 'jma.db'}")
+    SQLModel.metadata.create_all(engine)
+    enabled_metrics.reset()
+    with Session(engine) as session:
+        session.add(LocalFileSaved(file_path="a.csv"))
+        session.commit()
+
+    stages = enabled_metrics.summary()["stages"]
+    assert stages["sql_commit"]["count"] == 1
+    assert stages["sql_execute"]["count"] >= 1
+
+
+def test_sampling_profiler_collects_stacks(tmp_path):
+    def busy_loop():
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+
+    with SamplingProfiler(interval_sec=0.001) as profiler:
+        busy_loop()
+    profiler.write(tmp_path / "profile.folded")
+
+    folded = (tmp_path / "profile.folded").read_text()
+    assert "busy_loop (test_metrics.py)" in folded
+    stack, count = folded.splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0
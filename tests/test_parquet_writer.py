@@ -0,0 +1,109 @@
+import asyncio
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from jma_scraper.core.location_spec import LocationColumnType, RecordInterval
+from jma_scraper.core.table_decoder import decode_table, layout_for
+from jma_scraper.infrastracture.parquet import (
+    DfLocalParquetWriter,
+    ParquetBatchWriter,
+    partition_dir,
+    write_parquet_days,
+)
+from jma_scraper.usecase.backfill import PolitenessBudget, backfill
+from tests.helpers import TARGETS, FakeFetcher, daily_row, hourly_row, src, table_html
+
+
+def test_writer_stores_typed_columns(tmp_path, formatted_df):
+    writer = DfLocalParquetWriter(src(date(2023, 1, 1)), root=tmp_path)
+    writer.write(formatted_df.copy())
+
+    path = writer.create_parquet_full_path()
+    assert path == partition_dir(tmp_path, src(date(2023, 1, 1))) / "data.parquet"
+    table = pq.read_table(path)
+    assert table.num_rows == 144
+    assert table.schema.field("date").type == pa.date32()
+    assert table.schema.field("時分").type == pa.string()
+    assert table.schema.field("平均_風向").type == pa.string()
+    assert table.schema.field("気温(ºC)").type == pa.float32()
+    # "--" の降水量は 0
+    assert pa.compute.sum(table["降水量(mm)"]).as_py() == 0
+
+
+def test_rewriting_a_day_is_idempotent(tmp_path, formatted_df):
+    for _ in range(3):
+        DfLocalParquetWriter(src(date(2023, 1, 1)), root=tmp_path).write(
+            formatted_df.copy()
+        )
+    DfLocalParquetWriter(src(date(2023, 1, 2)), root=tmp_path).write(
+        formatted_df.copy()
+    )
+
+    table = pq.read_table(partition_dir(tmp_path, src(date(2023, 1, 1))))
+    assert table.num_rows == 144 * 2
+
+
+def test_write_many_days_into_one_file_per_year(tmp_path, formatted_df):
+    days = [date(2022, 12, 30), date(2022, 12, 31), date(2023, 1, 1)]
+    paths = write_parquet_days(
+        [(src(d), formatted_df.copy()) for d in days],
+        root=tmp_path,
+        row_group_size=144,
+    )
+    assert len(paths) == 2
+
+    metadata = pq.ParquetFile(paths[0]).metadata
+    assert metadata.num_rows == 144 * 2
+    assert metadata.num_row_groups == 2
+    statistics = metadata.row_group(1).column(0).statistics
+    assert statistics.has_min_max
+    assert statistics.min == statistics.max == date(2022, 12, 31)
+
+
+def test_decoded_hourly_and_daily_pages(tmp_path):
+    hourly = decode_table(
+        table_html(17, [hourly_row(h) for h in reversed(range(1, 25))]),
+        layout_for(RecordInterval.one_hour, LocationColumnType.main),
+    ).to_frame()
+    daily = decode_table(
+        table_html(22, [daily_row(d) for d in range(1, 32)]),
+        layout_for(RecordInterval.one_day, LocationColumnType.main),
+    ).to_frame()
+    hour_src = src(date(2022, 1, 5), every_xx="every_1_hour")
+    day_src = src(date(2022, 1, 1), every_xx="every_1_days")
+    hour_path, day_path = write_parquet_days(
+        [(hour_src, hourly), (day_src, daily)], root=tmp_path
+    )
+
+    hours = pq.read_table(hour_path)
+    assert hours.schema.field("天気").type == pa.string()
+    assert hours.schema.field("時").type == pa.int16()
+    assert hours["時"].to_pylist() == list(range(1, 25))
+    assert set(hours["天気"].to_pylist()) == {"晴れ"}
+    assert set(hours["date"].to_pylist()) == {date(2022, 1, 5)}
+
+    days = pq.read_table(day_path)
+    assert "日" not in days.column_names
+    assert days.schema.field("天気概況_夜").type == pa.string()
+    assert days["date"].to_pylist() == [date(2022, 1, d) for d in range(1, 32)]
+
+
+def test_backfill_writes_through_the_batch_writer(tmp_path, hamamatsu_html):
+    writer = ParquetBatchWriter(tmp_path, batch_pages=2)
+    results = asyncio.run(
+        backfill(
+            TARGETS[:1],
+            date(2022, 12, 30),
+            date(2023, 1, 2),
+            fetcher=FakeFetcher(hamamatsu_html),
+            writer_factory=writer,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    assert all(r.ok for r in results)
+    assert isinstance(writer(src(date(2023, 1, 1))), DfLocalParquetWriter)
+    for year in (2022, 2023):
+        path = partition_dir(tmp_path, src(date(year, 1, 1))) / "data.parquet"
+        assert pq.read_metadata(path).num_rows == 144 * 2
@@ -0,0 +1,205 @@
+import shutil
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from jma_scraper.core.aggregation import (
+    COUNT_COLUMN,
+    GUST,
+    GUST_DIRECTION,
+    RAIN,
+    RAIN_1HOUR_MAX,
+    RAIN_DAY_MAX,
+    SUNSHINE,
+    TEMPERATURE,
+    TEMPERATURE_MAX,
+    TEMPERATURE_MAX_MEAN,
+    TEMPERATURE_MIN,
+    WIND_MODE_DIRECTION,
+    Level,
+    aggregate_10minutes,
+    aggregate_daily,
+)
+from jma_scraper.infrastracture.pyramid import (
+    DfLocalParquetPyramidWriter,
+    pyramid_path,
+    read_pyramid,
+    rebuild_pyramid,
+    update_pyramid,
+    write_parquet_days_with_pyramid,
+)
+from jma_scraper.usecase.sync import CoverageIndex
+from tests.helpers import src
+
+HOUR_MINUTES = [f"{m // 60:02}:{m % 60:02}" for m in range(10, 1441, 10)]
+
+
+def ten_minutes(days, **values) -> pd.DataFrame:
+    """days の日数分の10分ごとの値. values は列名と1日分 (144個) の値"""
+    n = len(days)
+    columns = {"date": np.repeat(days, 144), "時分": HOUR_MINUTES * n}
+    for name, day_values in values.items():
+        columns[name] = list(day_values) * n
+    return pd.DataFrame(columns)
+
+
+def test_daily_values_follow_jma():
+    temperature = np.linspace(0.0, 14.3, 144)
+    gust = np.zeros(144)
+    gust[50] = 20.0
+    directions = ["北"] * 100 + ["南"] * 44
+    directions[50] = "西"
+    df = ten_minutes(
+        [date(2022, 1, 1)],
+        **{
+            "降水量(mm)": [0.5] * 144,
+            "気温(ºC)": temperature,
+            "最大瞬間_風速(m/s)": gust,
+            "最大瞬間_風向": directions,
+            "平均_風向": directions,
+            "日照時間(min)": [10.0] * 72 + [0.0] * 72,
+        },
+    )
+    [daily] = aggregate_10minutes(df, Level.daily).to_dict("records")
+    assert daily[COUNT_COLUMN] == 144
+    assert daily[RAIN] == pytest.approx(72.0)
+    assert daily[RAIN_1HOUR_MAX] == pytest.approx(3.0)
+    # 日平均気温は毎正時 (01:00 … 24:00) の24回の平均
+    assert daily[TEMPERATURE] == pytest.approx(temperature[5::6].mean())
+    assert (daily[TEMPERATURE_MAX], daily[TEMPERATURE_MIN]) == pytest.approx((14.3, 0))
+    assert (daily[GUST], daily[GUST_DIRECTION]) == (20.0, "西")
+    assert daily[WIND_MODE_DIRECTION] == "北"
+    assert daily[SUNSHINE] == pytest.approx(12.0)
+
+
+def test_hours_end_on_the_hour():
+    df = ten_minutes(
+        [date(2022, 1, 1)], **{"降水量(mm)": range(144), "気温(ºC)": range(144)}
+    )
+    hourly = aggregate_10minutes(df, Level.hourly)
+    # 1時間ごとの気温は H:00 の値
+    assert hourly[TEMPERATURE].tolist() == list(range(5, 144, 6))
+    assert hourly["時"].tolist() == list(range(1, 25))
+    # 1時は 00:10 から 01:00 まで, 24時は 23:10 から 24:00 まで
+    assert hourly[RAIN].iloc[0] == sum(range(6))
+    assert hourly[RAIN].iloc[-1] == sum(range(138, 144))
+    assert (hourly["date"] == date(2022, 1, 1)).all()
+
+
+def test_hourly_rain_max_uses_the_previous_day():
+    rain = [0.0] * 144
+    rain[-1] = 5.0  # 1日の 24:00
+    df = ten_minutes([date(2022, 1, 1), date(2022, 1, 2)], **{"降水量(mm)": rain})
+    df.loc[144:, "降水量(mm)"] = 0.0
+    df.loc[144, "降水量(mm)"] = 1.0  # 2日の 00:10
+    daily = aggregate_10minutes(df, Level.daily)
+    # 2日の 00:10 までの1時間には1日の 24:00 の5mmが入る
+    assert daily[RAIN_1HOUR_MAX].tolist() == [5.0, 6.0]
+    assert daily[RAIN].tolist() == [5.0, 1.0]
+
+
+def test_monthly_values_are_made_from_daily_values():
+    days = [date(2022, 1, 1) + timedelta(days=i) for i in range(31)] + [
+        date(2022, 2, 1)
+    ]
+    df = pd.concat(
+        [
+            ten_minutes(
+                [day],
+                **{"降水量(mm)": [day.day / 144] * 144, "気温(ºC)": [day.day] * 144},
+            )
+            for day in days
+        ],
+        ignore_index=True,
+    )
+    monthly = aggregate_daily(aggregate_10minutes(df, Level.daily))
+    assert monthly["date"].tolist() == [date(2022, 1, 1), date(2022, 2, 1)]
+    january = monthly.iloc[0]
+    assert january[COUNT_COLUMN] == 144 * 31
+    assert january[RAIN] == pytest.approx(sum(range(1, 32)), rel=1e-5)
+    assert january[RAIN_DAY_MAX] == pytest.approx(31.0)
+    assert january[TEMPERATURE] == pytest.approx(16.0)
+    assert january[TEMPERATURE_MAX_MEAN] == pytest.approx(16.0)
+    assert january[TEMPERATURE_MAX] == 31.0
+
+
+def test_writer_keeps_the_pyramid_up_to_date(tmp_path, formatted_df):
+    for day in (date(2023, 1, 1), date(2023, 1, 2)):
+        DfLocalParquetPyramidWriter(src(day), root=tmp_path).write(formatted_df.copy())
+    monthly = read_pyramid(
+        "hamamatsu", Level.monthly, date(2023, 1, 1), date(2023, 1, 1), tmp_path
+    )
+    assert monthly[COUNT_COLUMN].tolist() == [144 * 2]
+
+    # 同じ日を書き直しても行は増えない
+    DfLocalParquetPyramidWriter(src(date(2023, 1, 2)), root=tmp_path).write(
+        formatted_df.copy()
+    )
+    daily = read_pyramid(
+        "hamamatsu", "daily", date(2023, 1, 1), date(2023, 1, 31), tmp_path
+    )
+    assert daily["date"].tolist() == [date(2023, 1, 1), date(2023, 1, 2)]
+    hourly = read_pyramid(
+        "hamamatsu", "hourly", date(2023, 1, 2), date(2023, 1, 2), tmp_path
+    )
+    assert len(hourly) == 24
+
+
+def test_coarse_reads_do_not_touch_raw_rows(tmp_path, formatted_df):
+    days = [date(2022, 12, 31), date(2023, 1, 1)]
+    write_parquet_days_with_pyramid(
+        [(src(d), formatted_df.copy()) for d in days], tmp_path
+    )
+    shutil.rmtree(tmp_path / "station=hamamatsu" / "interval=every_10_minutes")
+
+    daily = read_pyramid(
+        "hamamatsu", Level.daily, days[0], days[1], tmp_path, columns=[RAIN]
+    )
+    assert daily.columns.tolist() == ["date", RAIN]
+    assert daily["date"].tolist() == days
+    monthly = read_pyramid(
+        "hamamatsu", Level.monthly, date(2022, 1, 1), date(2023, 12, 1), tmp_path
+    )
+    assert monthly["date"].tolist() == [date(2022, 12, 1), date(2023, 1, 1)]
+
+
+def test_rebuild_and_missing_days(tmp_path, formatted_df):
+    write_parquet_days_with_pyramid(
+        [(src(date(2023, 3, 1)), formatted_df.copy())], tmp_path
+    )
+    shutil.rmtree(tmp_path / "station=hamamatsu" / "pyramid=daily")
+    written = rebuild_pyramid("hamamatsu", tmp_path)
+    assert pyramid_path(tmp_path, "hamamatsu", Level.daily, 2023) in written
+    # 10分ごとの値のない日を更新しても何も作らない
+    update_pyramid("hamamatsu", [date(2023, 3, 5)], tmp_path)
+    daily = read_pyramid(
+        "hamamatsu", Level.daily, date(2023, 3, 1), date(2023, 3, 31), tmp_path
+    )
+    assert daily["date"].tolist() == [date(2023, 3, 1)]
+    # ピラミッドは取得済みの日の一覧には入らない
+    coverage = CoverageIndex().add_parquet_dataset(tmp_path)
+    assert coverage.covered("hamamatsu", "every_10_minutes", date(2023, 3, 1))
+    assert len(coverage) == 1
+
+
+def test_writing_the_previous_day_updates_the_next_day(tmp_path):
+    rain = [0.0] * 144
+    rain[-1] = 25.0  # 1日の 24:00
+    first = ten_minutes([date(2022, 1, 1)], **{"降水量(mm)": rain})
+    second = ten_minutes([date(2022, 1, 2)], **{"降水量(mm)": [0.0] + [1.0] + [0.0] * 142})
+    # バックフィルは新しい日から書き込む
+    for day, df in ((date(2022, 1, 2), second), (date(2022, 1, 1), first)):
+        write_parquet_days_with_pyramid([(src(day), df.drop(columns="date"))], tmp_path)
+
+    def pyramid(level):
+        return read_pyramid(
+            "hamamatsu", level, date(2022, 1, 1), date(2022, 1, 31), tmp_path
+        )
+
+    incremental = {level: pyramid(level) for level in Level}
+    assert incremental[Level.daily][RAIN_1HOUR_MAX].tolist() == [25.0, 26.0]
+    rebuild_pyramid("hamamatsu", tmp_path)
+    for level in Level:
+        pd.testing.assert_frame_equal(incremental[level], pyramid(level))
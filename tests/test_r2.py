@@ -0,0 +1,144 @@
+import gzip
+import io
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+import pytest
+import zstandard
+from sqlmodel import select
+
+from jma_scraper.core.html_to_dataframe import flatten_columns, format_columns
+from jma_scraper.core.location_instances import HAMAMATSU_10Minutes_COLUMNS
+from jma_scraper.core.repository import WriterSrcValues
+from jma_scraper.infrastracture.db_tables import R2UploadFailed, R2UploadSucceeded
+from jma_scraper.infrastracture.r2 import (
+    DfR2Writer,
+    R2BulkUploader,
+    R2Conf,
+    R2ObjectFormat,
+)
+from jma_scraper.usecase.hamamatsu.write_scenario_r2 import write_many_from_local_to_r2
+
+R2_CONF = R2Conf(
+    ACCOUNT_ID="0" * 32,
+    AWS_ACCESS_KEY_ID="a" * 32,
+    AWS_ACCESS_KEY_SECRET="b" * 64,
+    BUCKET_NAME="jma-test",
+    ENDPOINT_URL="http://localhost:9000",
+)
+
+
+class FakeS3Client:
+    """upload_file だけを持つ S3互換のスタンドイン"""
+
+    def __init__(self, fail_keys=()):
+        self.fail_keys = set(fail_keys)
+        self.objects = {}
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def upload_file(self, filename, bucket, key, Config=None):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        if key in self.fail_keys:
+            raise ConnectionError(f"failed to upload {key}")
+        self.objects[(bucket, key)] = Path(filename).read_bytes()
+
+
+@pytest.fixture
+def csv_files(tmp_path):
+    paths = []
+    for day in range(1, 21):
+        path = tmp_path / f"2022-01-{day:02}__hamamatsu__every_10_minutes.csv"
+        path.write_text(f"day,{day}\n")
+        paths.append(path)
+    return paths
+
+
+def test_client_is_cached_and_uses_endpoint_override():
+    assert R2_CONF.client() is R2_CONF.client()
+    assert R2_CONF.client().meta.endpoint_url == "http://localhost:9000"
+    assert R2_CONF.create_dst_url("a.csv") == "http://localhost:9000/jma-test/a.csv"
+
+
+def test_bulk_upload_runs_concurrently(csv_files):
+    client = FakeS3Client()
+    results = R2BulkUploader(R2_CONF, max_workers=8, client=client).upload(
+        (path, f"jma_csv/{path.name}") for path in csv_files
+    )
+
+    assert all(r.ok for r in results)
+    assert [r.src for r in results] == csv_files
+    assert 1 < client.max_in_flight <= 8
+    assert client.objects[("jma-test", f"jma_csv/{csv_files[0].name}")] == b"day,1\n"
+
+
+def test_bulk_upload_records_results_in_one_batch(csv_files, session):
+    failed_key = f"__data__/jma_csv/{csv_files[3].name}"
+    uploader = R2BulkUploader(R2_CONF, client=FakeS3Client(fail_keys=[failed_key]))
+
+    results = write_many_from_local_to_r2(
+        csv_files, R2_CONF, session=session, uploader=uploader
+    )
+
+    assert len([r for r in results if not r.ok]) == 1
+    assert len(session.exec(select(R2UploadSucceeded)).all()) == 19
+    failed = session.exec(select(R2UploadFailed)).one()
+    assert failed.url.endswith(failed_key)
+    assert "failed to upload" in failed.message
+
+
+class FakeStreamingS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        self.objects[(bucket, key)] = (fileobj.read(), ExtraArgs)
+
+
+@pytest.mark.parametrize(
+    "fmt, decode",
+    [
+        (R2ObjectFormat.csv, lambda body: pd.read_csv(io.BytesIO(body))),
+        (
+            R2ObjectFormat.csv_gzip,
+            lambda body: pd.read_csv(io.BytesIO(gzip.decompress(body))),
+        ),
+        (
+            R2ObjectFormat.csv_zstd,
+            lambda body: pd.read_csv(
+                io.BytesIO(zstandard.ZstdDecompressor().decompress(body))
+            ),
+        ),
+        (R2ObjectFormat.parquet, lambda body: pd.read_parquet(io.BytesIO(body))),
+    ],
+)
+def test_df_r2_writer_streams_without_local_file(
+    fmt, decode, raw_df, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    df = format_columns(
+        flatten_columns(raw_df), HAMAMATSU_10Minutes_COLUMNS.after_columns
+    )
+    src_values = WriterSrcValues(
+        date=date(2023, 1, 1), location_name="hamamatsu", every_xx="every_10_minutes"
+    )
+    client = FakeStreamingS3Client()
+    writer = DfR2Writer(src_values, R2_CONF, fmt=fmt, client=client)
+
+    writer.write(df)
+
+    body, extra_args = client.objects[("jma-test", writer.create_dst_key())]
+    assert writer.create_dst_key().endswith(f".{fmt}")
+    assert "ContentType" in extra_args
+    restored = decode(body)
+    assert len(restored) == len(df) == 144
+    assert list(tmp_path.iterdir()) == []
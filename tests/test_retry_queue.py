@@ -0,0 +1,148 @@
+import asyncio
+import random
+from datetime import date, datetime, timedelta
+
+import httpx
+import pytest
+
+from jma_scraper.core.errors import LayoutMismatchError, PageUrlError
+from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.infrastracture.db_tables import FetchFailed, RetryStatus
+from jma_scraper.usecase.backfill import PolitenessBudget
+from jma_scraper.usecase.retry_queue import (
+    RetryPolicy,
+    RetryQueue,
+    classify_error,
+    drain,
+)
+from tests.helpers import TARGETS, FakeFetcher, ListWriter
+
+NOW = datetime(2023, 1, 1, 12, 0, 0)
+
+
+def url_of(target, date_) -> str:
+    return str(
+        QueryParamsForJma.from_location_spec(
+            target.location, date_, target.record_interval
+        ).query_url
+    )
+
+
+def status_error(status_code: int, headers=None) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://example.com")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return httpx.HTTPStatusError("error", request=request, response=response)
+
+
+@pytest.fixture
+def queue(session) -> RetryQueue:
+    return RetryQueue(session, RetryPolicy(base_delay_sec=60), rng=random.Random(0))
+
+
+@pytest.mark.parametrize(
+    "exc, permanent, retry_after",
+    [
+        (status_error(404), True, None),
+        (status_error(503, {"Retry-After": "120"}), False, 120.0),
+        (status_error(429), False, None),
+        (httpx.ReadTimeout("timeout"), False, None),
+        (LayoutMismatchError("The layout may be different."), True, None),
+        (PageUrlError("Column type should be in the one of ..."), True, None),
+        # メンテナンス中のページなど
+        (ValueError("The content type should be text/html, got None"), False, None),
+        (ValueError("The HTML content should contain 'id=tablefix1'"), False, None),
+        (RuntimeError("unknown"), False, None),
+    ],
+)
+def test_classify_error(exc, permanent, retry_after):
+    assert classify_error(exc) == (permanent, retry_after)
+
+
+def test_backoff_grows_and_respects_retry_after(queue):
+    url = url_of(TARGETS[0], date(2022, 1, 1))
+    delays = []
+    for _ in range(4):
+        job = queue.enqueue(url, "timeout", httpx.ReadTimeout("timeout"), now=NOW)
+        delays.append((job.next_attempt_at - NOW).total_seconds())
+    assert job.attempts == 4
+    assert all(0 <= d <= 60 * 2**i for i, d in enumerate(delays))
+
+    job = queue.enqueue(
+        url, "busy", status_error(503, {"Retry-After": "3600"}), now=NOW
+    )
+    assert job.next_attempt_at - NOW >= timedelta(seconds=3600)
+    assert job.status == RetryStatus.pending
+
+
+def test_permanent_error_and_max_attempts_are_dead(session):
+    queue = RetryQueue(session, RetryPolicy(max_attempts=2))
+    url_1 = url_of(TARGETS[0], date(2022, 1, 1))
+    url_2 = url_of(TARGETS[0], date(2022, 1, 2))
+
+    assert queue.enqueue(url_1, "not found", status_error(404)).status == "dead"
+    queue.enqueue(url_2, "timeout")
+    assert queue.enqueue(url_2, "timeout").status == RetryStatus.dead
+    assert queue.due(datetime.now() + timedelta(days=1)) == []
+
+
+def test_import_fetch_failed_once(queue, session):
+    url = url_of(TARGETS[0], date(2022, 1, 1))
+    session.add(FetchFailed(url=url, message="timeout"))
+    session.add(FetchFailed(url=url, message="timeout again"))
+    session.commit()
+
+    assert queue.import_fetch_failed(NOW) == 1
+    assert queue.import_fetch_failed(NOW) == 0
+    assert [job.url for job in queue.due(NOW)] == [url]
+
+
+def test_drain_retries_only_due_jobs_and_resolves(queue, hamamatsu_html):
+    due_url = url_of(TARGETS[0], date(2022, 1, 1))
+    later_url = url_of(TARGETS[0], date(2022, 1, 2))
+    other_station_url = url_of(TARGETS[1], date(2022, 1, 1))
+    queue.enqueue(due_url, "timeout", now=NOW - timedelta(days=1))
+    queue.enqueue(later_url, "timeout", now=NOW + timedelta(days=1))
+    queue.enqueue(other_station_url, "timeout", now=NOW - timedelta(days=1))
+
+    fetcher = FakeFetcher(hamamatsu_html)
+    results = asyncio.run(
+        drain(
+            queue,
+            TARGETS[:1],
+            fetcher=fetcher,
+            writer_factory=ListWriter,
+            budget=PolitenessBudget(0.0),
+            now=NOW,
+        )
+    )
+
+    assert [r.date for r in results] == [date(2022, 1, 1)]
+    assert [str(qp.query_url) for qp in fetcher.fetched] == [due_url]
+    job = queue.get(due_url)
+    assert job.status == RetryStatus.resolved
+    assert job.resolved_at == NOW
+    assert queue.get(later_url).status == RetryStatus.pending
+    assert queue.get(other_station_url).status == RetryStatus.pending
+
+
+def test_drain_reschedules_transient_failures(queue, hamamatsu_html):
+    url = url_of(TARGETS[0], date(2022, 1, 1))
+    queue.enqueue(url, "timeout", now=NOW - timedelta(days=1))
+
+    fetcher = FakeFetcher(hamamatsu_html, fail_dates=[date(2022, 1, 1)])
+    asyncio.run(
+        drain(
+            queue,
+            TARGETS[:1],
+            fetcher=fetcher,
+            writer_factory=ListWriter,
+            budget=PolitenessBudget(0.0),
+            now=NOW,
+        )
+    )
+    job = queue.get(url)
+    assert job.attempts == 2
+    # FakeFetcher の ValueError はレイアウトやURLのエラーではないので再試行する
+    assert job.status == RetryStatus.pending
+    assert not job.permanent
+    assert job.next_attempt_at > NOW
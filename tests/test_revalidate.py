@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+from datetime import date, datetime
+from typing import List, Optional
+
+import httpx
+import pytest
+from sqlmodel import select
+
+from jma_scraper.core.repository import ConditionalFetcher, ConditionalPage
+from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.infrastracture.db_tables import PageRevision
+from jma_scraper.infrastracture.http_client import AsyncJmaHttpClient
+from jma_scraper.usecase.backfill import PolitenessBudget
+from jma_scraper.usecase.revalidate import (
+    RevisionIndex,
+    RevisionStatus,
+    plan_revalidation,
+    revalidate,
+    table_digest,
+)
+from tests.helpers import TARGETS, FakeFetcher, ListWriter
+
+TODAY = date(2022, 1, 10)
+
+
+class EtagFetcher:
+    """本文のハッシュを ETag として返し, If-None-Match が一致すれば 304 にする"""
+
+    def __init__(self, html: str):
+        self.html = html
+        self.not_modified = 0
+
+    def etag(self) -> str:
+        return '"' + hashlib.sha256(self.html.encode()).hexdigest()[:16] + '"'
+
+    async def __call__(self, query_param: QueryParamsForJma, time_out_sec=2.0) -> str:
+        return self.html
+
+    async def fetch_if_modified(
+        self,
+        query_param: QueryParamsForJma,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        time_out_sec: float = 2.0,
+    ) -> ConditionalPage:
+        if etag == self.etag():
+            self.not_modified += 1
+            return ConditionalPage(None, etag=etag)
+        return ConditionalPage(self.html, etag=self.etag())
+
+
+class BrokenWriter(ListWriter):
+    def write(self, src, dst=None) -> None:
+        raise OSError("disk full")
+
+
+def run(fetcher, session, writer=ListWriter, days=2, targets=TARGETS[:1]):
+    return asyncio.run(
+        revalidate(
+            targets,
+            fetcher,
+            writer,
+            RevisionIndex(session),
+            days=days,
+            today=TODAY,
+            budget=PolitenessBudget(0.0),
+            now=datetime(2022, 1, 10, 12),
+        )
+    )
+
+
+def statuses(results) -> List[RevisionStatus]:
+    return sorted(r.status for r in results)
+
+
+def edited(html: str) -> str:
+    return html.replace("1017.2</td>", "1017.3</td>", 1)
+
+
+def test_table_digest_ignores_the_outside_of_the_table(hamamatsu_html):
+    assert table_digest(hamamatsu_html) == table_digest(
+        hamamatsu_html.replace("</body>", "<p>ad</p></body>")
+    )
+    assert table_digest(hamamatsu_html) != table_digest(edited(hamamatsu_html))
+
+
+def test_plan_revalidation_counts_today():
+    pages = plan_revalidation(TARGETS[:1], 3, TODAY)
+    assert [d.day for d, _ in pages] == [10, 9, 8]
+    with pytest.raises(ValueError):
+        plan_revalidation(TARGETS, 0, TODAY)
+
+
+def test_first_run_writes_every_page(hamamatsu_html, session):
+    results = run(FakeFetcher(hamamatsu_html), session, targets=TARGETS)
+    assert statuses(results) == [RevisionStatus.changed] * 4
+    assert len(ListWriter.written) == 4
+    assert len(session.exec(select(PageRevision)).all()) == 4
+
+
+def test_same_table_is_not_parsed_again(hamamatsu_html, session):
+    run(FakeFetcher(hamamatsu_html), session)
+    ListWriter.written = []
+    fetcher = FakeFetcher(hamamatsu_html.replace("</body>", "<p>ad</p></body>"))
+    results = run(fetcher, session)
+    assert statuses(results) == [RevisionStatus.unchanged] * 2
+    assert len(fetcher.fetched) == 2
+    assert ListWriter.written == []
+
+
+def test_changed_table_is_written_again(hamamatsu_html, session):
+    run(FakeFetcher(hamamatsu_html), session)
+    ListWriter.written = []
+    results = run(FakeFetcher(edited(hamamatsu_html)), session)
+    assert statuses(results) == [RevisionStatus.changed] * 2
+    assert len(ListWriter.written) == 2
+    revision = session.exec(select(PageRevision)).first()
+    assert revision.table_digest == table_digest(edited(hamamatsu_html))
+
+
+def test_conditional_fetcher_skips_the_body(hamamatsu_html, session):
+    fetcher = EtagFetcher(hamamatsu_html)
+    assert isinstance(fetcher, ConditionalFetcher)
+    assert not isinstance(FakeFetcher(hamamatsu_html), ConditionalFetcher)
+    run(fetcher, session)
+    assert fetcher.not_modified == 0  # 初回は送る検証子がない
+    ListWriter.written = []
+    results = run(fetcher, session)
+    assert statuses(results) == [RevisionStatus.not_modified] * 2
+    assert fetcher.not_modified == 2
+    assert ListWriter.written == []
+
+
+def test_failed_write_is_retried_next_time(hamamatsu_html, session):
+    results = run(FakeFetcher(hamamatsu_html), session, writer=BrokenWriter)
+    assert statuses(results) == [RevisionStatus.failed] * 2
+    assert session.exec(select(PageRevision)).all() == []
+    results = run(FakeFetcher(hamamatsu_html), session)
+    assert statuses(results) == [RevisionStatus.changed] * 2
+
+
+def test_failed_fetch_is_reported(hamamatsu_html, session):
+    fetcher = FakeFetcher(hamamatsu_html, fail_dates=[TODAY])
+    results = run(fetcher, session)
+    assert {(r.date, r.status) for r in results} == {
+        (TODAY, RevisionStatus.failed),
+        (date(2022, 1, 9), RevisionStatus.changed),
+    }
+
+
+def test_http_client_sends_validators(hamamatsu_html, hamamatsu_qp_every_10_minuets):
+    requests: List[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+        return httpx.Response(
+            200,
+            content=hamamatsu_html.encode(),
+            headers={
+                "content-type": "text/html",
+                "ETag": '"v1"',
+                "Last-Modified": "Mon, 10 Jan 2022 00:00:00 GMT",
+            },
+        )
+
+    async def fetch_twice():
+        async with AsyncJmaHttpClient(transport=httpx.MockTransport(handler)) as client:
+            assert isinstance(client, ConditionalFetcher)
+            first = await client.fetch_if_modified(hamamatsu_qp_every_10_minuets)
+            second = await client.fetch_if_modified(
+                hamamatsu_qp_every_10_minuets, first.etag, first.last_modified
+            )
+            return first, second
+
+    first, second = asyncio.run(fetch_twice())
+    assert first.html_text == hamamatsu_html and not first.not_modified
+    assert second.not_modified
+    assert second.last_modified == "Mon, 10 Jan 2022 00:00:00 GMT"
+    assert "If-None-Match" not in requests[0].headers
+    assert requests[1].headers["If-Modified-Since"] == first.last_modified
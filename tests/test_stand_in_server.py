@@ -0,0 +1,111 @@
+from datetime import date
+
+import httpx
+import pytest
+
+from benchmarks.load import run_load_test
+from benchmarks.stand_in_server import FaultConfig, JmaStandInServer
+from jma_scraper.core.html_to_dataframe import parse_html_to_df
+from jma_scraper.core.location_instances import HAMAMATSU_10Minutes_COLUMNS
+from jma_scraper.core.location_spec import LocationColumnType, RecordInterval
+from jma_scraper.core.table_decoder import decode_table, layout_for
+from jma_scraper.core.url_formatter import QueryParamsForJma
+from jma_scraper.infrastracture.http_client import JmaHttpClient
+
+
+def query_param(
+    record_interval: RecordInterval = RecordInterval.ten_minutes,
+    col_type: LocationColumnType = LocationColumnType.main,
+    date_: date = date(2022, 1, 15),
+) -> QueryParamsForJma:
+    return QueryParamsForJma(
+        date=record_interval.page_date(date_),
+        prefecture_no=50,
+        block_no=47654,
+        record_interval=record_interval,
+        location_col_type=col_type,
+    )
+
+
+def test_ten_minutes_page_is_parseable():
+    with JmaStandInServer() as server, JmaHttpClient(
+        base_url=server.base_url
+    ) as client:
+        html = client(query_param())
+    df = parse_html_to_df(html, HAMAMATSU_10Minutes_COLUMNS.after_columns)
+    assert len(df) == 144
+    assert server.requests == 1
+
+
+@pytest.mark.parametrize(
+    "record_interval, col_type, rows",
+    [
+        (RecordInterval.ten_minutes, LocationColumnType.few, 144),
+        (RecordInterval.one_hour, LocationColumnType.main, 24),
+        (RecordInterval.one_day, LocationColumnType.main, 31),
+        (RecordInterval.ten_day_divide_for_each_mont, LocationColumnType.main, 36),
+        (RecordInterval.five_day_divide_for_each_month, LocationColumnType.few, 72),
+    ],
+)
+def test_layout_pages_are_decodable(record_interval, col_type, rows):
+    with JmaStandInServer() as server, JmaHttpClient(
+        base_url=server.base_url
+    ) as client:
+        html = client(query_param(record_interval, col_type))
+    layout = layout_for(record_interval, col_type)
+    df = decode_table(html, layout).to_frame()
+    assert len(df) == rows
+    assert list(df.columns) == list(layout.columns)
+
+
+def test_unknown_route_is_not_found():
+    with JmaStandInServer() as server:
+        response = httpx.get(f"{server.base_url}/obd/stats/etrn/view/unknown.php")
+    assert response.status_code == 404
+
+
+def test_error_rate_returns_503():
+    with JmaStandInServer(FaultConfig(error_rate=1.0)) as server, JmaHttpClient(
+        base_url=server.base_url
+    ) as client:
+        with pytest.raises(httpx.HTTPStatusError) as exc_info:
+            client(query_param())
+    assert exc_info.value.response.status_code == 503
+
+
+def test_wrong_content_type_is_rejected():
+    with JmaStandInServer(
+        FaultConfig(wrong_content_type_rate=1.0)
+    ) as server, JmaHttpClient(base_url=server.base_url) as client:
+        with pytest.raises(ValueError, match="text/plain"):
+            client(query_param())
+
+
+def test_rate_limit_returns_429_with_retry_after():
+    with JmaStandInServer(FaultConfig(rate_limit_per_sec=1.0)) as server:
+        url = str(query_param().query_url).replace(
+            "https://www.data.jma.go.jp", server.base_url
+        )
+        first = httpx.get(url)
+        second = httpx.get(url)
+    assert first.status_code == 200
+    assert second.status_code == 429
+    assert second.headers["Retry-After"] == "1"
+
+
+def test_timeout_rate_makes_the_client_time_out():
+    with JmaStandInServer(
+        FaultConfig(timeout_rate=1.0, timeout_sec=0.5)
+    ) as server, JmaHttpClient(base_url=server.base_url) as client:
+        with pytest.raises(httpx.TimeoutException):
+            client(query_param(), time_out_sec=0.1)
+
+
+def test_load_test_reports_throughput_and_errors():
+    with JmaStandInServer(FaultConfig(error_rate=0.5, seed=1)) as server:
+        report = run_load_test(server.base_url, days=6, concurrency=3)
+    assert report.requests == 6
+    assert 0 < report.ok < 6
+    assert report.errors == {"HTTPStatusError": 6 - report.ok}
+    assert report.per_sec > 0
+    assert report.latency_ms["p50"] <= report.latency_ms["p99"]
@@ -0,0 +1,159 @@
+import asyncio
+from datetime import date, datetime
+
+from jma_scraper.core.location_instances import HAMAMATSU
+from jma_scraper.core.location_spec import RecordInterval
+from jma_scraper.core.repository import WriterSrcValues
+from jma_scraper.infrastracture.db_tables import LocalFileSaved
+from jma_scraper.infrastracture.parquet import ParquetBatchWriter, write_parquet_days
+from jma_scraper.usecase.backfill import BackfillTarget, PolitenessBudget
+from jma_scraper.usecase.sync import CoverageIndex, plan_sync, sync
+from tests.helpers import TARGETS, FakeFetcher, ListWriter, daily_row, table_html
+
+TODAY = date(2023, 1, 1)
+
+
+def test_coverage_from_csv_names(tmp_path):
+    for name in [
+        "2022-01-01__hamamatsu__every_10_minutes.csv",
+        "2022-01-03__hamamatsu__every_10_minutes.csv",
+        "2022-01-02__shizuoka__every_10_minutes.csv",
+        "not_a_jma_file.csv",
+    ]:
+        (tmp_path / name).touch()
+    coverage = CoverageIndex().add_csv_dir(tmp_path)
+
+    assert len(coverage) == 3
+    days = [date(2022, 1, d) for d in range(1, 5)]
+    assert coverage.missing("hamamatsu", "every_10_minutes", days) == [
+        date(2022, 1, 2),
+        date(2022, 1, 4),
+    ]
+    assert coverage.missing("hamamatsu", "every_1_hour", days) == days
+
+
+def test_coverage_from_local_file_saved(session):
+    session.add(
+        LocalFileSaved(file_path="/x/2022-01-05__hamamatsu__every_10_minutes.csv")
+    )
+    session.commit()
+    coverage = CoverageIndex().add_local_file_saved(session)
+    assert coverage.covered("hamamatsu", "every_10_minutes", date(2022, 1, 5))
+
+
+def test_coverage_from_parquet_dataset(tmp_path, hamamatsu_html):
+    df = TARGETS[0].parse(hamamatsu_html)
+    frames = [
+        (
+            WriterSrcValues(
+                date=date(2021, 12, d),
+                location_name="hamamatsu",
+                every_xx="every_10_minutes",
+            ),
+            df,
+        )
+        for d in (30, 31)
+    ]
+    write_parquet_days(frames, root=tmp_path)
+
+    coverage = CoverageIndex().add_parquet_dataset(tmp_path)
+    assert coverage.covered("hamamatsu", "every_10_minutes", date(2021, 12, 31))
+    assert not coverage.covered("hamamatsu", "every_10_minutes", date(2022, 1, 1))
+
+
+def test_plan_sync_skips_covered_pages_but_refetches_current_page():
+    coverage = CoverageIndex()
+    coverage.mark_many(
+        "hamamatsu", "every_10_minutes", [date(2022, 12, d) for d in range(1, 32)]
+    )
+    coverage.mark("hamamatsu", "every_10_minutes", TODAY)
+
+    planned = plan_sync(TARGETS[:1], date(2022, 11, 30), TODAY, coverage, today=TODAY)
+    assert [page_date for page_date, _ in planned] == [TODAY, date(2022, 11, 30)]
+
+    daily = BackfillTarget(TARGETS[0].location, record_interval=RecordInterval.one_day)
+    coverage.mark("hamamatsu", "every_1_days", date(2022, 11, 1))
+    planned = plan_sync([daily], date(2022, 11, 5), date(2022, 12, 5), coverage, TODAY)
+    assert [page_date for page_date, _ in planned] == [date(2022, 12, 1)]
+
+
+def test_sync_twice_makes_no_redundant_requests(hamamatsu_html):
+    fetcher = FakeFetcher(hamamatsu_html, fail_dates=[date(2022, 1, 2)])
+    coverage = CoverageIndex()
+
+    def run():
+        return asyncio.run(
+            sync(
+                TARGETS,
+                date(2022, 1, 1),
+                date(2022, 1, 3),
+                fetcher=fetcher,
+                writer_factory=ListWriter,
+                coverage=coverage,
+                budget=PolitenessBudget(0.0),
+                today=TODAY,
+            )
+        )
+
+    first = run()
+    assert len(first) == 6
+    assert len([r for r in first if not r.ok]) == 2
+
+    fetcher.fail_dates.clear()
+    second = run()
+    # 失敗した日だけを取り直す
+    assert sorted((r.target.location.en_name, r.date) for r in second) == [
+        ("hamamatsu", date(2022, 1, 2)),
+        ("shizuoka", date(2022, 1, 2)),
+    ]
+    assert run() == []
+    assert len(fetcher.fetched) == 8
+
+
+def test_page_saved_while_current_is_fetched_again(tmp_path, session):
+    daily = BackfillTarget(HAMAMATSU, record_interval=RecordInterval.one_day)
+    every_xx = daily.record_interval.to_literal()
+    december = table_html(22, [daily_row(d) for d in range(1, 16)])
+    november = table_html(22, [daily_row(d) for d in range(1, 31)])
+
+    async def fetcher(query_param, time_out_sec=2.0):
+        return november if query_param.date.month == 11 else december
+
+    coverage = CoverageIndex()
+    results = asyncio.run(
+        sync(
+            [daily],
+            date(2022, 11, 1),
+            date(2022, 12, 15),
+            fetcher=fetcher,
+            writer_factory=ParquetBatchWriter(tmp_path),
+            coverage=coverage,
+            budget=PolitenessBudget(0.0),
+            today=date(2022, 12, 15),
+        )
+    )
+    assert all(r.ok for r in results)
+    session.add(
+        LocalFileSaved(
+            file_path=f"/x/2022-12-01__hamamatsu__{every_xx}.csv",
+            recorded_at=datetime(2022, 12, 15, 12),
+        )
+    )
+    session.commit()
+
+    # 12月のページは途中までしかないので, 年が変わってから残りを取り直す
+    for index in (
+        coverage,
+        CoverageIndex().add_parquet_dataset(tmp_path),
+        CoverageIndex().add_local_file_saved(session),
+    ):
+        planned = plan_sync(
+            [daily], date(2022, 11, 1), date(2023, 1, 2), index, date(2023, 1, 2)
+        )
+        assert date(2022, 12, 1) in [page_date for page_date, _ in planned]
+    assert coverage.covered("hamamatsu", every_xx, date(2022, 11, 1))
+    assert (
+        CoverageIndex()
+        .add_parquet_dataset(tmp_path)
+        .covered("hamamatsu", every_xx, date(2022, 11, 1))
+    )
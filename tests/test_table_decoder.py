@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from jma_scraper.core.html_to_dataframe import parse_html_to_df
+from jma_scraper.core.location_instances import HAMAMATSU_10Minutes_COLUMNS
+from jma_scraper.core.location_spec import LocationColumnType
+from jma_scraper.core.table_decoder import (
+    TEN_MINUTES_LAYOUTS,
+    QualityFlag,
+    decode_cell,
+    decode_table,
+)
+
+MAIN_LAYOUT = TEN_MINUTES_LAYOUTS[LocationColumnType.main]
+
+
+def test_decode_table_matches_read_html(hamamatsu_html):
+    decoded = decode_table(hamamatsu_html, MAIN_LAYOUT)
+    expected = parse_html_to_df(
+        hamamatsu_html, HAMAMATSU_10Minutes_COLUMNS.after_columns
+    )
+
+    assert decoded.values.dtype == np.float32
+    assert decoded.flags.dtype == np.uint8
+    assert decoded.values.shape == decoded.flags.shape == (144, 10)
+
+    df = decoded.to_frame()
+    assert list(df.columns) == HAMAMATSU_10Minutes_COLUMNS.after_columns
+    assert list(df["時分"]) == list(expected["時分"])
+    np.testing.assert_allclose(
+        df["気温(ºC)"].to_numpy(), expected["気温(ºC)"].to_numpy(), rtol=1e-6
+    )
+
+
+def test_decode_table_flags(hamamatsu_html):
+    decoded = decode_table(hamamatsu_html, MAIN_LAYOUT)
+    flags = decoded.flags_frame()
+    df = decoded.to_frame()
+
+    # 降水なしの "--" は 0mm
+    no_rain = flags["降水量(mm)"] == QualityFlag.no_phenomenon
+    assert no_rain.all()
+    assert (df.loc[no_rain, "降水量(mm)"] == 0).all()
+
+    # 夜間の日照時間は空欄
+    night = flags["日照時間(min)"] == QualityFlag.blank
+    assert night.any()
+    assert df.loc[night, "日照時間(min)"].isna().all()
+
+
+@pytest.mark.parametrize(
+    "text, expected_flag",
+    [
+        ("12.3]", QualityFlag.insufficient),
+        ("12.3 #", QualityFlag.dubious),
+        ("×", QualityFlag.missing),
+        ("///", QualityFlag.not_observed),
+    ],
+)
+def test_decode_cell_markers(text, expected_flag):
+    _, flag = decode_cell(text)
+    assert flag == expected_flag
+
+
+def test_decode_cell_direction():
+    assert decode_cell("北", is_direction=True) == (360.0, QualityFlag.normal)
+    assert decode_cell("静穏", is_direction=True) == (0.0, QualityFlag.normal)
+    with pytest.raises(ValueError, match="Unknown cell value"):
+        decode_cell("abc")
+
+
+def test_decode_table_rejects_other_layout(hamamatsu_html):
+    with pytest.raises(ValueError, match="layout"):
+        decode_table(hamamatsu_html, TEN_MINUTES_LAYOUTS[LocationColumnType.few])
+    assert isinstance(
+        decode_table(hamamatsu_html, MAIN_LAYOUT).to_frame(), pd.DataFrame
+    )
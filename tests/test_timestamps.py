@@ -0,0 +1,77 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from jma_scraper.core.timestamps import (
+    TIMESTAMP_INDEX,
+    jst_index,
+    jst_index_for_day,
+    jst_index_from_columns,
+    minutes_of_day,
+)
+from jma_scraper.usecase.backfill import PolitenessBudget, backfill
+from tests.helpers import TARGETS, FakeFetcher, ListWriter
+
+JST = timezone(timedelta(hours=9))
+
+
+def per_row(date_: date, hour_minutes: str) -> datetime:
+    """置き換える前の, 行ごとに変換するやり方"""
+    hour, minute = map(int, hour_minutes.split(":"))
+    day = datetime(date_.year, date_.month, date_.day, tzinfo=JST)
+    return day + timedelta(hours=hour, minutes=minute)
+
+
+def test_minutes_of_day_rejects_broken_values():
+    for broken in (["24:10"], ["12:60"], ["1:00"], ["ab:cd"], ["--"]):
+        with pytest.raises(ValueError):
+            minutes_of_day(broken)
+
+
+def test_index_matches_the_per_row_conversion(raw_df):
+    hour_minutes = raw_df.iloc[:, 0].astype(str).to_numpy()
+    index = jst_index_for_day(hour_minutes, date(2021, 12, 31))
+    assert str(index.tz) == "Asia/Tokyo"
+    assert list(index) == [per_row(date(2021, 12, 31), hm) for hm in hour_minutes]
+    assert index[-1] == pd.Timestamp("2022-01-01 00:00", tz="Asia/Tokyo")
+
+
+def test_many_days_in_one_call():
+    days = pd.date_range("2020-01-01", periods=1000).date
+    hour_minutes = [f"{m // 60:02}:{m % 60:02}" for m in range(10, 1441, 10)]
+    df = pd.DataFrame({"date": np.repeat(days, 144), "時分": hour_minutes * len(days)})
+    index = jst_index_from_columns(df)
+    assert len(index) == 144 * 1000
+    # 24:00 の繰り上がりで次の日の 00:10 とちょうど10分差になり, 重複しない
+    assert index.is_monotonic_increasing and index.is_unique
+    assert (np.diff(index.asi8) == 10 * 60 * 10**9).all()
+    assert index[0] == pd.Timestamp("2020-01-01 00:10", tz="Asia/Tokyo")
+
+
+def test_dates_and_minutes_should_match():
+    with pytest.raises(ValueError):
+        jst_index([date(2022, 1, 1)], [10, 20])
+    with pytest.raises(ValueError):
+        jst_index_from_columns(pd.DataFrame({"date": [date(2022, 1, 1)], "日": [1]}))
+
+
+def test_backfill_frames_have_jst_index(hamamatsu_html):
+    asyncio.run(
+        backfill(
+            TARGETS[:1],
+            date(2022, 1, 31),
+            date(2022, 1, 31),
+            fetcher=FakeFetcher(hamamatsu_html),
+            writer_factory=ListWriter,
+            budget=PolitenessBudget(0.0),
+        )
+    )
+    [(_, df)] = ListWriter.written
+    assert df.index.name == TIMESTAMP_INDEX
+    assert df.index[0] == pd.Timestamp("2022-01-31 00:10", tz="Asia/Tokyo")
+    assert df.index[-1] == pd.Timestamp("2022-02-01 00:00", tz="Asia/Tokyo")
+    # 時分の列は残るので, index を書かないCSVの中身は変わらない
+    assert df["時分"].iloc[-1] == "24:00"